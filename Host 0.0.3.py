@@ -7,124 +7,237 @@ import ssl
 import requests
 from datetime import datetime
 import time
+import sys
+import asyncio
+import itertools
+import secrets
+from collections import deque
+
+import conexiones
+import cola_ia
+import ia_cliente
+import protocolo
+from conexiones import ConexionAsync, ConexionHilo
+from almacenamiento import AlmacenJSON, AlmacenSQLite
+from protocolo import codificar_texto, decodificar_texto, LectorTramas, leer_trama_async, MAX_TRAMA_ENTRANTE, VERSION_AUTH, VERSION_SALAS_DELTA, VERSION_PRESENCIA
+from mensajes import Mensaje
+from registro import RegistroSesiones
+from cola_ia import ColaResumenes
+from ia_cliente import ClienteOllama, ServicioNoDisponible
 
 # --- Configuración Inicial ---
 usuarios_file = "usuarios.json"
 historial_file = "historial.json"
+historial_log_dir = "historial_log"
 pines_file = "pines.json"
+resumenes_file = "resumenes.json"
 salas_file = "salas.json"
+sqlite_file = "dchat.db"
+
+# Backend de persistencia: "json" (archivos completos) o "sqlite" (una fila por
+# registro). Se puede forzar con --json / --sqlite. Para pasar los datos existentes
+# a SQLite: python migrar_a_sqlite.py
+ALMACENAMIENTO = "json"
 
-# Configuración de OLLAMA
-OLLAMA_URL = "http://localhost:11434/api/generate"
+# Configuración de OLLAMA (ver ia_cliente.py)
+OLLAMA_URL = "http://localhost:11434"
 MODELO_IA = "llama3.2:3b"
 
+# Tras IA_FALLOS_PARA_ABRIR fallos seguidos los resúmenes fallan al instante
+# hasta que un sondeo (cada IA_INTERVALO_SONDEO s) vuelva a encontrar el servicio
+IA_FALLOS_PARA_ABRIR = 3
+IA_ESPERA_REINTENTO = 30
+IA_INTERVALO_SONDEO = 30
+
+# Resúmenes en segundo plano: la Raspberry atiende una inferencia a la vez y
+# a partir de IA_MAX_PENDIENTES resúmenes distintos en espera se responde "ocupado"
+IA_TRABAJADORES = 1
+IA_MAX_PENDIENTES = 8
+
+# Con streaming el resumen llega al cliente a medida que el modelo lo escribe
+# (tramas SUMMARY_CHUNK); sin él, completo al terminar
+IA_STREAMING = True
+
+# Resumen continuo por sala: se actualiza en segundo plano cada
+# RESUMEN_CADA_MENSAJES mensajes nuevos, o cuando la sala lleva
+# RESUMEN_INACTIVIDAD segundos sin mensajes y quedó algo sin resumir.
+# Cada actualización envía al modelo el resumen anterior y solo los mensajes
+# nuevos (como mucho RESUMEN_MAX_NUEVOS), y /resume responde con lo guardado.
+RESUMEN_CADA_MENSAJES = 30
+RESUMEN_INACTIVIDAD = 300
+RESUMEN_MAX_NUEVOS = 100
+
+# Dirección de escucha del servidor
+HOST_SERVIDOR = "192.168.1.100"
+PUERTO_SERVIDOR = 5000
+
+# Modo de atención de clientes: "hilos" (un hilo por conexión) o "asyncio"
+# (un único bucle de eventos). Se puede forzar con --hilos / --asyncio.
+MODO_SERVIDOR = "hilos"
+
+# Mensajes que se conservan por sala (en memoria y en disco)
+MAX_MENSAJES_SALA = 1000
+
+# Historial por páginas: al entrar a una sala se envían los últimos
+# PAGINA_HISTORIAL mensajes y el cliente pide los anteriores al desplazarse
+PAGINA_HISTORIAL = 50
+MAX_PAGINA_HISTORIAL = 200
+
+# Tickets TLS 1.3 que recibe cada cliente por conexión: con ellos reanuda la
+# sesión al reconectar (login tras registro, reintentos) sin handshake completo
+TLS_TICKETS = 2
+
+# Segundos que sigue valiendo el token de reanudación después de perder la
+# conexión: el cliente se reconecta solo y recibe únicamente lo que se perdió
+REANUDACION_TTL = 120
+
+# Compresión zlib de las tramas grandes (historial, miembros, resúmenes) para
+# los clientes que la piden al autenticarse. False la desactiva para todos
+COMPRESION = True
+
 # Verificación de certificados
 if not (os.path.exists("server.crt") and os.path.exists("server.key")):
     print("⚠️ ADVERTENCIA: No se encontraron 'server.crt' o 'server.key'.")
 
 # --- CACHÉ EN MEMORIA Y CONTROL DE CAMBIOS ---
 usuarios_cache = {}
-historial_cache = {}
+historial_cache = {}        # sala -> deque(maxlen=MAX_MENSAJES_SALA) de Mensaje
 pines_cache = {}
 salas_nombres_cache = []
-salas = {}
-clientes = {}
+resumenes_cache = {}        # sala -> {"texto", "hasta_id", "ts"}
+
+# Salas con sus miembros y sesiones conectadas (ver registro.py)
+registro = RegistroSesiones()
 
-# Banderas de cambios pendientes
+# Backend de persistencia (se crea en inicializar_cache)
+almacen = None
+
+# Generador de ids de mensaje (continúa desde el último persistido)
+ids_mensajes = itertools.count(1)
+
+# Banderas de cambios pendientes ("historial" solo marca cambios de estructura,
+# como borrar una sala: los mensajes van al almacén en cuanto llegan)
 cambios_pendientes = {
     "usuarios": False,
     "historial": False,
     "pines": False,
-    "salas": False
+    "salas": False,
+    "resumenes": False
 }
 
-# Lock para operaciones thread-safe
-cache_lock = threading.Lock()
+# Claves modificadas desde el último guardado (el backend SQLite solo escribe esas filas)
+usuarios_modificados = set()
+pines_modificados = set()
+resumenes_modificados = set()
+
+# Un lock por área: un mensaje en una sala no espera a un login ni a un pin
+usuarios_lock = threading.Lock()      # usuarios_cache, usuarios_modificados
+historial_lock = threading.Lock()     # historial_cache, versiones_historial, ids_mensajes
+pines_lock = threading.Lock()         # pines_cache, pines_modificados
+salas_lock = threading.Lock()         # salas_nombres_cache
+resumenes_lock = threading.Lock()     # resumenes_cache, resumenes_modificados, sin_resumir, ultima_actividad
+
+# Mensajes de chat desde la última actualización lanzada y hora del último, por sala
+sin_resumir = {}
+ultima_actividad = {}
+
+# Página inicial de historial ya codificada (trama HISTORY_BATCH) por sala.
+# Cada mensaje nuevo o borrado de sala incrementa la versión de la sala y
+# deja obsoleta la trama guardada; mientras no cambie, todos la comparten.
+versiones_historial = {}        # sala -> versión
+historial_serializado = {}      # sala -> (versión, {comprimida: trama})
+historial_serializado_lock = threading.Lock()   # una sola serialización a la vez
 
 # --- INICIALIZACIÓN DE CACHÉ ---
-def inicializar_cache():
-    """Carga todos los datos en memoria al iniciar"""
-    global usuarios_cache, historial_cache, pines_cache, salas_nombres_cache, salas
+def crear_almacen(tipo):
+    """Instancia el backend de persistencia elegido"""
+    if tipo == "sqlite":
+        return AlmacenSQLite(sqlite_file, max_por_sala=MAX_MENSAJES_SALA)
+    return AlmacenJSON(usuarios_file, salas_file, pines_file, historial_file, historial_log_dir,
+                       max_por_sala=MAX_MENSAJES_SALA, resumenes_file=resumenes_file)
+
+def inicializar_cache(tipo_almacen=ALMACENAMIENTO):
+    """Carga los datos en memoria al iniciar (con SQLite, usuarios e historial se cargan bajo demanda)"""
+    global usuarios_cache, historial_cache, pines_cache, salas_nombres_cache, resumenes_cache, registro, almacen, ids_mensajes
+    almacen = crear_almacen(tipo_almacen)
     
     # Cargar usuarios
-    if os.path.exists(usuarios_file):
-        try:
-            with open(usuarios_file, "r") as f:
-                usuarios_cache = json.load(f)
-        except:
-            usuarios_cache = {}
-    else:
-        usuarios_cache = {}
-        guardar_cache_usuarios()
+    usuarios_cache = {}
+    if not almacen.carga_perezosa:
+        datos = almacen.cargar_usuarios()
+        if datos is None:
+            guardar_cache_usuarios()
+        else:
+            usuarios_cache = datos
     
     # Cargar nombres de salas
-    if os.path.exists(salas_file):
-        try:
-            with open(salas_file, "r") as f:
-                salas_nombres_cache = json.load(f)
-        except:
-            salas_nombres_cache = ["General", "Equipo 1", "Equipo 2"]
-    else:
+    salas_nombres_cache = almacen.cargar_salas()
+    if salas_nombres_cache is None:
         salas_nombres_cache = ["General", "Equipo 1", "Equipo 2"]
         guardar_cache_salas()
     
     # Inicializar estructura de salas
-    salas = {nombre: [] for nombre in salas_nombres_cache}
+    registro = RegistroSesiones(salas_nombres_cache)
     
-    # Cargar historial
-    if os.path.exists(historial_file):
-        try:
-            with open(historial_file, "r") as f:
-                historial_cache = json.load(f)
-        except:
-            historial_cache = {s: [] for s in salas.keys()}
-    else:
-        historial_cache = {s: [] for s in salas.keys()}
-        guardar_cache_historial()
+    # Cargar historial (JSON: snapshot + reproducción de los logs)
+    historial_cache = {s: deque(m, maxlen=MAX_MENSAJES_SALA) for s, m in almacen.cargar_historial().items()}
+    if not almacen.carga_perezosa:
+        for s in registro.nombres_salas():
+            historial_cache.setdefault(s, deque(maxlen=MAX_MENSAJES_SALA))
+    ids_mensajes = itertools.count(almacen.ultimo_id() + 1)
+    # Compactar de entrada: el snapshot queda al día y los logs empiezan limpios
+    # (un log cortado por una caída no debe recibir más líneas detrás)
+    compactar_historial()
     
     # Cargar pines
-    if os.path.exists(pines_file):
-        try:
-            with open(pines_file, "r") as f:
-                pines_cache = json.load(f)
-        except:
-            pines_cache = {s: "" for s in salas.keys()}
-    else:
-        pines_cache = {s: "" for s in salas.keys()}
+    pines_cache = almacen.cargar_pines()
+    if pines_cache is None:
+        pines_cache = {s: "" for s in registro.nombres_salas()}
+        pines_modificados.update(pines_cache.keys())
         guardar_cache_pines()
     
-    print("✅ Caché en memoria inicializado.")
+    # Cargar resúmenes de IA
+    resumenes_cache = almacen.cargar_resumenes() or {}
+    
+    print(f"✅ Caché en memoria inicializado (almacenamiento: {tipo_almacen}).")
 
 # --- FUNCIONES DE GUARDADO A DISCO ---
 def guardar_cache_usuarios():
-    """Escribe el caché de usuarios a disco"""
+    """Escribe a disco los usuarios modificados"""
     try:
-        with open(usuarios_file, "w") as f:
-            json.dump(usuarios_cache, f, indent=4)
+        almacen.guardar_usuarios(usuarios_cache, usuarios_modificados)
+        usuarios_modificados.clear()
     except Exception as e:
         print(f"Error guardando usuarios: {e}")
 
-def guardar_cache_historial():
-    """Escribe el caché de historial a disco"""
+def compactar_historial():
+    """Compacta el historial persistido (snapshot + logs, o recorte en SQLite).
+    Toma historial_lock solo lo imprescindible: no llamar con el lock tomado"""
     try:
-        with open(historial_file, "w") as f:
-            json.dump(historial_cache, f, indent=4)
+        almacen.compactar(historial_lock, lambda: {k: list(v) for k, v in historial_cache.items()})
     except Exception as e:
-        print(f"Error guardando historial: {e}")
+        print(f"Error compactando historial: {e}")
 
 def guardar_cache_pines():
-    """Escribe el caché de pines a disco"""
+    """Escribe a disco los pines modificados"""
     try:
-        with open(pines_file, "w") as f:
-            json.dump(pines_cache, f, indent=4)
+        almacen.guardar_pines(pines_cache, pines_modificados)
+        pines_modificados.clear()
     except Exception as e:
         print(f"Error guardando pines: {e}")
 
+def guardar_cache_resumenes():
+    """Escribe a disco los resúmenes modificados"""
+    try:
+        almacen.guardar_resumenes(resumenes_cache, resumenes_modificados)
+        resumenes_modificados.clear()
+    except Exception as e:
+        print(f"Error guardando resúmenes: {e}")
+
 def guardar_cache_salas():
-    """Escribe el caché de nombres de salas a disco"""
+    """Escribe a disco la lista de salas"""
     try:
-        with open(salas_file, "w") as f:
-            json.dump(salas_nombres_cache, f, indent=4)
+        almacen.guardar_salas(salas_nombres_cache)
     except Exception as e:
         print(f"Error guardando salas: {e}")
 
@@ -133,46 +246,84 @@ def hilo_autosave():
     """Hilo en segundo plano que guarda cambios cada 60 segundos"""
     while True:
         time.sleep(60)
-        with cache_lock:
+        with usuarios_lock:
             if cambios_pendientes["usuarios"]:
                 guardar_cache_usuarios()
                 cambios_pendientes["usuarios"] = False
                 print("💾 Usuarios guardados.")
-            if cambios_pendientes["historial"]:
-                guardar_cache_historial()
-                cambios_pendientes["historial"] = False
-                print("💾 Historial guardado.")
+        with pines_lock:
             if cambios_pendientes["pines"]:
                 guardar_cache_pines()
                 cambios_pendientes["pines"] = False
                 print("💾 Pines guardados.")
+        with salas_lock:
             if cambios_pendientes["salas"]:
                 guardar_cache_salas()
                 cambios_pendientes["salas"] = False
                 print("💾 Salas guardadas.")
+        with resumenes_lock:
+            if cambios_pendientes["resumenes"]:
+                guardar_cache_resumenes()
+                cambios_pendientes["resumenes"] = False
+                print("💾 Resúmenes guardados.")
+        with historial_lock:
+            compactar = cambios_pendientes["historial"] or almacen.necesita_compactar()
+            cambios_pendientes["historial"] = False
+        if compactar:
+            compactar_historial()
+            print("💾 Historial compactado.")
 
 # --- FUNCIONES DE ACCESO A USUARIOS ---
+def _usuario(user):
+    """Datos del usuario en caché, leyéndolos del almacén si hace falta. Llamar con usuarios_lock"""
+    if user not in usuarios_cache and almacen.carga_perezosa:
+        datos = almacen.cargar_usuario(user)
+        if datos is not None:
+            usuarios_cache[user] = datos
+    return usuarios_cache.get(user)
+
+def obtener_usuario(user):
+    """Copia de los datos de un usuario, o None si no existe"""
+    with usuarios_lock:
+        datos = _usuario(user)
+        return dict(datos) if datos else None
+
+def actualizar_usuario(user, campos):
+    """Modifica campos de un usuario existente y marca solo esa fila como pendiente"""
+    with usuarios_lock:
+        datos = _usuario(user)
+        if datos is None:
+            return False
+        datos.update(campos)
+        usuarios_modificados.add(user)
+        cambios_pendientes["usuarios"] = True
+        return True
+
 def cargar_usuarios():
-    """Retorna el caché de usuarios"""
-    with cache_lock:
-        return usuarios_cache.copy()
+    """Retorna una copia de todos los usuarios"""
+    with usuarios_lock:
+        if almacen.carga_perezosa:
+            for user, datos in almacen.cargar_usuarios().items():
+                usuarios_cache.setdefault(user, datos)
+        return {u: dict(d) for u, d in usuarios_cache.items()}
 
 def guardar_usuarios(data):
     """Modifica el caché y marca como pendiente de guardar"""
-    with cache_lock:
+    with usuarios_lock:
         usuarios_cache.clear()
         usuarios_cache.update(data)
+        usuarios_modificados.update(data.keys())
         cambios_pendientes["usuarios"] = True
 
 # --- FUNCIONES DE GESTIÓN DE SALAS ---
 def cargar_nombres_salas():
     """Retorna el caché de nombres de salas"""
-    with cache_lock:
+    with salas_lock:
         return salas_nombres_cache.copy()
 
 def guardar_nombres_salas(lista_nombres):
     """Modifica el caché de salas y marca como pendiente"""
-    with cache_lock:
+    with salas_lock:
         salas_nombres_cache.clear()
         salas_nombres_cache.extend(lista_nombres)
         cambios_pendientes["salas"] = True
@@ -180,159 +331,474 @@ def guardar_nombres_salas(lista_nombres):
 # --- FUNCIONES DE HISTORIAL ---
 def cargar_historial():
     """Retorna el caché de historial"""
-    with cache_lock:
-        return {k: v.copy() for k, v in historial_cache.items()}
+    with historial_lock:
+        return {k: list(v) for k, v in historial_cache.items()}
 
-def registrar_mensaje_historial(sala, mensaje_formateado):
-    """Registra mensaje en el caché sin escribir a disco inmediatamente"""
-    if sala not in salas:
-        return
-    
-    with cache_lock:
-        if sala not in historial_cache:
-            historial_cache[sala] = []
-        
-        historial_cache[sala].append(mensaje_formateado)
-        
-        # Limitar a 1000 mensajes por sala
-        if len(historial_cache[sala]) > 1000:
-            historial_cache[sala] = historial_cache[sala][-1000:]
-        
-        cambios_pendientes["historial"] = True
+def _mensajes_sala(sala):
+    """Buffer circular de la sala, cargándolo del almacén la primera vez. Llamar con historial_lock"""
+    if sala not in historial_cache:
+        historial_cache[sala] = deque(almacen.cargar_historial_sala(sala), maxlen=MAX_MENSAJES_SALA)
+    return historial_cache[sala]
 
-def enviar_historial_a_usuario(conn, sala):
-    """Envía el historial del caché al usuario en un solo mensaje JSON"""
-    with cache_lock:
-        msgs = historial_cache.get(sala, [])
-    
-    if not msgs:
-        return
+def registrar_mensaje_historial(sala, texto, autor=None, rol=None):
+    """Registra el mensaje en el caché y lo pasa al almacén (escritura en grupo).
+    Retorna el Mensaje creado, o None si la sala no existe"""
+    if not registro.existe_sala(sala):
+        return None
     
-    # Serializar lista de mensajes a JSON
+    with historial_lock:
+        mensaje = Mensaje.nuevo(next(ids_mensajes), texto, autor, rol)
+        # El deque descarta solo el más antiguo al llegar a MAX_MENSAJES_SALA
+        _mensajes_sala(sala).append(mensaje)
+        versiones_historial[sala] = versiones_historial.get(sala, 0) + 1
+        almacen.agregar_mensaje(sala, mensaje)
+    return mensaje
+
+def _pagina_historial(registros, limite, antes=None, desde=None):
+    """Recorre el buffer de la sala desde el final y toma hasta `limite` mensajes
+    con id < antes y/o id > desde. Retorna (mensajes en orden, hay_mas). Llamar con historial_lock"""
+    pagina = []
+    hay_mas = False
+    for m in reversed(registros):
+        if antes is not None and m.id >= antes:
+            continue
+        if (desde is not None and m.id <= desde) or len(pagina) == limite:
+            hay_mas = True
+            break
+        pagina.append(m)
+    pagina.reverse()
+    return pagina, hay_mas
+
+def _codificar_historial(sala, modo, pagina, hay_mas, comprimir=False):
+    """Trama HISTORY_BATCH lista para enviar"""
+    # El formato de texto se arma solo aquí, al salir por la red
+    msgs = [m.para_envio() for m in pagina]
     historial_json = json.dumps({
         "sala": sala,
+        "modo": modo,
         "mensajes": msgs,
+        "hay_mas": hay_mas,
         "total": len(msgs)
     })
-    
-    # Enviar en un solo mensaje con prefijo HISTORY_BATCH
-    comando = f"HISTORY_BATCH:{historial_json}"
-    enviar_privado(conn, comando)
+    return codificar_texto(f"HISTORY_BATCH:{historial_json}", comprimir)
 
-# --- LÓGICA DE INTELIGENCIA ARTIFICIAL ---
-def generar_resumen_ollama(sala):
-    """Lee el historial del caché y solicita un resumen a Llama 3.2"""
-    with cache_lock:
-        mensajes = historial_cache.get(sala, [])
-    
-    if not mensajes:
-        return "No hay suficientes mensajes para generar un resumen."
+def _trama_historial_inicial(sala, comprimir=False):
+    """Trama de la página inicial de la sala, serializada (y comprimida) una vez
+    por versión"""
+    with historial_lock:
+        guardada = historial_serializado.get(sala)
+        if guardada and guardada[0] == versiones_historial.get(sala, 0) and comprimir in guardada[1]:
+            return guardada[1][comprimir]
     
-    ultimos_mensajes = mensajes[-20:]
-    texto_conversacion = "\n".join(ultimos_mensajes)
+    with historial_serializado_lock:
+        with historial_lock:
+            # Otro hilo pudo construirla mientras se esperaba el lock
+            version = versiones_historial.get(sala, 0)
+            guardada = historial_serializado.get(sala)
+            if guardada and guardada[0] == version:
+                if comprimir in guardada[1]:
+                    return guardada[1][comprimir]
+                variantes = guardada[1]
+            else:
+                variantes = {}
+            pagina, hay_mas = _pagina_historial(_mensajes_sala(sala), PAGINA_HISTORIAL)
+        # Los Mensaje no cambian: se serializan fuera de historial_lock
+        trama = variantes[comprimir] = _codificar_historial(sala, "ultimos", pagina, hay_mas, comprimir)
+        with historial_lock:
+            historial_serializado[sala] = (version, variantes)
+    return trama
+
+def enviar_historial_a_usuario(conn, sala, ultimos=PAGINA_HISTORIAL, antes=None, desde=None):
+    """Envía una página del historial: los últimos mensajes, los anteriores a
+    un id (desplazamiento hacia arriba) o todos los posteriores a un id (delta)"""
+    if ultimos == PAGINA_HISTORIAL and antes is None and desde is None:
+        # Lo que recibe todo el que entra a la sala: se reutiliza la trama ya armada
+        trama = _trama_historial_inicial(sala, comprime(conn))
+        try:
+            conn.sendall(trama)
+        except:
+            pass
+        return
     
-    prompt_sistema = (
-        f"Eres un asistente de secretaría técnica. Resume la siguiente conversación del chat de la sala '{sala}'. "
-        "Ignora los mensajes de sistema como [ENTRÓ], [SALIÓ]. "
-        "Enumera los puntos clave y decisiones. Sé breve y profesional en español."
-    )
+    with historial_lock:
+        registros = _mensajes_sala(sala)
+        if (desde is not None and registros and registros[0].id > desde
+                and len(registros) == registros.maxlen):
+            # El cliente quedó más atrás de lo que se conserva: recibe la última página
+            desde = None
+        limite = len(registros) if desde is not None else max(1, min(ultimos, MAX_PAGINA_HISTORIAL))
+        pagina, hay_mas = _pagina_historial(registros, limite, antes, desde)
     
-    payload = {
-        "model": MODELO_IA,
-        "prompt": f"{prompt_sistema}\n\nConversación:\n{texto_conversacion}",
-        "stream": False,
-        "keep_alive": 3600
-    }
+    if desde is not None:
+        modo = "desde"
+    elif antes is not None:
+        modo = "antes"
+    else:
+        modo = "ultimos"
     
+    trama = _codificar_historial(sala, modo, pagina, hay_mas, comprime(conn))
+    try:
+        conn.sendall(trama)
+    except:
+        pass
+
+# --- LÓGICA DE INTELIGENCIA ARTIFICIAL ---
+def mensajes_para_resumen(sala, hasta_id):
+    """Copia de los mensajes de la sala posteriores a hasta_id (como mucho RESUMEN_MAX_NUEVOS)"""
+    with historial_lock:
+        nuevos = []
+        for m in reversed(_mensajes_sala(sala)):
+            if m.id <= hasta_id or len(nuevos) == RESUMEN_MAX_NUEVOS:
+                break
+            nuevos.append(m)
+    nuevos.reverse()
+    return nuevos
+
+def generar_resumen_ollama(sala, resumen_previo, mensajes, al_avanzar):
+    """Solicita a Llama 3.2 un resumen de los mensajes (o que incorpore los mensajes
+    nuevos al resumen previo), pasando cada fragmento a al_avanzar a medida que llega.
+    Retorna el texto completo; lanza excepción si falla"""
+    texto_conversacion = "\n".join(m.renderizar() for m in mensajes)
+
+    if resumen_previo:
+        prompt_sistema = (
+            f"Eres un asistente de secretaría técnica. Este es el resumen actual del chat de la sala '{sala}'. "
+            "Actualízalo incorporando los mensajes nuevos y conserva los puntos clave y decisiones anteriores que sigan vigentes. "
+            "Ignora los mensajes de sistema como [ENTRÓ], [SALIÓ]. Sé breve y profesional en español."
+        )
+        prompt = f"{prompt_sistema}\n\nResumen actual:\n{resumen_previo}\n\nMensajes nuevos:\n{texto_conversacion}"
+    else:
+        prompt_sistema = (
+            f"Eres un asistente de secretaría técnica. Resume la siguiente conversación del chat de la sala '{sala}'. "
+            "Ignora los mensajes de sistema como [ENTRÓ], [SALIÓ]. "
+            "Enumera los puntos clave y decisiones. Sé breve y profesional en español."
+        )
+        prompt = f"{prompt_sistema}\n\nConversación:\n{texto_conversacion}"
+
+    print(f"🤖 [IA] Actualizando resumen de {sala} ({len(mensajes)} mensajes nuevos)...")
+    texto = cliente_ia.generar(prompt, al_avanzar, stream=IA_STREAMING)
+    if not texto:
+        texto = "La IA no devolvió respuesta."
+        al_avanzar(texto)
+    return texto
+
+def actualizar_resumen_sala(sala, resumen_previo, mensajes, al_avanzar):
+    """Trabajo de la cola: genera el resumen y lo guarda como resumen vigente de la sala"""
     try:
-        print(f"🤖 [IA] Generando resumen para {sala}...")
-        response = requests.post(OLLAMA_URL, json=payload, timeout=90)
-        response.raise_for_status()
-        resultado = response.json()
-        return resultado.get("response", "La IA no devolvió respuesta.")
-    except requests.exceptions.ConnectionError:
+        texto = generar_resumen_ollama(sala, resumen_previo, mensajes, al_avanzar)
+    except Exception:
+        # Los mensajes siguen sin resumir: la revisión por inactividad lo reintenta
+        with resumenes_lock:
+            sin_resumir[sala] = sin_resumir.get(sala, 0) + len(mensajes)
+        raise
+    with resumenes_lock:
+        actual = resumenes_cache.get(sala)
+        # Una actualización más reciente pudo terminar antes que esta
+        if registro.existe_sala(sala) and (actual is None or actual["hasta_id"] < mensajes[-1].id):
+            resumenes_cache[sala] = {"texto": texto, "hasta_id": mensajes[-1].id, "ts": time.time()}
+            resumenes_modificados.add(sala)
+            cambios_pendientes["resumenes"] = True
+    return texto
+
+def describir_error_ia(e):
+    """Texto para el usuario cuando falla un resumen"""
+    if isinstance(e, ServicioNoDisponible):
+        return "⏳ El servicio de IA no responde en este momento. Intenta de nuevo en unos minutos."
+    if isinstance(e, requests.exceptions.ConnectionError):
         return "❌ Error: El servicio de IA (Ollama) no está corriendo en el servidor."
-    except Exception as e:
-        return f"❌ Error generando resumen: {str(e)}"
+    return f"❌ Error generando resumen: {str(e)}"
+
+cliente_ia = ClienteOllama(OLLAMA_URL, MODELO_IA, fallos_para_abrir=IA_FALLOS_PARA_ABRIR,
+                           espera_reintento=IA_ESPERA_REINTENTO, intervalo_sondeo=IA_INTERVALO_SONDEO)
+
+cola_resumenes = ColaResumenes(actualizar_resumen_sala, describir_error_ia,
+                               trabajadores=IA_TRABAJADORES, max_pendientes=IA_MAX_PENDIENTES)
+
+def _sin_destinatario(evento, texto):
+    """Actualizaciones en segundo plano: nadie espera el texto"""
+    pass
+
+def actualizar_resumen(sala, entregar=_sin_destinatario):
+    """Encola la actualización del resumen de la sala con los mensajes posteriores
+    al guardado. Retorna el estado de la cola, o None si no hay nada nuevo"""
+    with resumenes_lock:
+        previo = resumenes_cache.get(sala)
+        sin_resumir[sala] = 0
+    mensajes = mensajes_para_resumen(sala, previo["hasta_id"] if previo else 0)
+    if not mensajes:
+        return None
+    # Mismo último mensaje = misma actualización: se comparte inferencia y resultado
+    clave = (sala, mensajes[-1].id)
+    estado = cola_resumenes.solicitar(clave, (sala, previo["texto"] if previo else None, mensajes), entregar)
+    if estado == "ocupado":
+        # Queda pendiente para la próxima revisión por inactividad
+        with resumenes_lock:
+            sin_resumir[sala] = sin_resumir.get(sala, 0) + len(mensajes)
+    return estado
+
+def anotar_mensaje_resumen(sala):
+    """Cuenta un mensaje de chat y lanza la actualización al llegar a RESUMEN_CADA_MENSAJES"""
+    with resumenes_lock:
+        sin_resumir[sala] = sin_resumir.get(sala, 0) + 1
+        ultima_actividad[sala] = time.time()
+        lanzar = sin_resumir[sala] >= RESUMEN_CADA_MENSAJES
+    # Con la IA caída el contador sigue creciendo y la revisión por inactividad lo retoma
+    if lanzar and cliente_ia.disponible():
+        actualizar_resumen(sala)
+
+def hilo_resumenes():
+    """Actualiza el resumen de las salas que quedaron inactivas con mensajes sin resumir"""
+    while True:
+        time.sleep(min(30, RESUMEN_INACTIVIDAD))
+        ahora = time.time()
+        with resumenes_lock:
+            salas = [s for s, n in sin_resumir.items()
+                     if n and ahora - ultima_actividad.get(s, 0) >= RESUMEN_INACTIVIDAD]
+        if not cliente_ia.disponible():
+            continue
+        for sala in salas:
+            if registro.existe_sala(sala):
+                actualizar_resumen(sala)
+
+def solicitar_resumen(conn, sala, forzar=False):
+    """Envía el resumen guardado de la sala. Si no hay ninguno, o con forzar=True
+    (/resume full), encola antes la actualización y el resultado llega al terminar"""
+    def entregar(evento, texto):
+        # SUMMARY_START abre el resumen en el cliente, cada SUMMARY_CHUNK se
+        # agrega tal cual y SUMMARY_END lo cierra (con el error si lo hubo)
+        if evento == "inicio":
+            if texto == "encolado":
+                enviar_privado(conn, "🤖 La IA está leyendo el historial... esto puede tardar unos segundos.")
+            elif texto == "agrupado":
+                enviar_privado(conn, "🤖 Ya se está generando un resumen de esta sala.")
+            enviar_privado(conn, f"SUMMARY_START:{json.dumps({'sala': sala})}")
+        elif evento == "parte":
+            enviar_privado(conn, f"SUMMARY_CHUNK:{texto}")
+        elif evento == "fin":
+            enviar_privado(conn, f"SUMMARY_END:{json.dumps({'sala': sala})}")
+        else:
+            enviar_privado(conn, f"SUMMARY_END:{json.dumps({'sala': sala, 'error': texto})}")
+
+    with resumenes_lock:
+        guardado = resumenes_cache.get(sala)
+        pendientes = sin_resumir.get(sala, 0)
+
+    if (guardado is None or forzar) and not cliente_ia.disponible():
+        # Sin servicio de IA se responde al instante con lo que haya
+        if guardado is None:
+            enviar_privado(conn, describir_error_ia(ServicioNoDisponible()))
+            return
+        forzar = False
+
+    if guardado is None or forzar:
+        estado = actualizar_resumen(sala, entregar)
+        if estado == "ocupado":
+            enviar_privado(conn, "⏳ La IA está ocupada con otros resúmenes. Intenta de nuevo en unos minutos.")
+            return
+        if estado is not None:
+            return
+        if guardado is None:
+            enviar_privado(conn, "No hay suficientes mensajes para generar un resumen.")
+            return
+        pendientes = 0
+
+    # Respuesta inmediata: el resumen ya está hecho
+    entregar("inicio", "guardado")
+    entregar("parte", guardado["texto"])
+    entregar("fin", guardado["texto"])
+    if pendientes:
+        enviar_privado(conn, f"ℹ️ Mensajes sin resumir: {pendientes}. Usa /resume full para actualizar el resumen.")
 
 # --- FUNCIONES DE PINES ---
 def cargar_pines():
     """Retorna el caché de pines"""
-    with cache_lock:
+    with pines_lock:
         return pines_cache.copy()
 
 def guardar_pin(sala, mensaje):
     """Modifica el pin en el caché y marca como pendiente"""
-    with cache_lock:
+    with pines_lock:
         pines_cache[sala] = mensaje
+        pines_modificados.add(sala)
         cambios_pendientes["pines"] = True
 
 def broadcast_pin(sala, mensaje):
     """Difunde actualización de pin a todos en la sala"""
-    comando = f"PIN_UPDATE:{mensaje}"
-    if sala in salas:
-        for conn in salas[sala]:
-            try:
-                conn.send(comando.encode("utf-8"))
-            except:
-                pass
+    trama = codificar_texto(f"PIN_UPDATE:{mensaje}")
+    for conn in registro.miembros(sala):
+        try:
+            conn.sendall(trama)
+        except:
+            pass
 
 # --- Utilidades de Red ---
-def broadcast(sala, mensaje, remitente_conn=None):
+def broadcast(sala, mensaje, remitente_conn=None, autor=None, rol=None):
     """Difunde mensaje a todos en la sala"""
-    hora = datetime.now().strftime("%H:%M")
-    msg_final = f"[{hora}] {mensaje}"
-    registrar_mensaje_historial(sala, msg_final)
-    if sala not in salas:
+    nuevo = registrar_mensaje_historial(sala, mensaje, autor, rol)
+    if nuevo is None:
         return
-    for conn in list(salas[sala]):
-        if conn != remitente_conn:
-            try:
-                conn.send(msg_final.encode("utf-8"))
-            except:
-                remover_cliente(conn)
-
-def broadcast_lista_salas():
-    """Difunde lista de salas a todos los clientes"""
-    lista = list(salas.keys())
-    json_salas = json.dumps(lista)
-    msg = f"ROOMS_UPDATE:{json_salas}"
-    for conn in clientes.keys():
+    if autor is not None:
+        anotar_mensaje_resumen(sala)
+    texto = nuevo.renderizar()
+    # Los clientes con ids (protocolo 3) reciben MSG:<id>:<texto> para poder pedir
+    # solo lo posterior al reconectarse; cada forma se codifica una sola vez
+    tramas = {}
+    # Instantánea de los miembros: nadie la modifica mientras se recorre
+    for conn in registro.miembros(sala):
+        sesion = registro.sesion(conn)
+        ids = sesion is not None and sesion["ids"]
         try:
-            conn.send(msg.encode("utf-8"))
+            if conn != remitente_conn:
+                trama = tramas.get(ids)
+                if trama is None:
+                    trama = tramas[ids] = codificar_texto(f"MSG:{nuevo.id}:{texto}" if ids else texto)
+                conn.sendall(trama)
+            elif ids:
+                # El remitente ya lo mostró: solo necesita el id
+                conn.sendall(codificar_texto(f"MSG_ID:{nuevo.id}"))
+        except:
+            remover_cliente(conn)
+
+def broadcast_cambio_sala(evento, sala):
+    """Difunde una sala creada (ROOM_ADDED) o borrada (ROOM_REMOVED). Los clientes
+    anteriores a VERSION_SALAS_DELTA reciben la lista completa como antes"""
+    trama_delta = codificar_texto(f"{evento}:{json.dumps({'sala': sala})}")
+    trama_lista = None
+    for conn, datos in registro.sesiones():
+        try:
+            if datos["version"] >= VERSION_SALAS_DELTA:
+                conn.sendall(trama_delta)
+            else:
+                if trama_lista is None:
+                    trama_lista = codificar_texto(f"ROOMS_UPDATE:{json.dumps(registro.nombres_salas())}")
+                conn.sendall(trama_lista)
+        except:
+            pass
+
+def difundir_presencia(ev, datos, excepto=None, **campos):
+    """Envía un cambio de presencia (entro, salio, movido, rol, silencio) a los clientes suscritos"""
+    trama = codificar_texto(f"PRESENCE_DELTA:{json.dumps({'ev': ev, 'id': datos['id'], **campos})}")
+    for conn in registro.suscritos():
+        if conn is excepto:
+            continue
+        try:
+            conn.sendall(trama)
         except:
             pass
 
+def comprime(conn):
+    """True si el cliente negoció compresión zlib"""
+    datos = registro.sesion(conn)
+    return datos is not None and datos["zlib"]
+
 def enviar_privado(conn, mensaje):
     """Envía mensaje privado a un cliente"""
     try:
-        conn.send(mensaje.encode("utf-8"))
+        conn.sendall(codificar_texto(mensaje, comprime(conn)))
     except:
         pass
 
-def remover_cliente(conn):
-    """Remueve cliente de todas las estructuras"""
-    if conn in clientes:
-        alias = clientes[conn]["alias"]
-        sala = clientes[conn]["sala"]
-        if sala in salas and conn in salas[sala]:
-            salas[sala].remove(conn)
-        del clientes[conn]
+def remover_cliente(conn, reanudable=True):
+    """Remueve cliente de todas las estructuras. Con reanudable=False (kick, ban)
+    su token de reanudación deja de valer"""
+    datos = registro.baja(conn)
+    if datos is not None:
+        difundir_presencia("salio", datos)
+        if datos["token"]:
+            soltar_token(datos["token"], conn, reanudable)
     try:
         conn.close()
     except:
         pass
 
+def generar_estadisticas():
+    """Resumen de colas de salida por cliente y expulsiones por lentitud"""
+    colas = []
+    for c, datos in registro.sesiones():
+        mensajes, pendientes = c.profundidad()
+        colas.append((pendientes, mensajes, datos["alias"]))
+    colas.sort(reverse=True)
+    st = conexiones.estadisticas
+    ia = cola_ia.estadisticas
+    ic = ia_cliente.estadisticas
+    exitosas = ic["llamadas"] - ic["fallidas"]
+    latencia_media = ic["latencia_total"] / exitosas if exitosas else 0.0
+    lineas = [
+        "📊 --- ESTADÍSTICAS DEL SERVIDOR ---",
+        f"Clientes conectados: {len(colas)}",
+        f"En cola total: {sum(m for _, m, _ in colas)} mensajes / {sum(b for b, _, _ in colas)} bytes",
+        f"Expulsados por lentitud: {st['expulsados_lentos']} "
+        f"({st['mensajes_descartados']} mensajes, {st['bytes_descartados']} bytes descartados)",
+        f"Resúmenes IA: {ia['generados']} generados, {ia['desde_cache']} desde caché, "
+        f"{ia['agrupados']} agrupados, {ia['rechazados']} rechazados, {ia['errores']} con error "
+        f"({cola_resumenes.pendientes()} en curso)",
+        f"Servicio IA: {cliente_ia.estado()}, {ic['llamadas']} llamadas ({ic['fallidas']} fallidas, "
+        f"{ic['rechazadas']} rechazadas sin conectar), latencia media {latencia_media:.1f} s, "
+        f"última {ic['latencia_ultima']:.1f} s a {ic['tokens_por_seg_ultima']:.1f} tok/s"
+    ]
+    zs = protocolo.estadisticas
+    if zs["tramas_comprimidas"]:
+        ahorro = 100 * (1 - zs["bytes_comprimidos"] / zs["bytes_originales"])
+        lineas.append(f"Compresión: {zs['tramas_comprimidas']} tramas, {zs['bytes_originales']} → "
+                      f"{zs['bytes_comprimidos']} bytes ({ahorro:.0f}% ahorrado), "
+                      f"{zs['segundos_cpu'] * 1000:.1f} ms de CPU")
+    if contexto_tls is not None:
+        tls = contexto_tls.session_stats()
+        lineas.append(f"Handshakes TLS: {tls['accept_good']} completados, {tls['hits']} reanudados")
+    for pendientes, mensajes, alias in colas[:5]:
+        if mensajes:
+            lineas.append(f"  • {alias}: {mensajes} mensajes / {pendientes} bytes en cola")
+    return "\n".join(lineas)
+
+# --- Reanudación de sesiones ---
+# Cada login con protocolo 3 recibe un token. Mientras la conexión vive no
+# vence; al caerse vale REANUDACION_TTL segundos más. Canjearlo (op "reanudar")
+# lo consume y entrega uno nuevo.
+tokens_reanudacion = {}     # token -> {"usuario", "conn", "expira" (None mientras la conexión siga viva)}
+tokens_lock = threading.Lock()
+
+def emitir_token(conn, user):
+    """Token nuevo ligado a la conexión. De paso descarta los vencidos"""
+    token = secrets.token_urlsafe(24)
+    ahora = time.time()
+    with tokens_lock:
+        vencidos = [t for t, d in tokens_reanudacion.items() if d["expira"] is not None and d["expira"] < ahora]
+        for t in vencidos:
+            del tokens_reanudacion[t]
+        tokens_reanudacion[token] = {"usuario": user, "conn": conn, "expira": None}
+    return token
+
+def soltar_token(token, conn, reanudable):
+    """La conexión del token se cerró: empieza a vencer, o se anula"""
+    with tokens_lock:
+        datos = tokens_reanudacion.get(token)
+        if datos is None or datos["conn"] is not conn:
+            return
+        if reanudable:
+            datos["expira"] = time.time() + REANUDACION_TTL
+        else:
+            del tokens_reanudacion[token]
+
+def canjear_token(token, user):
+    """Consume el token. Retorna la conexión anterior (quizá todavía registrada), o None si no vale"""
+    with tokens_lock:
+        datos = tokens_reanudacion.get(token)
+        if datos is None or datos["usuario"] != user:
+            return None
+        del tokens_reanudacion[token]
+    if datos["expira"] is not None and datos["expira"] < time.time():
+        return None
+    return datos["conn"]
+
 # --- Auth ---
-def registrar_usuario(conn, user, hashed_pwd, pregunta, hashed_resp):
-    """Registra usuario en el caché"""
-    with cache_lock:
-        if user in usuarios_cache:
-            conn.send("Usuario ya existe.\n".encode("utf-8"))
-            return False
+def registrar_usuario(user, hashed_pwd, pregunta, hashed_resp):
+    """Registra usuario en el caché. Retorna (éxito, texto para el cliente)"""
+    with usuarios_lock:
+        if _usuario(user) is not None:
+            return False, "Usuario ya existe.\n"
         
         rol_inicial = "estudiante"
-        if len(usuarios_cache) == 0:
+        if len(usuarios_cache) == 0 and almacen.contar_usuarios() == 0:
             rol_inicial = "admin"
         
         usuarios_cache[user] = {
@@ -342,16 +808,16 @@ def registrar_usuario(conn, user, hashed_pwd, pregunta, hashed_resp):
             "pregunta": pregunta,
             "resp_hash": hashed_resp
         }
+        usuarios_modificados.add(user)
         cambios_pendientes["usuarios"] = True
     
-    conn.send(f"Registro exitoso. Rol asignado: {rol_inicial.upper()}.\n".encode("utf-8"))
-    return True
+    return True, f"Registro exitoso. Rol asignado: {rol_inicial.upper()}.\n"
 
 def login_verificacion(user, hashed_pwd):
     """Verifica credenciales contra el caché"""
-    with cache_lock:
-        if user in usuarios_cache:
-            datos = usuarios_cache[user]
+    with usuarios_lock:
+        datos = _usuario(user)
+        if datos is not None:
             if datos["pass"] == hashed_pwd:
                 if datos.get("banned", False):
                     return "BANNED"
@@ -366,11 +832,25 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
     es_admin = (rol == "admin")
 
     if comando == "/resume":
-        enviar_privado(conn, "🤖 La IA está leyendo el historial... esto puede tardar unos segundos.")
-        resumen = generar_resumen_ollama(sala_actual)
-        enviar_privado(conn, f"\n✨ --- RESUMEN IA ({sala_actual}) --- ✨\n")
-        enviar_privado(conn, resumen)
-        enviar_privado(conn, "\n----------------------------------------\n")
+        forzar = len(partes) > 1 and partes[1].lower() == "full"
+        solicitar_resumen(conn, sala_actual, forzar)
+        return True
+
+    if comando == "/historial":
+        # Pedido del cliente: /historial {"sala": ..., "ultimos": n | "antes": id | "desde": id}
+        try:
+            peticion = json.loads(mensaje[len("/historial"):].strip() or "{}")
+            sala = peticion.get("sala", sala_actual)
+            ultimos = int(peticion.get("ultimos", PAGINA_HISTORIAL))
+            antes = int(peticion["antes"]) if peticion.get("antes") is not None else None
+            desde = int(peticion["desde"]) if peticion.get("desde") is not None else None
+        except (ValueError, TypeError, AttributeError):
+            enviar_privado(conn, 'Uso: /historial {"antes": id} | {"desde": id} | {"ultimos": n}')
+            return True
+        if not registro.existe_sala(sala):
+            enviar_privado(conn, "[SISTEMA] Sala no existe.")
+            return True
+        enviar_historial_a_usuario(conn, sala, ultimos, antes, desde)
         return True
 
     if comando == "/crear":
@@ -381,20 +861,21 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         if not nombre_sala:
             enviar_privado(conn, "Uso: /crear [nombre]")
             return True
-        if nombre_sala in salas:
+        if not registro.crear_sala(nombre_sala):
             enviar_privado(conn, "❌ La sala ya existe.")
             return True
-        salas[nombre_sala] = []
-        with cache_lock:
+        with salas_lock:
             salas_nombres_cache.append(nombre_sala)
+            cambios_pendientes["salas"] = True
+        with pines_lock:
             if nombre_sala not in pines_cache:
                 pines_cache[nombre_sala] = ""
-            if nombre_sala not in historial_cache:
-                historial_cache[nombre_sala] = []
-            cambios_pendientes["salas"] = True
+                pines_modificados.add(nombre_sala)
             cambios_pendientes["pines"] = True
-            cambios_pendientes["historial"] = True
-        broadcast_lista_salas()
+        with historial_lock:
+            if nombre_sala not in historial_cache:
+                historial_cache[nombre_sala] = deque(maxlen=MAX_MENSAJES_SALA)
+        broadcast_cambio_sala("ROOM_ADDED", nombre_sala)
         enviar_privado(conn, f"✅ Sala '{nombre_sala}' creada.")
         return True
 
@@ -403,40 +884,49 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
             enviar_privado(conn, "[ERROR] Solo Admin.")
             return True
         nombre_sala = " ".join(partes[1:])
-        if nombre_sala not in salas:
+        if not registro.existe_sala(nombre_sala):
             enviar_privado(conn, "❌ Sala no encontrada.")
             return True
-        if len(salas) <= 1:
+        resultado = registro.eliminar_sala(nombre_sala)
+        if resultado is None:
             enviar_privado(conn, "⚠️ No puedes borrar la última sala.")
             return True
-        sala_destino = list(salas.keys())[0]
-        if sala_destino == nombre_sala:
-            sala_destino = list(salas.keys())[1]
+        sala_destino, usuarios_afectados = resultado
         
-        usuarios_afectados = list(salas[nombre_sala])
         for c in usuarios_afectados:
-            salas[nombre_sala].remove(c)
-            salas[sala_destino].append(c)
-            clientes[c]["sala"] = sala_destino
+            datos_c = registro.sesion(c)
+            if datos_c is not None:
+                difundir_presencia("movido", datos_c, sala=sala_destino)
             enviar_privado(c, f"⚠️ La sala actual fue eliminada. Movido a {sala_destino}.")
             enviar_historial_a_usuario(c, sala_destino)
-        del salas[nombre_sala]
-        with cache_lock:
+        with salas_lock:
             salas_nombres_cache.remove(nombre_sala)
+            cambios_pendientes["salas"] = True
+        with pines_lock:
             if nombre_sala in pines_cache:
                 del pines_cache[nombre_sala]
+                pines_modificados.add(nombre_sala)
+            cambios_pendientes["pines"] = True
+        with historial_lock:
             if nombre_sala in historial_cache:
                 del historial_cache[nombre_sala]
-            cambios_pendientes["salas"] = True
-            cambios_pendientes["pines"] = True
+            versiones_historial[nombre_sala] = versiones_historial.get(nombre_sala, 0) + 1
+            historial_serializado.pop(nombre_sala, None)
+            almacen.eliminar_historial_sala(nombre_sala)
             cambios_pendientes["historial"] = True
-        broadcast_lista_salas()
+        with resumenes_lock:
+            resumenes_cache.pop(nombre_sala, None)
+            resumenes_modificados.add(nombre_sala)
+            sin_resumir.pop(nombre_sala, None)
+            ultima_actividad.pop(nombre_sala, None)
+            cambios_pendientes["resumenes"] = True
+        broadcast_cambio_sala("ROOM_REMOVED", nombre_sala)
         enviar_privado(conn, f"✅ Sala '{nombre_sala}' eliminada.")
         return True
 
     if comando == "/get_users":
-        lista_equipos = {s: [] for s in salas.keys()}
-        for c, datos in clientes.items():
+        lista_equipos = {s: [] for s in registro.nombres_salas()}
+        for c, datos in registro.sesiones():
             s_u = datos["sala"]
             if s_u in lista_equipos:
                 info = f"{datos['alias']}"
@@ -454,17 +944,26 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         return True
 
     if comando == "/join":
-        nueva_sala = " ".join(partes[1:]) if len(partes) > 1 else ""
-        if nueva_sala in salas:
-            if conn in salas[sala_actual]:
-                salas[sala_actual].remove(conn)
-            salas[nueva_sala].append(conn)
-            clientes[conn]["sala"] = nueva_sala
+        # /join [sala], o /join {"sala": ..., "desde": id} si el cliente ya tiene la sala hasta ese id
+        argumento = mensaje[len("/join"):].strip()
+        desde = None
+        if argumento.startswith("{"):
+            try:
+                peticion = json.loads(argumento)
+                nueva_sala = str(peticion["sala"])
+                desde = int(peticion["desde"]) if peticion.get("desde") is not None else None
+            except (ValueError, TypeError, KeyError, AttributeError):
+                enviar_privado(conn, 'Uso: /join [sala] | /join {"sala": ..., "desde": id}')
+                return True
+        else:
+            nueva_sala = " ".join(partes[1:]) if len(partes) > 1 else ""
+        if registro.mover(conn, nueva_sala):
+            difundir_presencia("movido", registro.sesion(conn), sala=nueva_sala)
             enviar_privado(conn, f"[SISTEMA] Entraste a: {nueva_sala}")
-            enviar_historial_a_usuario(conn, nueva_sala)
-            with cache_lock:
+            enviar_historial_a_usuario(conn, nueva_sala, desde=desde)
+            with pines_lock:
                 pin = pines_cache.get(nueva_sala, "")
-            conn.send(f"PIN_UPDATE:{pin}".encode("utf-8"))
+            conn.sendall(codificar_texto(f"PIN_UPDATE:{pin}"))
         else:
             enviar_privado(conn, f"[SISTEMA] Sala no existe.")
         return True
@@ -475,10 +974,10 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         texto = " ".join(partes[1:])
         if not texto:
             return True
-        with cache_lock:
+        with pines_lock:
             actual = pines_cache.get(sala_actual, "")
         if actual:
-            clientes[conn]["pending_pin"] = texto
+            registro.sesion(conn)["pending_pin"] = texto
             enviar_privado(conn, f"⚠️ Ya existe pin. ¿Sobrescribir? (y/n)")
             return True
         else:
@@ -498,7 +997,7 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
             return True
         
         # Verificar si hay un pin que borrar
-        with cache_lock:
+        with pines_lock:
             actual = pines_cache.get(sala_actual, "")
             
         if not actual:
@@ -512,12 +1011,12 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         return True
         
     if comando == "/help":
-        ayuda = "--- AYUDA ---\n/mirol, /join [sala], /resume (IA)"
+        ayuda = "--- AYUDA ---\n/mirol, /join [sala], /resume [full] (IA)"
         if es_staff:
             ayuda += "\n(STAFF) /kick, /mute, /unmute, /anuncio, /pin, /unpin"
         if es_admin:
             # Agregamos /roles aquí
-            ayuda += "\n(ADMIN) /crear, /borrar, /promote, /ban, /unban, /roles" 
+            ayuda += "\n(ADMIN) /crear, /borrar, /promote, /ban, /unban, /roles, /stats" 
         enviar_privado(conn, ayuda)
         return True
 
@@ -525,16 +1024,21 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         if not es_staff:
             return True
         target = partes[1].lower() if len(partes) > 1 else ""
-        for s, d in list(clientes.items()):
-            if d["alias"].lower() == target:
-                if d["rol"] == "admin":
-                    return True
-                enviar_privado(s, "🚫 Expulsado.")
-                remover_cliente(s)
-                enviar_privado(conn, f"✅ {target} expulsado.")
-                return True
+        objetivos = registro.sesiones_de(target)
+        if not objetivos or any(d["rol"] == "admin" for _, d in objetivos):
+            return True
+        for s, _ in objetivos:
+            enviar_privado(s, "🚫 Expulsado.")
+            remover_cliente(s, reanudable=False)
+        enviar_privado(conn, f"✅ {target} expulsado.")
         return True
         
+    if comando == "/stats":
+        if not es_admin:
+            return True
+        enviar_privado(conn, generar_estadisticas())
+        return True
+
     if comando == "/roles":
         if not es_admin:
             return True # Ignorar si no es admin
@@ -554,17 +1058,14 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         if not es_staff:
             return True
         target = partes[1] if len(partes) > 1 else ""
-        with cache_lock:
-            usrs = usuarios_cache.copy()
-        if target in usrs:
-            if usrs[target]["rol"] == "admin":
+        datos = obtener_usuario(target)
+        if datos:
+            if datos["rol"] == "admin":
                 return True
-            usrs[target]["banned"] = True
-            guardar_usuarios(usrs)
-            for s, d in list(clientes.items()):
-                if d["alias"] == target:
-                    enviar_privado(s, "⛔ BANEADO.")
-                    remover_cliente(s)
+            actualizar_usuario(target, {"banned": True})
+            for s, _ in registro.sesiones_de(target, exacto=True):
+                enviar_privado(s, "⛔ BANEADO.")
+                remover_cliente(s, reanudable=False)
             enviar_privado(conn, "✅ Usuario baneado.")
         return True
 
@@ -572,11 +1073,7 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         if not es_admin:
             return True
         target = partes[1] if len(partes) > 1 else ""
-        with cache_lock:
-            usrs = usuarios_cache.copy()
-        if target in usrs:
-            usrs[target]["banned"] = False
-            guardar_usuarios(usrs)
+        if actualizar_usuario(target, {"banned": False}):
             enviar_privado(conn, "✅ Desbaneado.")
         return True
     
@@ -584,24 +1081,26 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         if not es_staff:
             return True
         target = partes[1].lower() if len(partes) > 1 else ""
-        for s, d in clientes.items():
-            if d["alias"].lower() == target:
-                d["muted"] = True
-                enviar_privado(s, "😶 Silenciado.")
-                enviar_privado(conn, "✅ Listo.")
-                return True
+        objetivos = registro.sesiones_de(target)
+        for s, d in objetivos:
+            registro.actualizar(s, muted=True)
+            difundir_presencia("silencio", d, muted=True)
+            enviar_privado(s, "😶 Silenciado.")
+        if objetivos:
+            enviar_privado(conn, "✅ Listo.")
         return True
 
     if comando == "/unmute":
         if not es_staff:
             return True
         target = partes[1].lower() if len(partes) > 1 else ""
-        for s, d in clientes.items():
-            if d["alias"].lower() == target:
-                d["muted"] = False
-                enviar_privado(s, "🗣️ Liberado.")
-                enviar_privado(conn, "✅ Listo.")
-                return True
+        objetivos = registro.sesiones_de(target)
+        for s, d in objetivos:
+            registro.actualizar(s, muted=False)
+            difundir_presencia("silencio", d, muted=False)
+            enviar_privado(s, "🗣️ Liberado.")
+        if objetivos:
+            enviar_privado(conn, "✅ Listo.")
         return True
 
     if comando == "/promote":
@@ -610,171 +1109,429 @@ def procesar_comando(conn, mensaje, alias, rol, sala_actual):
         if len(partes) < 3:
             return True
         target, n_rol = partes[1], partes[2].lower()
-        with cache_lock:
-            usrs = usuarios_cache.copy()
-        if target in usrs and n_rol in ["admin", "docente", "estudiante"]:
-            usrs[target]["rol"] = n_rol
-            guardar_usuarios(usrs)
-            for s, d in clientes.items():
-                if d["alias"] == target:
-                    d["rol"] = n_rol
-                    enviar_privado(s, f"🎖️ Nuevo rol: {n_rol}")
+        if n_rol in ["admin", "docente", "estudiante"] and actualizar_usuario(target, {"rol": n_rol}):
+            for s, d in registro.sesiones_de(target, exacto=True):
+                registro.actualizar(s, rol=n_rol)
+                difundir_presencia("rol", d, rol=n_rol)
+                enviar_privado(s, f"🎖️ Nuevo rol: {n_rol}")
             enviar_privado(conn, f"✅ {target} es ahora {n_rol}.")
         return True
 
     enviar_privado(conn, "❌ Comando desconocido.")
     return False
 
-# --- MAIN ---
+# --- SESIÓN DE CLIENTE (común a ambos modos) ---
+def iniciar_sesion_cliente(conn, user, rol, ids=False, token=None, sala=None, desde=None, reanudada=False, version=2, zlib=False):
+    """Da de alta al cliente ya autenticado y le envía salas, historial y pin.
+    Al reanudar vuelve a su sala y recibe solo los mensajes posteriores a `desde`"""
+    datos = registro.alta(conn, user, rol, sala, ids, token, version, zlib=zlib)
+    sala_inicial = datos["sala"]
+    difundir_presencia("entro", datos, excepto=conn, alias=user, rol=rol, sala=sala_inicial, muted=False)
+    
+    if not reanudada:
+        broadcast(sala_inicial, f"[SISTEMA] {user} entró.", conn)
+    
+    json_salas = json.dumps(registro.nombres_salas())
+    conn.sendall(codificar_texto(f"ROOMS_UPDATE:{json_salas}", zlib))
+    if version >= VERSION_PRESENCIA:
+        # Única lista completa de la sesión: después solo llegan cambios. Se encola
+        # junto con la suscripción, así ningún delta se adelanta ni se pierde
+        registro.suscribir(conn, lambda usuarios: conn.sendall(
+            codificar_texto(f"PRESENCE_SNAPSHOT:{json.dumps({'usuarios': usuarios})}", zlib)))
+    
+    if sala_inicial != sala:
+        desde = None     # la sala ya no existe: página inicial de la sala nueva
+    if desde is not None:
+        enviar_historial_a_usuario(conn, sala_inicial, desde=desde)
+    else:
+        enviar_historial_a_usuario(conn, sala_inicial)
+    with pines_lock:
+        pin = pines_cache.get(sala_inicial, "")
+    conn.sendall(codificar_texto(f"PIN_UPDATE:{pin}"))
+
+def confirmar_pin_pendiente(conn, sesion, data):
+    """Resuelve la confirmación (y/n) de sobrescritura de pin. Retorna True si la consumió"""
+    pendiente = sesion.get("pending_pin")
+    if not pendiente:
+        return False
+    if data.lower() in ["y", "s", "si"]:
+        guardar_pin(sesion["sala"], pendiente)
+        broadcast_pin(sesion["sala"], pendiente)
+        enviar_privado(conn, "✅ Actualizado.")
+    else:
+        enviar_privado(conn, "❌ Cancelado.")
+    sesion["pending_pin"] = None
+    return True
+
+def procesar_mensaje_cliente(conn, user, data):
+    """Procesa una línea recibida de un cliente autenticado (comando o chat)"""
+    sesion = registro.sesion(conn)
+    if sesion is None:
+        return
+    rol = sesion["rol"]
+
+    if confirmar_pin_pendiente(conn, sesion, data):
+        return
+
+    if sesion["muted"] and not data.startswith("/"):
+        enviar_privado(conn, "😶 Silenciado.")
+        return
+
+    if data.startswith("/"):
+        sala_previa = sesion["sala"]
+        procesar_comando(conn, data, user, rol, sala_previa)
+    else:
+        # El prefijo de rol (👑 / 🎓) lo agrega Mensaje.renderizar
+        broadcast(sesion["sala"], data, conn, autor=user, rol=rol)
+
+def respuesta_pregunta_recuperacion(u):
+    """Retorna la respuesta al paso 1 de recuperación (pregunta de seguridad)"""
+    datos = obtener_usuario(u)
+    return f"PREGUNTA:{datos['pregunta']}" if datos else "ERROR"
+
+def restablecer_clave(u, r, np):
+    """Paso 2 de recuperación: valida la respuesta y cambia la contraseña"""
+    datos = obtener_usuario(u)
+    if datos and datos["resp_hash"] == hashlib.sha256(r.encode()).hexdigest():
+        actualizar_usuario(u, {"pass": hashlib.sha256(np.encode()).hexdigest()})
+        return "EXITO"
+    return "ERROR"
+
+def _hash(texto):
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+def resultado_login(user, pwd):
+    """Retorna (rol o None, texto para el cliente)"""
+    rol = login_verificacion(user, _hash(pwd))
+    if rol == "BANNED":
+        return None, "⛔ SUSPENDIDA."
+    if rol:
+        return rol, f"Bienvenido {user} [{rol.upper()}]\n"
+    return None, "Error credenciales."
+
+def atender_peticion_auth(conn, cuerpo):
+    """Resuelve en un solo paso una petición AUTH:{json} (login, reanudar, registro,
+    recuperar, restablecer). Retorna (respuesta para AUTH_RESULT, datos de la
+    sesión a iniciar o None)"""
+    try:
+        peticion = json.loads(cuerpo)
+        op = peticion["op"]
+        u = str(peticion.get("usuario", "")).strip()
+        version = int(peticion.get("v", 2))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return {"v": VERSION_AUTH, "op": None, "ok": False, "mensaje": "Petición inválida."}, None
+    
+    respuesta = {"v": VERSION_AUTH, "op": op, "ok": False}
+    sesion = None
+    if op == "login":
+        rol, respuesta["mensaje"] = resultado_login(u, str(peticion.get("clave", "")).strip())
+        if rol:
+            respuesta.update(ok=True, usuario=u, rol=rol)
+            sesion = {"user": u, "rol": rol, "ids": version >= 3, "version": version}
+    elif op == "reanudar":
+        anterior = canjear_token(str(peticion.get("token", "")), u)
+        datos = obtener_usuario(u) if anterior is not None else None
+        if datos is None or datos.get("banned", False):
+            respuesta["mensaje"] = "Sesión vencida."
+        else:
+            # Si el servidor no notó la caída, la conexión vieja se da de baja aquí
+            if registro.sesion(anterior) is not None:
+                remover_cliente(anterior, reanudable=False)
+            rol = datos.get("rol", "estudiante")
+            respuesta.update(ok=True, usuario=u, rol=rol, mensaje=f"Bienvenido {u} [{rol.upper()}]\n")
+            try:
+                desde = int(peticion["desde"]) if peticion.get("desde") is not None else None
+            except (ValueError, TypeError):
+                desde = None
+            sesion = {"user": u, "rol": rol, "ids": True, "sala": peticion.get("sala"),
+                      "desde": desde, "reanudada": True, "version": version}
+    elif op == "registro":
+        r = str(peticion.get("respuesta", "")).strip().lower()
+        respuesta["ok"], respuesta["mensaje"] = registrar_usuario(
+            u, _hash(str(peticion.get("clave", "")).strip()), str(peticion.get("pregunta", "")).strip(), _hash(r))
+    elif op == "recuperar":
+        respuesta["mensaje"] = respuesta_pregunta_recuperacion(u)
+        respuesta["ok"] = respuesta["mensaje"] != "ERROR"
+    elif op == "restablecer":
+        r = str(peticion.get("respuesta", "")).strip().lower()
+        respuesta["mensaje"] = restablecer_clave(u, r, str(peticion.get("nueva", "")).strip())
+        respuesta["ok"] = respuesta["mensaje"] == "EXITO"
+    else:
+        respuesta["mensaje"] = "Operación desconocida."
+    if sesion is not None and sesion["ids"]:
+        sesion["token"] = respuesta["token"] = emitir_token(conn, u)
+    if sesion is not None and COMPRESION and "zlib" in peticion.get("compresion", ()):
+        sesion["zlib"] = True
+        respuesta["compresion"] = "zlib"
+    return respuesta, sesion
+
+# --- MODO HILOS: un hilo por cliente ---
+def dialogo_legado(conn, lector, opcion):
+    """Autenticación paso a paso de los clientes anteriores a AUTH (un ACK por
+    campo). Retorna los datos de la sesión si el login fue aceptado, o None"""
+    if opcion == "l":
+        conn.sendall(codificar_texto("ACK"))
+        user = lector.recibir_texto().strip()
+        conn.sendall(codificar_texto("ACK"))
+        pwd = lector.recibir_texto().strip()
+        rol, texto = resultado_login(user, pwd)
+        conn.sendall(codificar_texto(texto))
+        return {"user": user, "rol": rol} if rol else None
+    elif opcion == "r":
+        conn.sendall(codificar_texto("ACK"))
+        u = lector.recibir_texto().strip()
+        conn.sendall(codificar_texto("ACK"))
+        p = lector.recibir_texto().strip()
+        conn.sendall(codificar_texto("ACK"))
+        q = lector.recibir_texto().strip()
+        conn.sendall(codificar_texto("ACK"))
+        r = lector.recibir_texto().strip().lower()
+        conn.sendall(codificar_texto(registrar_usuario(u, _hash(p), q, _hash(r))[1]))
+    elif opcion == "rec_req":
+        conn.sendall(codificar_texto("ACK"))
+        u = lector.recibir_texto().strip()
+        conn.sendall(codificar_texto(respuesta_pregunta_recuperacion(u)))
+    elif opcion == "rec_reset":
+        conn.sendall(codificar_texto("ACK"))
+        u = lector.recibir_texto().strip()
+        conn.sendall(codificar_texto("ACK"))
+        r = lector.recibir_texto().strip().lower()
+        conn.sendall(codificar_texto("ACK"))
+        np = lector.recibir_texto().strip()
+        conn.sendall(codificar_texto(restablecer_clave(u, r, np)))
+    return None
+
 def manejar_cliente(conn, addr):
     print(f"🔒 [CONEXIÓN] {addr}")
+    lector = LectorTramas(conn, maximo=MAX_TRAMA_ENTRANTE)
     try:
-        opcion = conn.recv(1024).decode("utf-8").lower().strip()
-        if opcion == "l":
-            conn.send("ACK".encode())
-            user = conn.recv(1024).decode().strip()
-            conn.send("ACK".encode())
-            pwd = conn.recv(1024).decode().strip()
-            hashed = hashlib.sha256(pwd.encode()).hexdigest()
-            rol = login_verificacion(user, hashed)
-            if rol == "BANNED":
-                conn.send("⛔ SUSPENDIDA.".encode())
-                return
-            elif rol:
-                conn.send(f"Bienvenido {user} [{rol.upper()}]\n".encode())
-                
-                sala_inicial = list(salas.keys())[0]
-                clientes[conn] = {"alias": user, "sala": sala_inicial, "rol": rol, "muted": False, "pending_pin": None}
-                salas[sala_inicial].append(conn)
-                
-                broadcast(sala_inicial, f"[SISTEMA] {user} entró.", conn)
-                
-                json_salas = json.dumps(list(salas.keys()))
-                conn.send(f"ROOMS_UPDATE:{json_salas}".encode("utf-8"))
-                
-                enviar_historial_a_usuario(conn, sala_inicial)
-                with cache_lock:
-                    pin = pines_cache.get(sala_inicial, "")
-                conn.send(f"PIN_UPDATE:{pin}".encode("utf-8"))
-
-                while True:
-                    data = conn.recv(1024).decode().strip()
-                    if not data:
-                        break
-                    
-                    if conn in clientes:
-                        rol = clientes[conn]["rol"]
-
-                    if clientes[conn].get("pending_pin"):
-                        if data.lower() in ["y", "s", "si"]:
-                            guardar_pin(clientes[conn]["sala"], clientes[conn]["pending_pin"])
-                            broadcast_pin(clientes[conn]["sala"], clientes[conn]["pending_pin"])
-                            enviar_privado(conn, "✅ Actualizado.")
-                        else:
-                            enviar_privado(conn, "❌ Cancelado.")
-                        clientes[conn]["pending_pin"] = None
-                        continue
-
-                    if clientes[conn]["muted"] and not data.startswith("/"):
-                        enviar_privado(conn, "😶 Silenciado.")
-                        continue
-
-                    if data.startswith("/"):
-                        sala_previa = clientes[conn]["sala"]
-                        procesar_comando(conn, data, user, rol, sala_previa)
-                    else:
-                        prefijo = ""
-                        if rol == "admin":
-                            prefijo = "👑 [ADMIN] "
-                        elif rol == "docente":
-                            prefijo = "🎓 [DOCENTE] "
-                        broadcast(clientes[conn]["sala"], f"{prefijo}{user}: {data}", conn)
-                return
-            else:
-                conn.send("Error credenciales.".encode())
-                return
+        primera = lector.recibir_texto().strip()
+        if primera.startswith("AUTH:"):
+            respuesta, sesion = atender_peticion_auth(conn, primera[len("AUTH:"):])
+            conn.sendall(codificar_texto(f"AUTH_RESULT:{json.dumps(respuesta)}"))
+        else:
+            sesion = dialogo_legado(conn, lector, primera.lower())
+        if sesion is None:
+            return
         
-        elif opcion == "r":
-            conn.send("ACK".encode())
-            u = conn.recv(1024).decode().strip()
-            conn.send("ACK".encode())
-            p = conn.recv(1024).decode().strip()
-            conn.send("ACK".encode())
-            q = conn.recv(1024).decode().strip()
-            conn.send("ACK".encode())
-            r = conn.recv(1024).decode().strip().lower()
-            registrar_usuario(conn, u, hashlib.sha256(p.encode()).hexdigest(), q, hashlib.sha256(r.encode()).hexdigest())
-        elif opcion == "rec_req":
-            conn.send("ACK".encode())
-            u = conn.recv(1024).decode().strip()
-            with cache_lock:
-                usrs = usuarios_cache.copy()
-            conn.send(f"PREGUNTA:{usrs[u]['pregunta']}".encode() if u in usrs else "ERROR".encode())
-        elif opcion == "rec_reset":
-            conn.send("ACK".encode())
-            u = conn.recv(1024).decode().strip()
-            conn.send("ACK".encode())
-            r = conn.recv(1024).decode().strip().lower()
-            conn.send("ACK".encode())
-            np = conn.recv(1024).decode().strip()
-            with cache_lock:
-                usrs = usuarios_cache.copy()
-            if u in usrs and usrs[u]["resp_hash"] == hashlib.sha256(r.encode()).hexdigest():
-                usrs[u]["pass"] = hashlib.sha256(np.encode()).hexdigest()
-                guardar_usuarios(usrs)
-                conn.send("EXITO".encode())
-            else:
-                conn.send("ERROR".encode())
+        user = sesion["user"]
+        iniciar_sesion_cliente(conn, **sesion)
+        while True:
+            trama = lector.recibir()
+            if trama is None:
+                break
+            data = decodificar_texto(*trama, MAX_TRAMA_ENTRANTE).strip()
+            if data:
+                procesar_mensaje_cliente(conn, user, data)
+    except:
+        pass
+    finally:
+        remover_cliente(conn)
+
+def atender_conexion_hilo(ctx, sock, addr):
+    """Hace el handshake TLS en el hilo del cliente (no en el que acepta) y lo atiende"""
+    try:
+        conn = ConexionHilo(ctx.wrap_socket(sock, server_side=True), addr)
+    except (ssl.SSLError, OSError):
+        sock.close()
+        return
+    manejar_cliente(conn, addr)
+
+def servidor_hilos(ctx):
+    """Acepta conexiones y lanza un hilo por cliente"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Permite reiniciar tras una caída sin esperar a que expire TIME_WAIT
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((HOST_SERVIDOR, PUERTO_SERVIDOR))
+    s.listen(5)
+    print(f"📌 [SERVIDOR COMPLETO] Listo en puerto {PUERTO_SERVIDOR} (modo hilos).")
+    
+    while True:
+        c, a = s.accept()
+        threading.Thread(target=atender_conexion_hilo, args=(ctx, c, a), daemon=True).start()
+
+# --- MODO ASYNCIO: un solo bucle de eventos para todas las conexiones ---
+async def _recibir_async(reader):
+    """Equivalente asíncrono de lector.recibir_texto().strip()"""
+    trama = await leer_trama_async(reader, MAX_TRAMA_ENTRANTE)
+    if trama is None:
+        return ""
+    return decodificar_texto(*trama, MAX_TRAMA_ENTRANTE).strip()
+
+def _en_hilo(funcion, *args):
+    """Ejecuta fuera del bucle algo que puede esperar un lock tomado durante E/S
+    de disco (historial_lock en la rotación del WAL, el almacén al compactar)"""
+    return asyncio.get_running_loop().run_in_executor(None, funcion, *args)
+
+async def dialogo_legado_async(conn, reader, opcion):
+    """Equivalente asíncrono de dialogo_legado"""
+    if opcion == "l":
+        conn.sendall(codificar_texto("ACK"))
+        user = await _recibir_async(reader)
+        conn.sendall(codificar_texto("ACK"))
+        pwd = await _recibir_async(reader)
+        rol, texto = await _en_hilo(resultado_login, user, pwd)
+        conn.sendall(codificar_texto(texto))
+        return {"user": user, "rol": rol} if rol else None
+    elif opcion == "r":
+        conn.sendall(codificar_texto("ACK"))
+        u = await _recibir_async(reader)
+        conn.sendall(codificar_texto("ACK"))
+        p = await _recibir_async(reader)
+        conn.sendall(codificar_texto("ACK"))
+        q = await _recibir_async(reader)
+        conn.sendall(codificar_texto("ACK"))
+        r = (await _recibir_async(reader)).lower()
+        conn.sendall(codificar_texto((await _en_hilo(registrar_usuario, u, _hash(p), q, _hash(r)))[1]))
+    elif opcion == "rec_req":
+        conn.sendall(codificar_texto("ACK"))
+        u = await _recibir_async(reader)
+        conn.sendall(codificar_texto(await _en_hilo(respuesta_pregunta_recuperacion, u)))
+    elif opcion == "rec_reset":
+        conn.sendall(codificar_texto("ACK"))
+        u = await _recibir_async(reader)
+        conn.sendall(codificar_texto("ACK"))
+        r = (await _recibir_async(reader)).lower()
+        conn.sendall(codificar_texto("ACK"))
+        np = await _recibir_async(reader)
+        conn.sendall(codificar_texto(await _en_hilo(restablecer_clave, u, r, np)))
+    return None
+
+async def manejar_cliente_async(reader, writer):
+    loop = asyncio.get_running_loop()
+    conn = ConexionAsync(writer, loop)
+    print(f"🔒 [CONEXIÓN] {conn.addr}")
+    try:
+        primera = await _recibir_async(reader)
+        if primera.startswith("AUTH:"):
+            respuesta, sesion = await _en_hilo(atender_peticion_auth, conn, primera[len("AUTH:"):])
+            conn.sendall(codificar_texto(f"AUTH_RESULT:{json.dumps(respuesta)}"))
+        else:
+            sesion = await dialogo_legado_async(conn, reader, primera.lower())
+        if sesion is None:
+            return
+        
+        user = sesion["user"]
+        await _en_hilo(lambda: iniciar_sesion_cliente(conn, **sesion))
+        while not conn.cerrada:
+            trama = await leer_trama_async(reader, MAX_TRAMA_ENTRANTE)
+            if trama is None:
+                break
+            data = decodificar_texto(*trama, MAX_TRAMA_ENTRANTE).strip()
+            if not data:
+                continue
+            # Comandos y mensajes de chat pueden esperar locks (p. ej. /resume, o el
+            # historial mientras rota el WAL): se ejecutan fuera del bucle, pero en
+            # orden respecto a este cliente.
+            await _en_hilo(procesar_mensaje_cliente, conn, user, data)
     except:
         pass
     finally:
         remover_cliente(conn)
 
+def _ampliar_limite_descriptores():
+    """Sube el límite de sockets abiertos al máximo permitido (solo POSIX)"""
+    try:
+        import resource
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if duro == resource.RLIM_INFINITY or blando < duro:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+    except (ImportError, ValueError, OSError):
+        pass
+
+async def servidor_asyncio(ctx):
+    """Atiende todas las conexiones TLS en un único bucle de eventos"""
+    _ampliar_limite_descriptores()
+    server = await asyncio.start_server(
+        manejar_cliente_async, HOST_SERVIDOR, PUERTO_SERVIDOR,
+        ssl=ctx, backlog=1024, ssl_handshake_timeout=10
+    )
+    print(f"📌 [SERVIDOR COMPLETO] Listo en puerto {PUERTO_SERVIDOR} (modo asyncio).")
+    async with server:
+        await server.serve_forever()
+
+# --- MAIN ---
+contexto_tls = None
+
+def crear_contexto_tls():
+    """Contexto del servidor con caché de sesiones y tickets para la reanudación"""
+    global contexto_tls
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain("server.crt", "server.key")
+    # La caché de sesiones del servidor (TLS 1.2) viene activa; los tickets se
+    # activan explícitamente por si la configuración de OpenSSL los deshabilita
+    ctx.options &= ~ssl.OP_NO_TICKET
+    ctx.num_tickets = TLS_TICKETS
+    contexto_tls = ctx
+    return ctx
+
+def guardar_cambios_pendientes():
+    """Vuelca a disco todo lo que esté marcado como pendiente"""
+    with usuarios_lock:
+        if cambios_pendientes["usuarios"]:
+            guardar_cache_usuarios()
+    with pines_lock:
+        if cambios_pendientes["pines"]:
+            guardar_cache_pines()
+    with salas_lock:
+        if cambios_pendientes["salas"]:
+            guardar_cache_salas()
+    with resumenes_lock:
+        if cambios_pendientes["resumenes"]:
+            guardar_cache_resumenes()
+    compactar_historial()
+    almacen.cerrar()
+
+def informar_ia(disponible):
+    """Resultado del primer sondeo a Ollama"""
+    if disponible:
+        print("🤖 [IA] Ollama detectado y listo.")
+    else:
+        print("⚠️ [IA] OLLAMA NO RESPONDE. El comando /resume fallará.")
+        print("   -> Asegúrate de ejecutar 'ollama serve' en la Raspberry.")
+
 def main():
     # Inicializar caché en memoria
-    inicializar_cache()
+    tipo_almacen = ALMACENAMIENTO
+    if "--sqlite" in sys.argv:
+        tipo_almacen = "sqlite"
+    elif "--json" in sys.argv:
+        tipo_almacen = "json"
+    inicializar_cache(tipo_almacen)
     
     # Iniciar hilo autosave
     autosave_thread = threading.Thread(target=hilo_autosave, daemon=True)
     autosave_thread.start()
+    threading.Thread(target=almacen.hilo_sincronizacion, daemon=True).start()
     print("💾 [AUTOSAVE] Hilo de guardado automático iniciado.")
+    cola_resumenes.iniciar()
+    threading.Thread(target=hilo_resumenes, daemon=True).start()
     
-    # Verificación de IA
-    try:
-        requests.get("http://localhost:11434")
-        print("🤖 [IA] Ollama detectado y listo.")
-    except:
-        print("⚠️ [IA] OLLAMA NO RESPONDE. El comando /resume fallará.")
-        print("   -> Asegúrate de ejecutar 'ollama serve' en la Raspberry.")
+    # Verificación de IA en segundo plano (sondeo y precarga del modelo): un modelo
+    # lento en cargar no retrasa el arranque del servidor
+    cliente_ia.iniciar(informar_ia)
 
     try:
-        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        ctx.load_cert_chain("server.crt", "server.key")
+        ctx = crear_contexto_tls()
     except:
         print("❌ Error SSL: No se encuentran las llaves. El servidor no iniciará.")
         return
     
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind(("192.168.1.100", 5000))
-    s.listen(5)
-    print("📌 [SERVIDOR COMPLETO] Listo en puerto 5000.")
+    modo = MODO_SERVIDOR
+    if "--asyncio" in sys.argv:
+        modo = "asyncio"
+    elif "--hilos" in sys.argv:
+        modo = "hilos"
     
     try:
-        while True:
-            c, a = s.accept()
-            threading.Thread(target=manejar_cliente, args=(ctx.wrap_socket(c, server_side=True), a), daemon=True).start()
+        if modo == "asyncio":
+            asyncio.run(servidor_asyncio(ctx))
+        else:
+            servidor_hilos(ctx)
     except KeyboardInterrupt:
         print("\n⚠️ Guardando cambios pendientes antes de cerrar...")
-        with cache_lock:
-            if cambios_pendientes["usuarios"]:
-                guardar_cache_usuarios()
-            if cambios_pendientes["historial"]:
-                guardar_cache_historial()
-            if cambios_pendientes["pines"]:
-                guardar_cache_pines()
-            if cambios_pendientes["salas"]:
-                guardar_cache_salas()
+        guardar_cambios_pendientes()
         print("✅ Servidor cerrado correctamente.")
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
@@ -0,0 +1,329 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from historial_wal import RegistroHistorial, INTERVALO_FSYNC
+from mensajes import Mensaje, cargar_registros
+
+# --- ALMACENAMIENTO PERSISTENTE ---
+# El Host trabaja siempre contra sus cachés en memoria y delega aquí la
+# persistencia. Hay dos implementaciones con la misma interfaz:
+#   AlmacenJSON   -> archivos JSON completos + log append-only del historial
+#   AlmacenSQLite -> una base SQLite (modo WAL) escrita fila a fila
+# Los métodos guardar_* reciben el caché completo y las claves que cambiaron:
+# el backend JSON reescribe el archivo, el SQLite solo toca esas filas.
+# El historial se maneja como registros Mensaje (ver mensajes.py).
+
+class AlmacenJSON:
+    """Backend por defecto: usuarios.json, salas.json, pines.json, resumenes.json e historial.json"""
+
+    # Todo se carga al arrancar: no hace falta ir al disco por cada consulta
+    carga_perezosa = False
+
+    def __init__(self, usuarios_file, salas_file, pines_file, historial_file, historial_log_dir, max_por_sala=1000,
+                 resumenes_file="resumenes.json"):
+        self.usuarios_file = usuarios_file
+        self.salas_file = salas_file
+        self.pines_file = pines_file
+        self.resumenes_file = resumenes_file
+        self.historial = RegistroHistorial(historial_file, historial_log_dir, max_por_sala)
+        self._ultimo_id = 0
+
+    def _leer(self, ruta):
+        """Contenido JSON de un archivo, o None si no existe o está dañado"""
+        if not os.path.exists(ruta):
+            return None
+        try:
+            with open(ruta, "r") as f:
+                return json.load(f)
+        except:
+            return None
+
+    def _escribir(self, ruta, datos):
+        with open(ruta, "w") as f:
+            json.dump(datos, f, indent=4)
+
+    # --- Usuarios ---
+    def cargar_usuarios(self):
+        return self._leer(self.usuarios_file)
+
+    def cargar_usuario(self, nombre):
+        return None
+
+    def contar_usuarios(self):
+        return 0
+
+    def guardar_usuarios(self, usuarios, cambiados):
+        self._escribir(self.usuarios_file, usuarios)
+
+    # --- Salas y pines ---
+    def cargar_salas(self):
+        return self._leer(self.salas_file)
+
+    def guardar_salas(self, nombres):
+        self._escribir(self.salas_file, nombres)
+
+    def cargar_pines(self):
+        return self._leer(self.pines_file)
+
+    def guardar_pines(self, pines, cambiados):
+        self._escribir(self.pines_file, pines)
+
+    # --- Resúmenes IA ---
+    def cargar_resumenes(self):
+        return self._leer(self.resumenes_file)
+
+    def guardar_resumenes(self, resumenes, cambiados):
+        self._escribir(self.resumenes_file, resumenes)
+
+    # --- Historial ---
+    def cargar_historial(self):
+        crudo = self.historial.cargar()
+        # Las líneas del formato antiguo reciben ids a continuación de los existentes
+        siguiente = 1 + max((e["id"] for ms in crudo.values() for e in ms if isinstance(e, dict)), default=0)
+        historial = {}
+        for sala, entradas in crudo.items():
+            historial[sala], siguiente = cargar_registros(entradas, siguiente)
+        self._ultimo_id = siguiente - 1
+        return historial
+
+    def cargar_historial_sala(self, sala):
+        return []
+
+    def ultimo_id(self):
+        return self._ultimo_id
+
+    def agregar_mensaje(self, sala, mensaje):
+        self.historial.agregar(sala, mensaje.a_dict())
+
+    def eliminar_historial_sala(self, sala):
+        self.historial.eliminar_sala(sala)
+
+    def hilo_sincronizacion(self):
+        self.historial.hilo_sincronizacion()
+
+    def necesita_compactar(self):
+        return self.historial.necesita_compactar()
+
+    def compactar(self, lock, copiar_historial):
+        """Snapshot + rotación de logs. La copia y la rotación ocurren bajo el lock del caché"""
+        with lock:
+            copia = copiar_historial()
+            corte = self.historial.rotar()
+        # Los Mensaje no cambian una vez creados: se serializan fuera del lock
+        snapshot = {sala: [m.a_dict() for m in mensajes] for sala, mensajes in copia.items()}
+        self.historial.escribir_snapshot(snapshot, corte)
+
+    def cerrar(self):
+        self.historial.cerrar()
+
+class AlmacenSQLite:
+    """Backend SQLite: una fila por usuario, sala, pin, resumen y mensaje"""
+
+    # Usuarios e historial se leen bajo demanda: arrancar no depende de cuántos haya
+    carga_perezosa = True
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS usuarios (
+            nombre TEXT PRIMARY KEY,
+            pass TEXT NOT NULL,
+            rol TEXT NOT NULL,
+            banned INTEGER NOT NULL DEFAULT 0,
+            pregunta TEXT,
+            resp_hash TEXT
+        );
+        CREATE TABLE IF NOT EXISTS salas (
+            nombre TEXT PRIMARY KEY,
+            orden INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS pines (
+            sala TEXT PRIMARY KEY,
+            mensaje TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS resumenes (
+            sala TEXT PRIMARY KEY,
+            texto TEXT NOT NULL,
+            hasta_id INTEGER NOT NULL,
+            ts REAL
+        );
+        CREATE TABLE IF NOT EXISTS mensajes (
+            id INTEGER PRIMARY KEY,
+            sala TEXT NOT NULL,
+            texto TEXT NOT NULL,
+            ts REAL,
+            autor TEXT,
+            rol TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_mensajes_sala ON mensajes (sala, id);
+    """
+
+    def __init__(self, ruta_db, max_por_sala=1000):
+        self.ruta_db = ruta_db
+        self.max_por_sala = max_por_sala
+        self._lock = threading.Lock()
+        self._pendientes = []      # mensajes a insertar en el próximo grupo
+        self._insertados = 0       # mensajes desde el último recorte
+        self.db = sqlite3.connect(ruta_db, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.ESQUEMA)
+        # Bases creadas antes de los registros estructurados: agregar columnas
+        columnas = {f[1] for f in self.db.execute("PRAGMA table_info(mensajes)")}
+        for col, tipo in (("ts", "REAL"), ("autor", "TEXT"), ("rol", "TEXT")):
+            if col not in columnas:
+                self.db.execute(f"ALTER TABLE mensajes ADD COLUMN {col} {tipo}")
+        self.db.commit()
+
+    @staticmethod
+    def _fila_a_usuario(fila):
+        return {
+            "pass": fila[0],
+            "rol": fila[1],
+            "banned": bool(fila[2]),
+            "pregunta": fila[3],
+            "resp_hash": fila[4]
+        }
+
+    # --- Usuarios ---
+    def cargar_usuarios(self):
+        """Todos los usuarios. Solo lo usan los accesos masivos, no el arranque"""
+        with self._lock:
+            filas = self.db.execute(
+                "SELECT nombre, pass, rol, banned, pregunta, resp_hash FROM usuarios").fetchall()
+        return {f[0]: self._fila_a_usuario(f[1:]) for f in filas}
+
+    def cargar_usuario(self, nombre):
+        with self._lock:
+            fila = self.db.execute(
+                "SELECT pass, rol, banned, pregunta, resp_hash FROM usuarios WHERE nombre = ?",
+                (nombre,)).fetchone()
+        return self._fila_a_usuario(fila) if fila else None
+
+    def contar_usuarios(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]
+
+    def guardar_usuarios(self, usuarios, cambiados):
+        filas = [(u, d["pass"], d.get("rol", "estudiante"), int(d.get("banned", False)),
+                  d.get("pregunta"), d.get("resp_hash"))
+                 for u, d in ((u, usuarios[u]) for u in cambiados if u in usuarios)]
+        if not filas:
+            return
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO usuarios (nombre, pass, rol, banned, pregunta, resp_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)", filas)
+
+    # --- Salas y pines ---
+    def cargar_salas(self):
+        with self._lock:
+            filas = self.db.execute("SELECT nombre FROM salas ORDER BY orden").fetchall()
+        return [f[0] for f in filas] or None
+
+    def guardar_salas(self, nombres):
+        with self._lock, self.db:
+            actuales = {f[0] for f in self.db.execute("SELECT nombre FROM salas")}
+            borradas = actuales - set(nombres)
+            self.db.executemany("DELETE FROM salas WHERE nombre = ?", [(n,) for n in borradas])
+            self.db.executemany(
+                "INSERT OR REPLACE INTO salas (nombre, orden) VALUES (?, ?)",
+                [(n, i) for i, n in enumerate(nombres)])
+
+    def cargar_pines(self):
+        with self._lock:
+            filas = self.db.execute("SELECT sala, mensaje FROM pines").fetchall()
+        return dict(filas) if filas else None
+
+    def guardar_pines(self, pines, cambiados):
+        with self._lock, self.db:
+            for sala in cambiados:
+                if sala in pines:
+                    self.db.execute("INSERT OR REPLACE INTO pines (sala, mensaje) VALUES (?, ?)",
+                                    (sala, pines[sala]))
+                else:
+                    self.db.execute("DELETE FROM pines WHERE sala = ?", (sala,))
+
+    # --- Resúmenes IA ---
+    def cargar_resumenes(self):
+        with self._lock:
+            filas = self.db.execute("SELECT sala, texto, hasta_id, ts FROM resumenes").fetchall()
+        return {f[0]: {"texto": f[1], "hasta_id": f[2], "ts": f[3]} for f in filas}
+
+    def guardar_resumenes(self, resumenes, cambiados):
+        with self._lock, self.db:
+            for sala in cambiados:
+                r = resumenes.get(sala)
+                if r is not None:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO resumenes (sala, texto, hasta_id, ts) VALUES (?, ?, ?, ?)",
+                        (sala, r["texto"], r["hasta_id"], r["ts"]))
+                else:
+                    self.db.execute("DELETE FROM resumenes WHERE sala = ?", (sala,))
+
+    # --- Historial ---
+    def cargar_historial(self):
+        """El historial se carga por sala la primera vez que se pide"""
+        return {}
+
+    def cargar_historial_sala(self, sala):
+        self.sincronizar()
+        with self._lock:
+            filas = self.db.execute(
+                "SELECT id, ts, autor, rol, texto FROM mensajes WHERE sala = ? ORDER BY id DESC LIMIT ?",
+                (sala, self.max_por_sala)).fetchall()
+        return [Mensaje(*f) for f in reversed(filas)]
+
+    def ultimo_id(self):
+        with self._lock:
+            return self.db.execute("SELECT COALESCE(MAX(id), 0) FROM mensajes").fetchone()[0]
+
+    def agregar_mensaje(self, sala, mensaje):
+        with self._lock:
+            self._pendientes.append((mensaje.id, sala, mensaje.texto, mensaje.ts, mensaje.autor, mensaje.rol))
+
+    def sincronizar(self):
+        """Inserta en una sola transacción los mensajes acumulados"""
+        with self._lock:
+            if not self._pendientes:
+                return
+            lote, self._pendientes = self._pendientes, []
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO mensajes (id, sala, texto, ts, autor, rol) VALUES (?, ?, ?, ?, ?, ?)", lote)
+            self._insertados += len(lote)
+
+    def hilo_sincronizacion(self):
+        while True:
+            time.sleep(INTERVALO_FSYNC)
+            try:
+                self.sincronizar()
+            except sqlite3.Error as e:
+                print(f"Error guardando mensajes en SQLite: {e}")
+
+    def eliminar_historial_sala(self, sala):
+        with self._lock, self.db:
+            self._pendientes = [p for p in self._pendientes if p[1] != sala]
+            self.db.execute("DELETE FROM mensajes WHERE sala = ?", (sala,))
+
+    def necesita_compactar(self):
+        with self._lock:
+            return self._insertados >= self.max_por_sala
+
+    def compactar(self, lock, copiar_historial):
+        """Recorta cada sala a sus últimos max_por_sala mensajes"""
+        self.sincronizar()
+        with self._lock, self.db:
+            salas = [f[0] for f in self.db.execute("SELECT DISTINCT sala FROM mensajes")]
+            for sala in salas:
+                self.db.execute(
+                    "DELETE FROM mensajes WHERE sala = ? AND id <= "
+                    "(SELECT id FROM mensajes WHERE sala = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (sala, sala, self.max_por_sala))
+            self._insertados = 0
+
+    def cerrar(self):
+        self.sincronizar()
+        with self._lock:
+            self.db.close()
@@ -1,10 +1,10 @@
 from customtkinter import *
-from CTkMessagebox import CTkMessagebox
 import tkinter as tk
 import queue
-from PIL import Image
 import threading 
 import json
+import time
+from collections import deque, OrderedDict
 
 from network_manager import NetworkManager
 import auth 
@@ -12,7 +12,10 @@ from design_constants import *
 
 class ChatApp(CTk):
 
-    def __init__(self):
+    def __init__(self, inicio=None):
+        # --- INFORME DE ARRANQUE ---
+        # inicio: momento en que main.py empezó a importar; se informa al dibujar el primer cuadro
+        self.arranque = {"inicio": inicio if inicio is not None else time.perf_counter(), "interfaz": time.perf_counter()}
         super().__init__()
         self.title("Chat Seguro - Admin Control")
         self.geometry("400x600") 
@@ -21,21 +24,80 @@ class ChatApp(CTk):
         
         self.alias = ""
         self.cola_mensajes = queue.Queue()
+        
+        # --- HISTORIAL POR PÁGINAS ---
+        self.sala_actual = None
+        self.historial_cursor = None      # id del mensaje más antiguo mostrado
+        self.historial_hay_mas = False    # el servidor tiene mensajes anteriores
+        self.pidiendo_historial = False
+        # El chat guarda como mucho MAX_LINEAS_CHAT líneas; al pasarse borra las más
+        # antiguas de a RECORTE_CHAT y se vuelven a pedir al desplazarse hacia arriba
+        self.MAX_LINEAS_CHAT = 2000
+        self.RECORTE_CHAT = 500
+        self.bloques_chat = deque()       # [id o None, líneas, termina en salto] por cada texto insertado
+        # Al subir página tras página se borran los mensajes más nuevos: la vista queda
+        # desenganchada del vivo y lo que llega no se agrega debajo hasta volver al final
+        self.vista_en_vivo = True
+        self.volviendo_al_vivo = False    # se pidió lo posterior a ultimo_id_vista
+        self.ultimo_id_vista = None       # id del mensaje más nuevo que quedó en pantalla
+        self.lineas_en_espera = []        # bloques [(id, segmentos)] que llegaron mientras se vuelve al vivo
+        
+        # --- CACHÉ DE SALAS ---
+        # Últimos MAX_MENSAJES_CACHE mensajes de las MAX_SALAS_CACHE salas visitadas más
+        # recientemente: al volver a una sala se muestra al instante y solo se pide lo nuevo
+        self.MAX_SALAS_CACHE = 8
+        self.MAX_MENSAJES_CACHE = 300
+        self.cache_salas = OrderedDict()  # sala -> {"mensajes": {id: texto o None}, "hay_mas", "pin"}
+        self.cache_activa = False         # False desde el /join hasta que llega el historial de la sala
+        
+        # --- PRESENCIA ---
+        # Con servidores que la envían, la lista de miembros se mantiene localmente con
+        # PRESENCE_SNAPSHOT (al entrar) y PRESENCE_DELTA: "Ver miembros" abre al instante
+        self.presencia = None             # id de sesión -> {"alias", "rol", "sala", "muted"}; None = sin presencia
+        self.ventana_miembros = None
         self.network_manager = NetworkManager(self.cola_mensajes)
         
+        # --- BOMBA DE MENSAJES ---
+        # NetworkManager avisa con un evento virtual (seguro entre hilos) y la cola
+        # se procesa en tandas de como mucho PRESUPUESTO_COLA segundos, para que
+        # una sala inundada no congele la ventana
+        self.PRESUPUESTO_COLA = 0.012
+        self.INTERVALO_RESPALDO = 500  # ms, por si algún aviso se pierde
+        self._aviso_pendiente = False   # hay un aviso o una cadena de tandas en curso: el hilo de red no vuelve a avisar
+        self._tanda = None              # after() de la próxima tanda de la cadena
+        self.bind("<<MensajesNuevos>>", lambda e: self.procesar_cola(respaldo=False))
+        self.network_manager.al_encolar = self._avisar_mensajes
+        
         # --- NUEVO: DEBOUNCE PARA REDIMENSIONAMIENTO ---
         self.resize_after_id = None
         self.RESIZE_DELAY = 200  # millisegundos
         
-        try:
-            self.original_image = Image.open(BACKGROUND_IMAGE_PATH)
-            self.background_image_ctk = CTkImage(self.original_image, size=(800, 800)) 
-            self.background_label = CTkLabel(self, image=self.background_image_ctk, text="")
-            self.background_label.place(x=0, y=0, relwidth=1, relheight=1)
-            self.bind("<Configure>", self._resize_background_image)
-        except:
-            self.original_image = None
-            self.background_label = None
+        # --- FONDO EN DOS FASES ---
+        # Al redimensionar se muestra enseguida un escalado rápido de una copia chica y
+        # el LANCZOS se hace en un hilo. Los resultados quedan en una caché LRU por
+        # tamaño, redondeado hacia arriba a múltiplos de PASO_FONDO píxeles
+        self.PASO_FONDO = 32
+        self.MAX_CACHE_FONDOS = 6
+        self.LADO_PREVIA = 320
+        self.cache_fondos = OrderedDict()   # (ancho, alto) -> CTkImage
+        self.fondo_pedido = None            # último tamaño pedido; un resultado viejo se guarda pero no se muestra
+        self.fondos_listos = queue.Queue()  # (tamaño, imagen) que terminó el hilo
+        # Un solo hilo hace los LANCZOS, siempre del último tamaño pedido: arrastrar el
+        # borde de la ventana no lanza varios remuestreos a la vez
+        self.aviso_fondo = threading.Event()
+        self.hilo_reescalado = None
+        self.bind("<<FondoListo>>", self._aplicar_fondos_listos)
+        
+        # La imagen de fondo se decodifica en un hilo: la ventana se dibuja sin esperarla
+        self.original_image = None
+        self.imagen_previa = None
+        self.background_label = None
+        self.fondo_cargado = queue.Queue()
+        self.bind("<<FondoCargado>>", self._colocar_fondo)
+        pantalla = (self.winfo_screenwidth(), self.winfo_screenheight())
+        self.hilo_fondo = threading.Thread(target=self._cargar_fondo, args=(BACKGROUND_IMAGE_PATH, pantalla), daemon=True)
+        self.hilo_fondo.start()
+        self.after(self.INTERVALO_RESPALDO, self._esperar_fondo)
 
         self.login_frame = CTkFrame(self, fg_color="transparent")
         w_login = auth.create_login_widgets(self.login_frame, self.on_login_click, self.show_register, self.show_recovery)
@@ -43,6 +105,31 @@ class ChatApp(CTk):
         self.login_pass = w_login["pass_entry"]
         self.btn_login = w_login["login_button"]
         
+        # Registro, recuperación y chat se construyen la primera vez que se muestran
+        self.reg_frame = None
+        self.rec_frame = None
+        self.chat_frame = None
+        
+        self.show_login()
+        self.after(self.INTERVALO_RESPALDO, self.procesar_cola)
+        self.arranque["ventana"] = time.perf_counter()
+        # El primer cuadro se mide cuando la ventana queda mapeada en pantalla
+        self.bind("<Map>", self._informe_arranque, add="+")
+
+    def _informe_arranque(self, event):
+        # <Map> llega también por cada widget hijo, y de nuevo al restaurar la ventana
+        if event.widget is not self or "primer_cuadro" in self.arranque: return
+        a = self.arranque; a["primer_cuadro"] = time.perf_counter()
+        print(f"⏱️ [ARRANQUE] Importación {(a['interfaz'] - a['inicio']) * 1000:.0f} ms, "
+              f"widgets {(a['ventana'] - a['interfaz']) * 1000:.0f} ms, "
+              f"primer cuadro {(a['primer_cuadro'] - a['inicio']) * 1000:.0f} ms")
+
+    def _mensaje(self, title, message):
+        from CTkMessagebox import CTkMessagebox  # se importa al primer aviso, no al arrancar
+        return CTkMessagebox(title=title, message=message)
+
+    # --- PANTALLAS DIFERIDAS ---
+    def _crear_registro(self):
         self.reg_frame = CTkFrame(self, fg_color="transparent")
         w_reg = auth.create_register_widgets(self.reg_frame, self.on_register_click, self.show_login)
         self.reg_user = w_reg["user_entry"]
@@ -52,20 +139,62 @@ class ChatApp(CTk):
         self.reg_ans = w_reg["ans_entry"]
         self.btn_reg = w_reg["register_button"]
 
+    def _crear_recuperacion(self):
         self.rec_frame = CTkFrame(self, fg_color="transparent")
         w_rec = auth.create_recovery_widgets(self.rec_frame, self.on_rec_search_click, self.on_rec_reset_click, self.show_login)
         self.rec_user = w_rec["user_entry"]
         self.rec_lbl_q = w_rec["lbl_question"]
         self.rec_ans = w_rec["ans_entry"]
         self.rec_new_pass = w_rec["new_pass_entry"]
-        
-        self.chat_frame = CTkFrame(self, fg_color=COLOR_FONDO_CHAT)
-        
-        self.show_login()
-        self.after(100, self.procesar_cola)
+
+    def _ocultar_pantallas(self, *pantallas):
+        for frame in pantallas:
+            if frame is not None: frame.place_forget()
+
+    # --- FONDO ---
+    def _cargar_fondo(self, ruta, pantalla):
+        """Hilo: decodifica la imagen ya reducida al tamaño de la pantalla (draft de JPEG)
+        y arma la copia chica para la primera fase de redimensionamiento"""
+        inicio = time.perf_counter()
+        try:
+            from PIL import Image
+            imagen = Image.open(ruta)
+            imagen.draft("RGB", pantalla)   # el decodificador JPEG reduce por 1/2, 1/4 u 1/8 sin leer a tamaño completo
+            imagen = imagen.convert("RGB")
+            imagen.thumbnail(pantalla, Image.Resampling.LANCZOS)
+            previa = imagen.copy()
+            previa.thumbnail((self.LADO_PREVIA, self.LADO_PREVIA), Image.Resampling.BILINEAR)
+        except Exception as e:
+            print(f"Error cargando imagen de fondo: {e}"); return
+        self.fondo_cargado.put((imagen, previa, time.perf_counter() - inicio))
+        try: self.event_generate("<<FondoCargado>>", when="tail")
+        except (tk.TclError, RuntimeError): pass  # ventana cerrándose
+
+    def _esperar_fondo(self):
+        """Respaldo de <<FondoCargado>>: si el hilo terminó antes de que corriera
+        mainloop, event_generate falló y el aviso se perdió"""
+        vivo = self.hilo_fondo.is_alive()
+        if not self.fondo_cargado.empty(): self._colocar_fondo()
+        elif vivo: self.after(self.INTERVALO_RESPALDO, self._esperar_fondo)
+
+    def _colocar_fondo(self, event=None):
+        """Crea la etiqueta de fondo con la imagen ya cargada y la ajusta a la ventana"""
+        if self.fondo_cargado.empty(): return
+        self.original_image, self.imagen_previa, segundos = self.fondo_cargado.get()
+        print(f"⏱️ [ARRANQUE] Fondo cargado en {segundos * 1000:.0f} ms")
+        self.background_image_ctk = CTkImage(self.original_image, size=(800, 800))
+        self.background_label = CTkLabel(self, image=self.background_image_ctk, text="")
+        # Si ya se entró al chat, el fondo queda guardado para cuando se vuelva al login
+        if not (self.chat_frame is not None and self.chat_frame.winfo_manager()):
+            self.background_label.place(x=0, y=0, relwidth=1, relheight=1)
+        self.background_label.lower()
+        self.bind("<Configure>", self._resize_background_image)
+        if self.winfo_width() > 1: self._do_resize_background(self.winfo_width(), self.winfo_height())
 
     def _resize_background_image(self, event):
         """Redimensiona imagen de fondo con debounce de 200ms"""
+        # <Configure> llega también por cada widget hijo: solo interesa la ventana
+        if event.widget is not self: return
         # Cancelar el anterior scheduled resize si existe
         if self.resize_after_id is not None:
             self.after_cancel(self.resize_after_id)
@@ -79,22 +208,60 @@ class ChatApp(CTk):
             if width == 0 or height == 0:
                 return
             
+            # Redondeo hacia arriba: la imagen cubre la ventana y tamaños parecidos comparten entrada
+            tam = (-(-width // self.PASO_FONDO) * self.PASO_FONDO, -(-height // self.PASO_FONDO) * self.PASO_FONDO)
+            self.fondo_pedido = tam
             try:
-                res_img = self.original_image.resize((width, height), Image.Resampling.LANCZOS)
-                self.bg_ctk = CTkImage(light_image=res_img, dark_image=res_img, size=(width, height))
-                self.background_label.configure(image=self.bg_ctk)
-                self.background_label.lower()
+                from PIL import Image  # ya importado por _cargar_fondo
+                if tam in self.cache_fondos:
+                    self.cache_fondos.move_to_end(tam)
+                    self._mostrar_fondo(self.cache_fondos[tam])
+                else:
+                    # Fase 1: escalado rápido de la copia chica; fase 2: LANCZOS en segundo plano
+                    rapida = self.imagen_previa.resize(tam, Image.Resampling.BILINEAR)
+                    self._mostrar_fondo(CTkImage(light_image=rapida, dark_image=rapida, size=tam))
+                    if self.hilo_reescalado is None:
+                        self.hilo_reescalado = threading.Thread(target=self._reescalar_fondos, daemon=True)
+                        self.hilo_reescalado.start()
+                    self.aviso_fondo.set()
             except Exception as e:
                 print(f"Error redimensionando imagen: {e}")
         
         self.resize_after_id = None
 
+    def _reescalar_fondos(self):
+        """Hilo: remuestreo de calidad del último tamaño pedido (Pillow libera el GIL
+        mientras redimensiona). Los tamaños pedidos mientras trabaja se saltean"""
+        from PIL import Image
+        hecho = None
+        while True:
+            self.aviso_fondo.wait(); self.aviso_fondo.clear()
+            tam = self.fondo_pedido
+            if tam == hecho: continue
+            try: imagen = self.original_image.resize(tam, Image.Resampling.LANCZOS)
+            except Exception as e: print(f"Error redimensionando imagen: {e}"); continue
+            hecho = tam
+            self.fondos_listos.put((tam, imagen))
+            try: self.event_generate("<<FondoListo>>", when="tail")
+            except (tk.TclError, RuntimeError): return  # ventana cerrándose
+
+    def _aplicar_fondos_listos(self, event=None):
+        while not self.fondos_listos.empty():
+            tam, imagen = self.fondos_listos.get()
+            ctk_img = CTkImage(light_image=imagen, dark_image=imagen, size=tam)
+            self.cache_fondos[tam] = ctk_img
+            while len(self.cache_fondos) > self.MAX_CACHE_FONDOS: self.cache_fondos.popitem(last=False)
+            if tam == self.fondo_pedido: self._mostrar_fondo(ctk_img)
+
+    def _mostrar_fondo(self, ctk_img):
+        self.bg_ctk = ctk_img
+        self.background_label.configure(image=ctk_img)
+        self.background_label.lower()
+
     # --- NAVEGACIÓN ---
     def show_login(self):
         # Ocultar otras pantallas
-        self.reg_frame.place_forget()
-        self.chat_frame.place_forget()
-        self.rec_frame.place_forget()
+        self._ocultar_pantallas(self.reg_frame, self.chat_frame, self.rec_frame)
         
         # Fondo
         if self.background_label: 
@@ -107,17 +274,23 @@ class ChatApp(CTk):
         
         self.login_frame.place(relx=0.5, rely=0.5, anchor="center")
         self.login_frame.tkraise()
+        self.network_manager.precalentar()
 
     def show_register(self):
-        self.login_frame.place_forget(); self.rec_frame.place_forget()
+        if self.reg_frame is None: self._crear_registro()
+        self._ocultar_pantallas(self.login_frame, self.rec_frame)
         self.reg_frame.place(relx=0.5, rely=0.5, anchor="center"); self.reg_frame.tkraise()
+        self.network_manager.precalentar()
 
     def show_recovery(self):
-        self.login_frame.place_forget(); self.reg_frame.place_forget()
+        if self.rec_frame is None: self._crear_recuperacion()
+        self._ocultar_pantallas(self.login_frame, self.reg_frame)
         self.rec_frame.place(relx=0.5, rely=0.5, anchor="center"); self.rec_frame.tkraise()
+        self.network_manager.precalentar()
         
     def show_chat(self):
-        self.login_frame.place_forget(); self.reg_frame.place_forget(); self.rec_frame.place_forget()
+        if self.chat_frame is None: self.chat_frame = CTkFrame(self, fg_color=COLOR_FONDO_CHAT)
+        self._ocultar_pantallas(self.login_frame, self.reg_frame, self.rec_frame)
         if self.background_label: self.background_label.place_forget()
         if not self.attributes('-fullscreen'): self.geometry("900x600")
         self.chat_frame.place(x=0, y=0, relwidth=1, relheight=1)
@@ -140,6 +313,7 @@ class ChatApp(CTk):
         
         self.contenedor_botones_salas = CTkScrollableFrame(self.barra_lateral, fg_color="transparent")
         self.contenedor_botones_salas.pack(fill="both", expand=True)
+        self.botones_salas = {}   # nombre de sala -> CTkButton, en el orden de la barra
 
         # 2. Panel Derecho
         self.panel_derecho = CTkFrame(self.chat_frame, width=150, fg_color="#111111", corner_radius=0)
@@ -165,6 +339,8 @@ class ChatApp(CTk):
         self.chat_area = CTkTextbox(self.chat_area_frame, state="disabled", font=("Arial", 12), wrap=tk.WORD, fg_color=COLOR_FONDO_CHAT, text_color=COLOR_TEXTO_CHAT)
         self.chat_area.pack(fill="both", expand=True, padx=10, pady=10)
         self.chat_area.tag_config("sistema", foreground="gray"); self.chat_area.tag_config("alias", foreground=COLOR_TEXTO_ALIAS)
+        for evento in ("<MouseWheel>", "<Button-4>", "<Button-5>", "<Prior>", "<Next>"):
+            self.chat_area.bind(evento, self._al_desplazar_chat, add="+")
 
         frm_in = CTkFrame(self.chat_area_frame, fg_color="transparent")
         frm_in.pack(fill="x", padx=10, pady=10)
@@ -175,26 +351,236 @@ class ChatApp(CTk):
 
     # --- DINÁMICA DE SALAS ---
     def actualizar_lista_salas(self, lista_nombres):
-        # Limpiar botones viejos
-        for widget in self.contenedor_botones_salas.winfo_children():
-            widget.destroy()
-        
-        # Crear nuevos
+        """Lista completa (ROOMS_UPDATE): solo se tocan los botones de salas nuevas o borradas"""
+        for sala in [s for s in set(self.botones_salas) | set(self.cache_salas) if s not in lista_nombres]:
+            self.quitar_sala(sala)
+        anterior = None
         for sala in lista_nombres:
-            btn = CTkButton(self.contenedor_botones_salas, text=sala, font=("Arial", 14), anchor="w", fg_color="transparent", text_color=COLOR_TEXTO_CHAT, hover_color="#333333", command=lambda s=sala: self.cambiar_sala(s))
-            btn.pack(fill="x", padx=5, pady=2)
+            if sala not in self.botones_salas: self.agregar_sala(sala, despues_de=anterior, al_inicio=anterior is None)
+            anterior = sala
+        self.botones_salas = {s: self.botones_salas[s] for s in lista_nombres}
+        if self._ventana_miembros_abierta(): self._armar_miembros()
+
+    def agregar_sala(self, sala, despues_de=None, al_inicio=False):
+        """Agrega el botón de la sala (ROOM_ADDED): al final, tras el de despues_de o al principio"""
+        if sala in self.botones_salas: return
+        btn = CTkButton(self.contenedor_botones_salas, text=sala, font=("Arial", 14), anchor="w", fg_color="transparent", text_color=COLOR_TEXTO_CHAT, hover_color="#333333", command=lambda s=sala: self.cambiar_sala(s))
+        if despues_de in self.botones_salas: btn.pack(fill="x", padx=5, pady=2, after=self.botones_salas[despues_de])
+        elif al_inicio and self.botones_salas: btn.pack(fill="x", padx=5, pady=2, before=next(iter(self.botones_salas.values())))
+        else: btn.pack(fill="x", padx=5, pady=2)
+        self.botones_salas[sala] = btn
+
+    def quitar_sala(self, sala):
+        """Quita el botón de la sala (ROOM_REMOVED) y lo guardado de ella: una sala nueva
+        con el mismo nombre no debe mostrar mensajes de la borrada"""
+        btn = self.botones_salas.pop(sala, None)
+        if btn is not None: btn.destroy()
+        self.cache_salas.pop(sala, None)
 
     def cambiar_sala(self, sala):
         self.chat_area.configure(state="normal")
-        self.chat_area.delete("1.0", tk.END)
-        self.chat_area.insert(tk.END, f"[SISTEMA] Conectando a {sala}...\n", "sistema")
-        self.chat_area.configure(state="disabled")
-        self.pin_label.configure(text="Cargando...")
-        self.network_manager.send_msg(f"/join {sala}")
+        self.chat_area.delete("1.0", tk.END); self.bloques_chat.clear()
+        self.sala_actual = sala; self.historial_cursor = None; self.historial_hay_mas = False; self.pidiendo_historial = False
+        self._enganchar_vivo()
+        # Lo que llegue antes del historial de la sala nueva puede ser aún de la anterior
+        self.cache_activa = False
+        desde = self._mostrar_desde_cache(sala)
+        if desde is None:
+            aviso = f"[SISTEMA] Conectando a {sala}...\n"
+            self.chat_area.insert(tk.END, aviso, "sistema"); self._anotar_bloque(aviso)
+            self.pin_label.configure(text="Cargando...")
+        else: self._mostrar_pin(self.cache_salas[sala].get("pin", ""))
+        self.chat_area.configure(state="disabled"); self.chat_area.see(tk.END)
+        self.network_manager.unirse(sala, desde)
         if hasattr(self, 'chat_header'): self.chat_header.configure(text=sala)
 
+    # --- CACHÉ DE SALAS ---
+    def _cache_sala(self, sala):
+        """Entrada de la sala en la caché (la crea si falta y la marca como la más reciente)"""
+        entrada = self.cache_salas.get(sala)
+        if entrada is None:
+            entrada = self.cache_salas[sala] = {"mensajes": {}, "hay_mas": False, "pin": ""}
+            while len(self.cache_salas) > self.MAX_SALAS_CACHE: self.cache_salas.popitem(last=False)
+        else: self.cache_salas.move_to_end(sala)
+        return entrada
+
+    def _guardar_en_cache(self, sala, mensajes, reemplazar=False, hay_mas=None):
+        """Agrega [(id, texto)] a la caché de la sala. Texto None: mensaje propio del que solo se conoce el id"""
+        entrada = self._cache_sala(sala)
+        if reemplazar: entrada["mensajes"] = {}
+        entrada["mensajes"].update(mensajes)
+        if hay_mas is not None: entrada["hay_mas"] = hay_mas
+        sobran = len(entrada["mensajes"]) - self.MAX_MENSAJES_CACHE
+        if sobran > 0:
+            for id_msg in sorted(entrada["mensajes"])[:sobran]: del entrada["mensajes"][id_msg]
+            entrada["hay_mas"] = True
+
+    def _mostrar_desde_cache(self, sala):
+        """Inserta los mensajes guardados de la sala. Retorna el id desde el que pedir lo nuevo, o None si no hay nada"""
+        entrada = self.cache_salas.get(sala)
+        if not entrada: return None
+        self.cache_salas.move_to_end(sala)
+        mensajes = []
+        for id_msg in sorted(entrada["mensajes"]):
+            texto = entrada["mensajes"][id_msg]
+            if texto is None: break   # a partir de un mensaje propio sin texto se pide todo al servidor
+            mensajes.append((id_msg, texto))
+        if not mensajes: return None
+        for id_msg in [i for i in entrada["mensajes"] if i > mensajes[-1][0]]: del entrada["mensajes"][id_msg]
+        self.chat_area.insert(tk.END, "".join(texto + "\n\n" for _, texto in mensajes))
+        for id_msg, texto in mensajes: self._anotar_bloque(texto + "\n\n", id_msg)
+        self._recortar_chat()
+        self.historial_cursor = mensajes[0][0]; self.historial_hay_mas = entrada["hay_mas"]
+        return mensajes[-1][0]
+
+    # --- HISTORIAL POR PÁGINAS ---
+    def _al_desplazar_chat(self, event=None):
+        # La vista se mueve después del evento: se revisa cuando Tk quede libre
+        self.after_idle(self._pedir_pagina_anterior)
+        if not self.vista_en_vivo: self.after_idle(self._volver_si_al_final)
+
+    def _pedir_pagina_anterior(self):
+        """Al llegar arriba del todo, pide los mensajes anteriores al más antiguo mostrado"""
+        if self.pidiendo_historial or not self.historial_hay_mas or self.historial_cursor is None: return
+        if self.chat_area.yview()[0] > 0: return
+        self.pidiendo_historial = True
+        self.network_manager.pedir_historial(self.sala_actual, antes=self.historial_cursor)
+
+    def _mostrar_historial(self, datos):
+        """Inserta una página de HISTORY_BATCH según su modo (ultimos / antes / desde)"""
+        modo = datos.get("modo", "ultimos")
+        if datos.get("sala") != self.sala_actual and modo != "ultimos": return  # respuesta de una sala que ya se dejó
+        self.sala_actual = datos.get("sala", self.sala_actual)
+        mensajes = datos.get("mensajes", [])
+        self.cache_activa = True
+        self._guardar_en_cache(self.sala_actual, [(m["id"], m["texto"]) for m in mensajes], reemplazar=modo == "ultimos",
+                               hay_mas=None if modo == "desde" else datos.get("hay_mas", False))
+        
+        # Construir string con todos los mensajes e insertar todo de una vez
+        contenido = "".join(m["texto"] + "\n\n" for m in mensajes)
+        self.chat_area.configure(state="normal")
+        # Una página inicial sobre una sala ya cargada (p. ej. al reconectar tras mucho tiempo) la reemplaza
+        if modo == "ultimos" and self.historial_cursor is not None: self.chat_area.delete("1.0", tk.END); self.bloques_chat.clear()
+        if modo == "desde" and not self.vista_en_vivo and not self.volviendo_al_vivo:
+            # Delta de una reconexión con la vista en páginas viejas: queda en la caché
+            self.chat_area.configure(state="disabled")
+            self.network_manager.marcar_visto(self.sala_actual, mensajes[-1]["id"] if mensajes else None)
+            return
+        if modo == "antes":
+            # Arriba, manteniendo a la vista la línea que el usuario estaba leyendo
+            self.pidiendo_historial = False
+            lineas_previas = int(self.chat_area.index("end-1c").split(".")[0])
+            self.chat_area.insert("1.0", contenido)
+            for m in reversed(mensajes): self._anotar_bloque(m["texto"] + "\n\n", m["id"], al_inicio=True)
+            nuevas = int(self.chat_area.index("end-1c").split(".")[0]) - lineas_previas
+            self._recortar_chat_abajo()
+            self.chat_area.configure(state="disabled")
+            self.chat_area.yview(f"{nuevas + 1}.0")
+        else:
+            self.chat_area.insert(tk.END, contenido)
+            for m in mensajes: self._anotar_bloque(m["texto"] + "\n\n", m["id"])
+            self.chat_area.configure(state="disabled")
+            self.chat_area.see(tk.END)
+        if modo != "desde":
+            if mensajes: self.historial_cursor = mensajes[0]["id"]
+            self.historial_hay_mas = datos.get("hay_mas", False)
+        if modo != "antes":
+            en_espera = self.lineas_en_espera if self.volviendo_al_vivo else []
+            ultimo = mensajes[-1]["id"] if mensajes else self.ultimo_id_vista
+            self._enganchar_vivo()
+            # Lo que llegó mientras tanto y no vino en la página (sistema, propios, posteriores)
+            self._insertar_lineas([b for b in en_espera if b[0] is None or ultimo is None or b[0] > ultimo])
+            self._recortar_chat()
+            # Al reconectar se piden solo los mensajes posteriores al último mostrado
+            self.network_manager.marcar_visto(self.sala_actual, mensajes[-1]["id"] if mensajes else None)
+
+    # --- RESUMEN IA EN VIVO ---
+    def _mostrar_resumen(self, msg):
+        """Abre, amplía o cierra el resumen a medida que llegan SUMMARY_START / CHUNK / END"""
+        tipo, contenido = msg.split(":", 1)
+        self.chat_area.configure(state="normal")
+        if tipo == "SUMMARY_START":
+            sala = json.loads(contenido).get("sala", "")
+            texto = f"\n✨ --- RESUMEN IA ({sala}) --- ✨\n"; self.chat_area.insert(tk.END, texto)
+        elif tipo == "SUMMARY_CHUNK":
+            # Cada fragmento se agrega a continuación del anterior, sin saltos
+            texto = contenido; self.chat_area.insert(tk.END, texto)
+        elif tipo == "SUMMARY_END":
+            error = json.loads(contenido).get("error")
+            if error: self.chat_area.insert(tk.END, f"\n{error}", "sistema")
+            self.chat_area.insert(tk.END, "\n----------------------------------------\n\n")
+            texto = (f"\n{error}" if error else "") + "\n----------------------------------------\n\n"
+        else: texto = ""
+        self._anotar_bloque(texto); self._recortar_chat()
+        self.chat_area.configure(state="disabled"); self.chat_area.see(tk.END)
+
     # --- FUNCIONALIDAD ---
-    def ver_miembros(self): self.network_manager.solicitar_usuarios()
+    def ver_miembros(self):
+        if self.presencia is None: self.network_manager.solicitar_usuarios()  # servidor anterior: lista completa
+        else: self._abrir_ventana_presencia()
+
+    # --- PRESENCIA ---
+    def _aplicar_presencia(self, delta):
+        """Aplica un PRESENCE_DELTA al modelo local y, si está abierta, a la ventana de miembros"""
+        if self.presencia is None: return   # llegó antes de la lista inicial, que ya lo incluye
+        ev, id_u = delta.pop("ev"), delta.pop("id")
+        # Solo "entro" trae todos los datos: un cambio de alguien desconocido dejaría una entrada sin alias
+        if ev != "entro" and id_u not in self.presencia: return
+        if ev == "salio": self.presencia.pop(id_u, None)
+        else: self.presencia.setdefault(id_u, {}).update(delta)
+        if not self._ventana_miembros_abierta(): return
+        if ev in ("rol", "silencio") and id_u in self.etiquetas_miembros:
+            texto, color = self._formato_miembro(self.presencia[id_u])
+            self.etiquetas_miembros[id_u][0].configure(text=texto, text_color=color)
+        else:
+            self._quitar_etiqueta_miembro(id_u)
+            if ev != "salio": self._etiqueta_miembro(id_u, self.presencia[id_u])
+
+    def _ventana_miembros_abierta(self):
+        return self.ventana_miembros is not None and self.ventana_miembros.winfo_exists()
+
+    def _abrir_ventana_presencia(self):
+        if self._ventana_miembros_abierta(): self.ventana_miembros.lift(); return
+        top = CTkToplevel(self)
+        top.title("Miembros en Línea"); top.geometry("400x500")
+        CTkLabel(top, text="Usuarios Conectados", font=("Arial", 20, "bold")).pack(pady=10)
+        self.scroll_miembros = CTkScrollableFrame(top, width=350, height=400); self.scroll_miembros.pack(padx=10, pady=10, fill="both", expand=True)
+        self.ventana_miembros = top
+        self._armar_miembros()
+
+    def _armar_miembros(self):
+        """Arma la ventana de miembros desde el modelo local (al abrirla o si cambian las salas)"""
+        for w in self.scroll_miembros.winfo_children(): w.destroy()
+        self.secciones_miembros = {}; self.etiquetas_miembros = {}
+        for sala in self.botones_salas:
+            marco = CTkFrame(self.scroll_miembros, fg_color="transparent"); marco.pack(fill="x")
+            CTkLabel(marco, text=sala, font=("Arial", 16, "bold"), text_color="#00AFFF", anchor="w").pack(fill="x", pady=(10, 5))
+            vacio = CTkLabel(marco, text="   (Vacío)", font=("Arial", 12, "italic"), text_color="gray", anchor="w"); vacio.pack(fill="x")
+            self.secciones_miembros[sala] = {"marco": marco, "vacio": vacio, "n": 0}
+        for id_u, u in self.presencia.items(): self._etiqueta_miembro(id_u, u)
+
+    def _formato_miembro(self, u):
+        """(texto, color) como en la lista del servidor"""
+        texto = u["alias"] + (f" [{u['rol'].upper()}]" if u["rol"] != "estudiante" else "") + (" 🔇" if u["muted"] else "")
+        color = {"admin": "#FFD700", "docente": "#00FF7F"}.get(u["rol"], "white")
+        return f"   • {texto}", color
+
+    def _etiqueta_miembro(self, id_u, u):
+        seccion = self.secciones_miembros.get(u["sala"])
+        if seccion is None: return
+        texto, color = self._formato_miembro(u)
+        etiqueta = CTkLabel(seccion["marco"], text=texto, font=("Arial", 14), text_color=color, anchor="w"); etiqueta.pack(fill="x", pady=2)
+        seccion["n"] += 1; seccion["vacio"].pack_forget()
+        self.etiquetas_miembros[id_u] = (etiqueta, u["sala"])
+
+    def _quitar_etiqueta_miembro(self, id_u):
+        etiqueta, sala = self.etiquetas_miembros.pop(id_u, (None, None))
+        if etiqueta is None: return
+        etiqueta.destroy()
+        seccion = self.secciones_miembros.get(sala)
+        if seccion is not None:
+            seccion["n"] -= 1
+            if not seccion["n"]: seccion["vacio"].pack(fill="x")
 
     def mostrar_ventana_miembros(self, json_data):
         try:
@@ -217,15 +603,21 @@ class ChatApp(CTk):
     def on_enviar_mensaje(self, event=None):
         m = self.msg_entry.get()
         if m:
+            # Con la vista en páginas viejas, primero se vuelve al final: lo propio se muestra debajo de lo nuevo
+            self._volver_al_vivo()
             if self.network_manager.send_msg(m):
-                self.chat_area.configure(state="normal")
-                self.chat_area.insert(tk.END, f"{self.alias}: ", "alias")
-                self.chat_area.insert(tk.END, f"{m}\n\n") 
-                self.chat_area.configure(state="disabled"); self.chat_area.see(tk.END)
+                self._insertar_lineas([(None, [(f"{self.alias}: ", "alias"), (f"{m}\n\n", "")])])
             self.msg_entry.delete(0, tk.END)
 
+    def _mostrar_pin(self, texto_pin):
+        if texto_pin: self.pin_label.configure(text=texto_pin, font=("Arial", 12, "bold"), text_color="white")
+        else: self.pin_label.configure(text="(Ningún mensaje fijado)", font=("Arial", 12, "italic"), text_color="#888888")
+
     def on_salir_chat(self):
         self.network_manager.disconnect(); self.show_login()
+        self.cache_salas.clear(); self.cache_activa = False
+        self.presencia = None
+        if self._ventana_miembros_abierta(): self.ventana_miembros.destroy()
         self.alias = ""; self.login_user.delete(0, tk.END); self.login_pass.delete(0, tk.END)
 
     def on_login_click(self):
@@ -237,8 +629,8 @@ class ChatApp(CTk):
     def on_register_click(self):
         u, p, c = self.reg_user.get(), self.reg_pass.get(), self.reg_conf.get()
         q, a = self.reg_quest.get(), self.reg_ans.get()
-        if not all([u,p,c,q,a]): return CTkMessagebox(title="Error", message="Faltan datos")
-        if p != c: return CTkMessagebox(title="Error", message="Pass no coincide")
+        if not all([u,p,c,q,a]): return self._mensaje(title="Error", message="Faltan datos")
+        if p != c: return self._mensaje(title="Error", message="Pass no coincide")
         self.btn_reg.configure(state="disabled", text="...")
         threading.Thread(target=self.network_manager.register, args=(u, p, q, a), daemon=True).start()
 
@@ -252,77 +644,206 @@ class ChatApp(CTk):
         u, a, np = self.rec_user.get(), self.rec_ans.get(), self.rec_new_pass.get()
         if all([u, a, np]): threading.Thread(target=self.network_manager.recover_step2, args=(u, a, np), daemon=True).start()
 
-    def procesar_cola(self):
+    def _avisar_mensajes(self):
+        """Llamado desde el hilo de red: despierta a la interfaz una sola vez por tanda"""
+        if self._aviso_pendiente: return
+        self._aviso_pendiente = True
+        try: self.event_generate("<<MensajesNuevos>>", when="tail")
+        except (tk.TclError, RuntimeError): self._aviso_pendiente = False  # ventana cerrándose
+
+    def procesar_cola(self, respaldo=True):
+        """Atiende un aviso o el respaldo periódico. Con una tanda ya programada no
+        hace nada: esa cadena sigue hasta vaciar la cola"""
+        if respaldo: self.after(self.INTERVALO_RESPALDO, self.procesar_cola)
+        if self._tanda is None: self._procesar_tanda()
+
+    def _procesar_tanda(self):
+        """Procesa mensajes durante un tiempo acotado. Las líneas de chat seguidas se
+        insertan juntas, con un solo cambio de estado y un solo desplazamiento"""
+        self._tanda = None
+        limite = time.perf_counter() + self.PRESUPUESTO_COLA
+        lineas = []
         try:
-            while not self.cola_mensajes.empty():
-                msg = self.cola_mensajes.get()
-                if msg.startswith("[LOGIN]"):
-                    if "Bienvenido" in msg: self.alias = self.login_user.get(); self.show_chat()
-                    else: CTkMessagebox(title="Error", message=msg.split(" ", 1)[1]); self.btn_login.configure(state="normal", text="Login")
-                elif msg.startswith("[REGISTRO]"):
-                    CTkMessagebox(title="Info", message=msg)
-                    if "exitoso" in msg: self.show_login()
-                    self.btn_reg.configure(state="normal", text="Registrar")
-                elif msg.startswith("[RECUPERACION_DATA]"):
-                    d = msg.split(" ", 1)[1]
-                    self.rec_lbl_q.configure(text=f"Pregunta: {d.split(':', 1)[1]}" if "PREGUNTA:" in d else "Usuario no encontrado")
-                elif msg.startswith("[RECUPERACION_RESULT]"):
-                    CTkMessagebox(title="Info", message=msg.split(" ", 1)[1])
-                    if "EXITO" in msg: self.show_login()
-                elif msg.startswith("PIN_UPDATE:"):
-                    texto_pin = msg.split(":", 1)[1]
-                    if hasattr(self, 'pin_label'):
-                        if texto_pin: self.pin_label.configure(text=texto_pin, font=("Arial", 12, "bold"), text_color="white")
-                        else: self.pin_label.configure(text="(Ningún mensaje fijado)", font=("Arial", 12, "italic"), text_color="#888888")
-                
-                # --- HISTORIAL EN LOTE (OPTIMIZADO) ---
-                elif msg.startswith("HISTORY_BATCH:"):
-                    json_historial = msg.split(":", 1)[1]
-                    try:
-                        datos = json.loads(json_historial)
-                        if hasattr(self, 'chat_area'):
-                            mensajes = datos.get("mensajes", [])
-                            if mensajes:
-                                # Cambiar estado una sola vez
-                                self.chat_area.configure(state="normal")
-                                
-                                # Construir string con todos los mensajes
-                                contenido = ""
-                                for m in mensajes:
-                                    contenido += m + "\n\n"
-                                
-                                # Insertar todo de una vez
-                                self.chat_area.insert(tk.END, contenido)
-                                
-                                # Cambiar estado y desplazar
-                                self.chat_area.configure(state="disabled")
-                                self.chat_area.see(tk.END)
-                    except Exception as e:
-                        print(f"Error parseando historial: {e}")
-                
-                elif msg.startswith("ROOMS_UPDATE:"):
-                    json_salas = msg.split(":", 1)[1]
-                    try:
-                        lista = json.loads(json_salas)
-                        if hasattr(self, 'actualizar_lista_salas'):
-                            self.actualizar_lista_salas(lista)
-                    except: pass
-                
-                elif msg.startswith("USERS_LIST:"):
-                    json_data = msg.split(":", 1)[1]
-                    self.mostrar_ventana_miembros(json_data)
-                elif hasattr(self, 'chat_area'):
-                    self.chat_area.configure(state="normal")
-                    if msg.startswith("[SISTEMA]"): self.chat_area.insert(tk.END, msg + "\n", "sistema")
-                    elif ":" in msg:
-                        p = msg.split(":", 1)
-                        if len(p)==2 and p[0] != self.alias: self.chat_area.insert(tk.END, f"{p[0]}:", "alias"); self.chat_area.insert(tk.END, f"{p[1]}\n\n")
-                        elif len(p)==2 and p[0] == self.alias: pass 
-                        else: self.chat_area.insert(tk.END, msg + "\n\n")
-                    else: self.chat_area.insert(tk.END, msg + "\n\n")
-                    self.chat_area.configure(state="disabled"); self.chat_area.see(tk.END)
+            while time.perf_counter() < limite:
+                try: msg = self.cola_mensajes.get_nowait()
+                except queue.Empty: break
+                if self._es_linea_chat(msg):
+                    if hasattr(self, 'chat_area'): lineas.append(self._segmentos_chat(msg))
+                    continue
+                # Antes de cualquier otro mensaje se vuelca lo acumulado, para respetar el orden
+                self._insertar_lineas(lineas); lineas = []
+                self._procesar_mensaje(msg)
         finally:
-            self.after(100, self.procesar_cola)
+            self._insertar_lineas(lineas)
+            # Cola vacía: termina la cadena y el hilo de red puede volver a avisar
+            if self.cola_mensajes.empty(): self._aviso_pendiente = False
+            # Lo que no entró en esta tanda (o llegó justo sin avisar) sigue en la próxima, tras atender los eventos de Tk
+            if not self.cola_mensajes.empty(): self._tanda = self.after(1, self._procesar_tanda)
+
+    PREFIJOS_PROTOCOLO = ("[LOGIN]", "[REGISTRO]", "[RECUPERACION_DATA]", "[RECUPERACION_RESULT]", "PIN_UPDATE:", "MSG_ID:",
+                          "HISTORY_BATCH:", "ROOMS_UPDATE:", "ROOM_ADDED:", "ROOM_REMOVED:", "USERS_LIST:",
+                          "PRESENCE_SNAPSHOT:", "PRESENCE_DELTA:", "SUMMARY_")
+
+    def _es_linea_chat(self, msg):
+        return not msg.startswith(self.PREFIJOS_PROTOCOLO)
+
+    def _segmentos_chat(self, msg):
+        """(id o None, pares (texto, etiqueta)) de una línea de chat o de sistema"""
+        id_msg = None
+        if msg.startswith("MSG:"):
+            # MSG:<id>:<texto>, de servidores que envían el id de cada mensaje
+            id_msg, msg = msg[4:].split(":", 1); id_msg = int(id_msg)
+            if self.cache_activa: self._guardar_en_cache(self.sala_actual, [(id_msg, msg)])
+        if msg.startswith("[SISTEMA]"): return id_msg, [(msg + "\n", "sistema")]
+        if ":" in msg:
+            autor, texto = msg.split(":", 1)
+            if autor == self.alias: return id_msg, []  # ya se mostró al enviarlo
+            return id_msg, [(f"{autor}:", "alias"), (f"{texto}\n\n", "")]
+        return id_msg, [(msg + "\n\n", "")]
+
+    def _insertar_lineas(self, bloques):
+        """Agrega al final los bloques [(id, segmentos)] con un único insert"""
+        if not self.vista_en_vivo:
+            # Debajo hay mensajes borrados: lo nuevo se muestra al volver al final
+            if self.volviendo_al_vivo: self.lineas_en_espera.extend(bloques)
+            return
+        args = []
+        for id_msg, segmentos in bloques:
+            for texto, etiqueta in segmentos: args.extend((texto, etiqueta))
+            if segmentos: self._anotar_bloque("".join(t for t, _ in segmentos), id_msg)
+        if not args: return
+        self.chat_area.configure(state="normal")
+        self.chat_area.insert(tk.END, *args)
+        self._recortar_chat()
+        self.chat_area.configure(state="disabled"); self.chat_area.see(tk.END)
+
+    # --- LÍMITE DEL CHAT ---
+    def _anotar_bloque(self, texto, id_msg=None, al_inicio=False):
+        """Registra un texto recién insertado en chat_area, para poder recortar por mensajes enteros"""
+        if not texto: return
+        bloque = [id_msg, texto.count("\n"), texto.endswith("\n")]
+        if al_inicio: self.bloques_chat.appendleft(bloque)
+        else: self.bloques_chat.append(bloque)
+
+    def _recortar_chat(self):
+        """Si el chat pasa de MAX_LINEAS_CHAT líneas, borra al menos RECORTE_CHAT de las más
+        antiguas (sin partir mensajes) y deja el cursor del historial para volver a pedirlas"""
+        total = sum(b[1] for b in self.bloques_chat)
+        if total <= self.MAX_LINEAS_CHAT: return
+        borradas = 0; ultimo_id = None
+        recorte = max(self.RECORTE_CHAT, total - self.MAX_LINEAS_CHAT)
+        while self.bloques_chat:
+            id_msg, lineas, cierra = self.bloques_chat.popleft()
+            borradas += lineas
+            if id_msg is not None: ultimo_id = id_msg
+            # Solo se corta al final de una línea completa
+            if borradas >= recorte and cierra: break
+        estado = self.chat_area.cget("state")
+        self.chat_area.configure(state="normal")
+        self.chat_area.delete("1.0", f"{borradas + 1}.0")
+        self.chat_area.configure(state=estado)
+        # Lo borrado vuelve a pedirse por páginas al llegar arriba del todo
+        siguiente = next((b[0] for b in self.bloques_chat if b[0] is not None), None)
+        if siguiente is not None or ultimo_id is not None:
+            self.historial_cursor = siguiente if siguiente is not None else ultimo_id + 1
+            self.historial_hay_mas = True
+
+    def _recortar_chat_abajo(self):
+        """Tras insertar una página anterior: si el chat pasa de MAX_LINEAS_CHAT líneas borra
+        los mensajes más nuevos (enteros) y desengancha la vista del vivo"""
+        total = sum(b[1] for b in self.bloques_chat)
+        if total <= self.MAX_LINEAS_CHAT: return
+        while self.bloques_chat and (total > self.MAX_LINEAS_CHAT or not self.bloques_chat[-1][2]):
+            total -= self.bloques_chat.pop()[1]
+        self.chat_area.delete(f"{total + 1}.0", tk.END)
+        if self.vista_en_vivo or self.volviendo_al_vivo:
+            self.vista_en_vivo = False; self.volviendo_al_vivo = False; self.lineas_en_espera = []
+        self.ultimo_id_vista = next((b[0] for b in reversed(self.bloques_chat) if b[0] is not None), None)
+
+    def _volver_si_al_final(self):
+        if not self.vista_en_vivo and self.chat_area.yview()[1] >= 1.0: self._volver_al_vivo()
+
+    def _volver_al_vivo(self):
+        """Pide lo posterior al último mensaje en pantalla; al llegar la vista vuelve al vivo"""
+        if self.vista_en_vivo or self.volviendo_al_vivo: return
+        self.volviendo_al_vivo = True
+        if self.ultimo_id_vista is None: self.network_manager.pedir_historial(self.sala_actual)
+        else: self.network_manager.pedir_historial(self.sala_actual, desde=self.ultimo_id_vista)
+
+    def _enganchar_vivo(self):
+        self.vista_en_vivo = True; self.volviendo_al_vivo = False; self.lineas_en_espera = []
+
+    def _procesar_mensaje(self, msg):
+        """Mensajes de protocolo (login, historial, salas, pines, resúmenes...)"""
+        if msg.startswith("[LOGIN]"):
+            if "Bienvenido" in msg: self.alias = self.login_user.get(); self.show_chat()
+            else:
+                self._mensaje(title="Error", message=msg.split(" ", 1)[1]); self.btn_login.configure(state="normal", text="Login")
+                self.network_manager.precalentar()
+        elif msg.startswith("[REGISTRO]"):
+            self._mensaje(title="Info", message=msg)
+            if "exitoso" in msg: self.show_login()
+            self.btn_reg.configure(state="normal", text="Registrar")
+        elif msg.startswith("[RECUPERACION_DATA]"):
+            d = msg.split(" ", 1)[1]
+            self.rec_lbl_q.configure(text=f"Pregunta: {d.split(':', 1)[1]}" if "PREGUNTA:" in d else "Usuario no encontrado")
+        elif msg.startswith("[RECUPERACION_RESULT]"):
+            self._mensaje(title="Info", message=msg.split(" ", 1)[1])
+            if "EXITO" in msg: self.show_login()
+        elif msg.startswith("PIN_UPDATE:"):
+            texto_pin = msg.split(":", 1)[1]
+            if self.cache_activa: self._cache_sala(self.sala_actual)["pin"] = texto_pin
+            if hasattr(self, 'pin_label'): self._mostrar_pin(texto_pin)
+        elif msg.startswith("MSG_ID:"):
+            # Id de un mensaje propio: su texto con formato llegará con el próximo historial de la sala
+            if self.cache_activa: self._guardar_en_cache(self.sala_actual, [(int(msg[7:]), None)])
+        
+        # --- HISTORIAL POR PÁGINAS ---
+        elif msg.startswith("HISTORY_BATCH:"):
+            json_historial = msg.split(":", 1)[1]
+            try:
+                datos = json.loads(json_historial)
+                if hasattr(self, 'chat_area'):
+                    self._mostrar_historial(datos)
+            except Exception as e:
+                print(f"Error parseando historial: {e}")
+        
+        elif msg.startswith("ROOMS_UPDATE:"):
+            json_salas = msg.split(":", 1)[1]
+            try:
+                lista = json.loads(json_salas)
+                if hasattr(self, 'botones_salas'):
+                    self.actualizar_lista_salas(lista)
+            except: pass
+        
+        elif msg.startswith(("ROOM_ADDED:", "ROOM_REMOVED:")):
+            tipo, json_sala = msg.split(":", 1)
+            try:
+                sala = json.loads(json_sala)["sala"]
+                if hasattr(self, 'botones_salas'):
+                    if tipo == "ROOM_ADDED": self.agregar_sala(sala)
+                    else: self.quitar_sala(sala)
+                    if self._ventana_miembros_abierta(): self._armar_miembros()
+            except: pass
+        
+        elif msg.startswith("USERS_LIST:"):
+            json_data = msg.split(":", 1)[1]
+            self.mostrar_ventana_miembros(json_data)
+        
+        # --- PRESENCIA ---
+        elif msg.startswith("PRESENCE_SNAPSHOT:"):
+            try:
+                usuarios = json.loads(msg.split(":", 1)[1])["usuarios"]
+                self.presencia = {u.pop("id"): u for u in usuarios}
+                if self._ventana_miembros_abierta(): self._armar_miembros()
+            except Exception as e: print(f"Error parseando presencia: {e}")
+        elif msg.startswith("PRESENCE_DELTA:"):
+            try: self._aplicar_presencia(json.loads(msg.split(":", 1)[1]))
+            except Exception as e: print(f"Error parseando presencia: {e}")
+        
+        # --- RESUMEN IA EN VIVO ---
+        elif msg.startswith("SUMMARY_") and hasattr(self, 'chat_area'):
+            self._mostrar_resumen(msg)
 
     def on_closing(self):
         # Cancelar resize pendiente si existe
@@ -0,0 +1,116 @@
+import queue
+import threading
+from collections import OrderedDict
+
+# --- COLA DE RESÚMENES IA ---
+# /resume ya no bloquea el hilo del cliente: el pedido se encola y un grupo
+# pequeño de trabajadores llama al modelo. Pedidos iguales (misma sala y mismo
+# último mensaje) se agrupan en una sola inferencia y el resultado queda en
+# caché hasta que la sala recibe un mensaje nuevo.
+#
+# El texto se entrega a medida que el modelo lo produce: cada interesado recibe
+# los eventos "inicio" (con el estado del pedido), "parte" (un fragmento), y
+# "fin" o "error" (con el texto completo o el error). Quien se
+# suma a un trabajo ya empezado recibe primero todo lo generado hasta entonces.
+
+# Contadores globales de la cola
+estadisticas = {
+    "generados": 0,
+    "desde_cache": 0,
+    "agrupados": 0,
+    "rechazados": 0,
+    "errores": 0
+}
+
+class ColaResumenes:
+    """Trabajadores acotados para resúmenes, con agrupación por clave y caché de resultados"""
+
+    def __init__(self, generar, describir_error, trabajadores=1, max_pendientes=8, max_cache=64):
+        self._generar = generar                  # generar(*entrada, al_avanzar) -> texto (lanza excepción si falla)
+        self._describir_error = describir_error  # excepción -> texto para el usuario
+        self.trabajadores = trabajadores
+        self.max_pendientes = max_pendientes
+        self.max_cache = max_cache
+        self._cola = queue.Queue()
+        self._en_curso = {}          # clave -> {"entregas": [...], "partes": [...]}
+        self._cache = OrderedDict()  # clave -> texto (LRU)
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        for _ in range(self.trabajadores):
+            threading.Thread(target=self._trabajar, daemon=True).start()
+
+    def solicitar(self, clave, entrada, entregar):
+        """Pide un resumen. entregar(evento, texto) se llama a medida que avanza,
+        a veces desde otro hilo. Retorna "cache" (ya entregado completo),
+        "agrupado", "encolado" u "ocupado" (rechazado, sin eventos)"""
+        with self._lock:
+            texto = self._cache.get(clave)
+            if texto is not None:
+                self._cache.move_to_end(clave)
+                estadisticas["desde_cache"] += 1
+            elif clave in self._en_curso:
+                trabajo = self._en_curso[clave]
+                trabajo["entregas"].append(entregar)
+                estadisticas["agrupados"] += 1
+                # Bajo el lock: ningún fragmento nuevo se cuela antes de lo ya generado
+                _entregar(entregar, "inicio", "agrupado")
+                if trabajo["partes"]:
+                    _entregar(entregar, "parte", "".join(trabajo["partes"]))
+                return "agrupado"
+            elif len(self._en_curso) >= self.max_pendientes:
+                estadisticas["rechazados"] += 1
+                return "ocupado"
+            else:
+                self._en_curso[clave] = {"entregas": [entregar], "partes": []}
+                _entregar(entregar, "inicio", "encolado")
+                self._cola.put((clave, entrada))
+                return "encolado"
+        _entregar(entregar, "inicio", "cache")
+        _entregar(entregar, "parte", texto)
+        _entregar(entregar, "fin", texto)
+        return "cache"
+
+    def pendientes(self):
+        """Trabajos encolados o en curso"""
+        with self._lock:
+            return len(self._en_curso)
+
+    def _avanzar(self, clave, fragmento):
+        """Reparte un fragmento recién generado entre todos los interesados"""
+        if not fragmento:
+            return
+        with self._lock:
+            trabajo = self._en_curso[clave]
+            trabajo["partes"].append(fragmento)
+            for entregar in trabajo["entregas"]:
+                _entregar(entregar, "parte", fragmento)
+
+    def _trabajar(self):
+        while True:
+            clave, entrada = self._cola.get()
+            try:
+                texto = self._generar(*entrada, lambda f, c=clave: self._avanzar(c, f))
+                exito = True
+            except Exception as e:
+                texto = self._describir_error(e)
+                exito = False
+            with self._lock:
+                entregas = self._en_curso.pop(clave)["entregas"]
+                if exito:
+                    estadisticas["generados"] += 1
+                    # Los errores no se guardan: el próximo pedido lo reintenta
+                    self._cache[clave] = texto
+                    if len(self._cache) > self.max_cache:
+                        self._cache.popitem(last=False)
+                else:
+                    estadisticas["errores"] += 1
+            for entregar in entregas:
+                _entregar(entregar, "fin" if exito else "error", texto)
+
+def _entregar(entregar, evento, texto):
+    # Un cliente caído no debe cortar la entrega al resto
+    try:
+        entregar(evento, texto)
+    except Exception as e:
+        print(f"Error entregando resumen: {e}")
@@ -0,0 +1,201 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+
+# --- CONEXIONES DEL SERVIDOR ---
+# El resto del servidor trata a cada cliente como un objeto con send/close,
+# igual que un socket SSL. Estas clases añaden una cola de salida acotada por
+# cliente, vaciada por un escritor dedicado: difundir un mensaje solo lo encola
+# y un cliente lento ya no frena la entrega al resto de la sala.
+
+# Límites de la cola de salida. Un cliente que los supera no está leyendo
+# (Wi-Fi saturada, equipo congelado) y se desconecta.
+MAX_COLA_BYTES = 2 * 1024 * 1024
+MAX_COLA_MENSAJES = 1000
+
+# Bytes que el escritor toma de la cola por escritura. Lo que espera en la
+# cola (y no en los buffers del socket) es lo que cuenta para la expulsión.
+TAM_LOTE = 64 * 1024
+
+# Contadores globales de la capa de salida
+estadisticas = {
+    "expulsados_lentos": 0,
+    "mensajes_descartados": 0,
+    "bytes_descartados": 0
+}
+_estadisticas_lock = threading.Lock()
+
+class ConexionEncolada:
+    """Base común: cola de salida acotada y expulsión de consumidores lentos"""
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.cerrada = False
+        self.lenta = False
+        self._cola = deque()
+        self._bytes_cola = 0
+        self._cola_lock = threading.Lock()
+
+    def send(self, data):
+        """Encola una trama ya codificada. Nunca bloquea al hilo que difunde"""
+        with self._cola_lock:
+            if self.cerrada:
+                raise OSError("Conexión cerrada")
+            desbordada = (len(self._cola) >= MAX_COLA_MENSAJES or
+                          self._bytes_cola + len(data) > MAX_COLA_BYTES)
+            if not desbordada:
+                self._cola.append(data)
+                self._bytes_cola += len(data)
+        if desbordada:
+            self._expulsar_lenta()
+            raise OSError("Cola de salida llena")
+        self._despertar_escritor()
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def profundidad(self):
+        """Retorna (mensajes, bytes) pendientes de enviar"""
+        with self._cola_lock:
+            return len(self._cola), self._bytes_cola
+
+    def _tomar_lote(self):
+        """Saca varias tramas (hasta TAM_LOTE bytes) para escribirlas juntas"""
+        lote = []
+        tam = 0
+        with self._cola_lock:
+            while self._cola and (not lote or tam + len(self._cola[0]) <= TAM_LOTE):
+                data = self._cola.popleft()
+                lote.append(data)
+                tam += len(data)
+            self._bytes_cola -= tam
+        return lote
+
+    def _vaciar_cola(self):
+        with self._cola_lock:
+            mensajes, total = len(self._cola), self._bytes_cola
+            self._cola.clear()
+            self._bytes_cola = 0
+        return mensajes, total
+
+    def _expulsar_lenta(self):
+        with self._cola_lock:
+            if self.lenta:
+                return
+            self.lenta = True
+        mensajes, total = self._vaciar_cola()
+        with _estadisticas_lock:
+            estadisticas["expulsados_lentos"] += 1
+            estadisticas["mensajes_descartados"] += mensajes
+            estadisticas["bytes_descartados"] += total
+        print(f"🐢 [SALIDA] {self.addr} no lee sus mensajes ({mensajes} en cola). Desconectado.")
+        self.close(inmediato=True)
+
+    def close(self, inmediato=False):
+        """Cierra tras enviar lo pendiente, o al instante si inmediato=True"""
+        with self._cola_lock:
+            if self.cerrada and not inmediato:
+                return
+            self.cerrada = True
+        if inmediato:
+            self._vaciar_cola()
+            self._abortar()
+        self._despertar_escritor()
+
+    def _despertar_escritor(self):
+        raise NotImplementedError
+
+    def _abortar(self):
+        raise NotImplementedError
+
+class ConexionHilo(ConexionEncolada):
+    """Socket SSL atendido por hilos: un hilo escritor por cliente"""
+
+    def __init__(self, sock, addr):
+        super().__init__(addr)
+        self.sock = sock
+        self._hay_datos = threading.Condition(self._cola_lock)
+        threading.Thread(target=self._escribir, daemon=True).start()
+
+    def recv(self, n):
+        return self.sock.recv(n)
+
+    def _despertar_escritor(self):
+        with self._hay_datos:
+            self._hay_datos.notify()
+
+    def _escribir(self):
+        try:
+            while True:
+                with self._hay_datos:
+                    while not self._cola and not self.cerrada:
+                        self._hay_datos.wait()
+                    if not self._cola:
+                        break
+                lote = self._tomar_lote()
+                self.sock.sendall(b"".join(lote))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._abortar()
+
+    def _abortar(self):
+        # shutdown desbloquea el recv()/sendall() que esté esperando en otro hilo
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, ValueError):
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return f"<ConexionHilo {self.addr}>"
+
+class ConexionAsync(ConexionEncolada):
+    """StreamWriter de asyncio: una tarea escritora por cliente"""
+
+    def __init__(self, writer, loop):
+        super().__init__(writer.get_extra_info("peername"))
+        self.writer = writer
+        self.loop = loop
+        self._hilo_loop = threading.get_ident()
+        self._hay_datos = asyncio.Event()
+        self._tarea = loop.create_task(self._escribir())
+
+    def _en_loop(self, funcion, *args):
+        # Los comandos pueden ejecutarse en hilos del executor: solo el hilo
+        # del bucle de eventos puede tocar el transporte directamente.
+        if threading.get_ident() == self._hilo_loop:
+            funcion(*args)
+        else:
+            self.loop.call_soon_threadsafe(funcion, *args)
+
+    def _despertar_escritor(self):
+        self._en_loop(self._hay_datos.set)
+
+    async def _escribir(self):
+        try:
+            while True:
+                lote = self._tomar_lote()
+                if lote:
+                    self.writer.writelines(lote)
+                    await self.writer.drain()
+                    continue
+                if self.cerrada:
+                    break
+                self._hay_datos.clear()
+                await self._hay_datos.wait()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.writer.close()
+
+    def _abortar(self):
+        self._en_loop(self.writer.transport.abort)
+
+    def __repr__(self):
+        return f"<ConexionAsync {self.addr}>"
@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+import threading
+import time
+from urllib.parse import quote, unquote
+
+# --- LOG DE HISTORIAL (append-only) ---
+# Cada mensaje se agrega como una línea JSON al log de su sala y los logs se
+# sincronizan a disco (fsync) en grupo cada INTERVALO_FSYNC segundos. Cada tanto
+# se compacta: el historial en memoria se escribe como snapshot y los logs se
+# descartan. Al arrancar se carga el snapshot y se reproduce la cola de los logs.
+#
+# Cada registro lleva un número de secuencia global; el snapshot guarda el último
+# que contiene, así un log que sobrevivió a una compactación interrumpida no
+# duplica mensajes al reproducirse.
+
+INTERVALO_FSYNC = 0.5           # segundos entre fsync de grupo
+MAX_BYTES_LOG = 1024 * 1024     # compactar cuando los logs superan este tamaño
+MAX_EDAD_LOG = 600              # ... o cuando llevan este tiempo sin compactarse
+EXT_LOG = ".log"
+EXT_ROTADO = ".compactando"
+
+class RegistroHistorial:
+    """Historial persistente: snapshot + log append-only por sala"""
+
+    def __init__(self, ruta_snapshot, directorio_logs, max_por_sala=1000):
+        self.ruta_snapshot = ruta_snapshot
+        self.directorio = directorio_logs
+        self.max_por_sala = max_por_sala
+        self.seq = 0
+        self._archivos = {}        # sala -> archivo abierto en modo append
+        self._sucios = set()       # salas con escrituras sin fsync
+        self._bytes_log = 0
+        self._ultima_compactacion = time.time()
+        self._lock = threading.Lock()
+
+    # --- Rutas ---
+    def _ruta_log(self, sala, ext=EXT_LOG):
+        return os.path.join(self.directorio, quote(sala, safe="") + ext)
+
+    def _logs_en_disco(self):
+        """Retorna [(sala, ruta)] de logs rotados primero y luego los actuales"""
+        rotados, actuales = [], []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.endswith(EXT_ROTADO):
+                rotados.append((unquote(nombre[:-len(EXT_ROTADO)]), ruta))
+            elif nombre.endswith(EXT_LOG):
+                actuales.append((unquote(nombre[:-len(EXT_LOG)]), ruta))
+        return rotados + actuales
+
+    # --- Carga ---
+    def cargar(self):
+        """Retorna {sala: [mensajes]} a partir del snapshot más los logs pendientes"""
+        os.makedirs(self.directorio, exist_ok=True)
+        historial = {}
+        ultimo_seq = 0
+        if os.path.exists(self.ruta_snapshot):
+            try:
+                with open(self.ruta_snapshot, "r") as f:
+                    datos = json.load(f)
+                if "salas" in datos and "ultimo_seq" in datos:
+                    historial = datos["salas"]
+                    ultimo_seq = datos["ultimo_seq"]
+                else:
+                    # Formato antiguo: {sala: [mensajes]}
+                    historial = datos
+            except:
+                historial = {}
+
+        self.seq = ultimo_seq
+        reproducidos = 0
+        for sala, ruta in self._logs_en_disco():
+            mensajes = historial.setdefault(sala, [])
+            with open(ruta, "r", encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        registro = json.loads(linea)
+                    except ValueError:
+                        # Línea a medio escribir al caerse el servidor
+                        continue
+                    if registro["n"] <= ultimo_seq:
+                        continue
+                    mensajes.append(registro["m"])
+                    self.seq = max(self.seq, registro["n"])
+                    reproducidos += 1
+            self._bytes_log += os.path.getsize(ruta)
+            if len(mensajes) > self.max_por_sala:
+                del mensajes[:-self.max_por_sala]
+
+        if reproducidos:
+            print(f"📜 [HISTORIAL] {reproducidos} mensajes recuperados del log.")
+        return historial
+
+    # --- Escritura ---
+    def agregar(self, sala, mensaje):
+        """Agrega un mensaje al log de la sala. El fsync llega en el próximo grupo"""
+        with self._lock:
+            self.seq += 1
+            linea = json.dumps({"n": self.seq, "m": mensaje}, ensure_ascii=False) + "\n"
+            f = self._archivos.get(sala)
+            if f is None:
+                f = open(self._ruta_log(sala), "a", encoding="utf-8")
+                self._archivos[sala] = f
+            f.write(linea)
+            self._sucios.add(sala)
+            self._bytes_log += len(linea)
+
+    def sincronizar(self):
+        """Vuelca y hace fsync de todos los logs con escrituras pendientes"""
+        with self._lock:
+            archivos = [self._archivos[s] for s in self._sucios if s in self._archivos]
+            self._sucios.clear()
+            for f in archivos:
+                f.flush()
+            descriptores = [os.dup(f.fileno()) for f in archivos]
+        # El fsync (lo lento) se hace fuera del lock sobre copias del descriptor
+        for fd in descriptores:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def hilo_sincronizacion(self):
+        """Bucle del hilo que hace el fsync de grupo"""
+        while True:
+            time.sleep(INTERVALO_FSYNC)
+            try:
+                self.sincronizar()
+            except OSError as e:
+                print(f"Error sincronizando log de historial: {e}")
+
+    def eliminar_sala(self, sala):
+        """Borra el log de una sala eliminada"""
+        with self._lock:
+            f = self._archivos.pop(sala, None)
+            self._sucios.discard(sala)
+            if f:
+                f.close()
+            for ext in (EXT_LOG, EXT_ROTADO):
+                try:
+                    os.remove(self._ruta_log(sala, ext))
+                except FileNotFoundError:
+                    pass
+
+    # --- Compactación ---
+    def necesita_compactar(self):
+        with self._lock:
+            if not self._bytes_log:
+                return False
+            return (self._bytes_log >= MAX_BYTES_LOG or
+                    time.time() - self._ultima_compactacion >= MAX_EDAD_LOG)
+
+    def rotar(self):
+        """Cierra los logs actuales y los aparta para compactar. Retorna el corte.
+
+        Debe llamarse con el historial en memoria bloqueado, junto con la copia
+        que se va a escribir como snapshot: todo lo anterior al corte está en la
+        copia y todo lo posterior irá a logs nuevos."""
+        with self._lock:
+            for f in self._archivos.values():
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            self._archivos.clear()
+            for nombre in os.listdir(self.directorio):
+                if not nombre.endswith(EXT_LOG):
+                    continue
+                origen = os.path.join(self.directorio, nombre)
+                destino = origen[:-len(EXT_LOG)] + EXT_ROTADO
+                if os.path.exists(destino):
+                    # Quedó de una compactación interrumpida: se conserva y se amplía
+                    with open(origen, "rb") as o, open(destino, "ab") as d:
+                        shutil.copyfileobj(o, d)
+                        d.flush()
+                        os.fsync(d.fileno())
+                    os.remove(origen)
+                else:
+                    os.replace(origen, destino)
+            self._sucios.clear()
+            self._bytes_log = 0
+            self._ultima_compactacion = time.time()
+            return self.seq
+
+    def escribir_snapshot(self, historial, corte):
+        """Escribe el snapshot de forma atómica y borra los logs ya incluidos"""
+        tmp = self.ruta_snapshot + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"ultimo_seq": corte, "salas": historial}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ruta_snapshot)
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith(EXT_ROTADO):
+                os.remove(os.path.join(self.directorio, nombre))
+
+    def cerrar(self):
+        """Sincroniza y cierra todos los logs"""
+        self.sincronizar()
+        with self._lock:
+            for f in self._archivos.values():
+                f.close()
+            self._archivos.clear()
@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- CLIENTE OLLAMA ---
+# Todas las consultas al modelo pasan por un único ClienteOllama:
+#   - Una requests.Session con conexiones keep-alive reutilizadas.
+#   - Un hilo que sondea el servicio al arrancar y cada intervalo_sondeo
+#     segundos y, al encontrarlo, precarga el modelo en memoria (keep_alive).
+#     El servidor no espera a ese primer sondeo para empezar a escuchar.
+#   - Un circuito: tras fallos_para_abrir fallos seguidos (o un sondeo fallido)
+#     las llamadas fallan al instante con ServicioNoDisponible en lugar de
+#     esperar a que venza la conexión. Pasados espera_reintento segundos se
+#     deja pasar una sola llamada de prueba; un sondeo exitoso lo cierra.
+# La URL base es configurable: se puede probar contra un servidor HTTP local
+# que imite /api/tags y /api/generate.
+
+# Contadores globales del cliente (latencias en segundos)
+estadisticas = {
+    "llamadas": 0,
+    "fallidas": 0,
+    "rechazadas": 0,
+    "latencia_ultima": 0.0,
+    "latencia_total": 0.0,
+    "primer_fragmento_ultimo": 0.0,
+    "tokens_ultima": 0,
+    "tokens_por_seg_ultima": 0.0
+}
+
+class ServicioNoDisponible(Exception):
+    """El circuito está abierto: la llamada no se intentó"""
+
+class ClienteOllama:
+    """Conexiones reutilizadas, sondeo de salud y circuito hacia Ollama"""
+
+    def __init__(self, url_base="http://localhost:11434", modelo="llama3.2:3b", keep_alive=3600,
+                 conexiones=4, fallos_para_abrir=3, espera_reintento=30, intervalo_sondeo=30,
+                 timeout=(5, 90)):
+        self.url_base = url_base.rstrip("/")
+        self.modelo = modelo
+        self.keep_alive = keep_alive
+        self.fallos_para_abrir = fallos_para_abrir
+        self.espera_reintento = espera_reintento
+        self.intervalo_sondeo = intervalo_sondeo
+        self.timeout = timeout
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=conexiones)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.mount("https://", adaptador)
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_hasta = 0.0    # 0 = circuito cerrado
+        self._probando = False       # hay una llamada de prueba en curso
+        self._modelo_cargado = False
+
+    # --- Circuito ---
+    def disponible(self):
+        """True si una llamada ahora se intentaría"""
+        with self._lock:
+            return self._abierto_hasta == 0 or (time.time() >= self._abierto_hasta and not self._probando)
+
+    def _permitir(self):
+        with self._lock:
+            if self._abierto_hasta == 0:
+                return True
+            if time.time() >= self._abierto_hasta and not self._probando:
+                self._probando = True
+                return True
+            estadisticas["rechazadas"] += 1
+            return False
+
+    def _exito(self):
+        with self._lock:
+            if self._abierto_hasta:
+                print("🤖 [IA] Servicio recuperado.")
+            self._fallos = 0
+            self._abierto_hasta = 0.0
+            self._probando = False
+
+    def _fallo(self, abrir=False):
+        with self._lock:
+            self._fallos += 1
+            self._probando = False
+            if abrir or self._fallos >= self.fallos_para_abrir:
+                if not self._abierto_hasta:
+                    print(f"⚠️ [IA] Servicio no disponible. Reintento en {self.espera_reintento} s.")
+                self._abierto_hasta = time.time() + self.espera_reintento
+                self._modelo_cargado = False
+
+    # --- Salud ---
+    def sondear(self):
+        """Consulta /api/tags. Actualiza el circuito y precarga el modelo si hace falta"""
+        try:
+            r = self.sesion.get(f"{self.url_base}/api/tags", timeout=self.timeout[0])
+            r.raise_for_status()
+        except requests.exceptions.RequestException:
+            self._fallo(abrir=True)
+            return False
+        self._exito()
+        if not self._modelo_cargado:
+            self.calentar()
+        return True
+
+    def calentar(self):
+        """Carga el modelo en memoria sin generar texto (una petición sin prompt)"""
+        try:
+            r = self.sesion.post(f"{self.url_base}/api/generate",
+                                 json={"model": self.modelo, "keep_alive": self.keep_alive},
+                                 timeout=(self.timeout[0], 300))
+            r.raise_for_status()
+            self._modelo_cargado = True
+            print(f"🤖 [IA] Modelo {self.modelo} cargado en memoria.")
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ [IA] No se pudo precargar el modelo: {e}")
+
+    def iniciar(self, al_primer_sondeo=None):
+        """Sondea en segundo plano (el primero enseguida, sin bloquear el arranque) y
+        precarga el modelo. al_primer_sondeo(disponible) recibe el resultado del primero"""
+        threading.Thread(target=self._hilo_sondeo, args=(al_primer_sondeo,), daemon=True).start()
+
+    def _hilo_sondeo(self, al_primer_sondeo):
+        self.sondear()
+        if al_primer_sondeo:
+            al_primer_sondeo(self.disponible())
+        while True:
+            time.sleep(self.intervalo_sondeo)
+            self.sondear()
+
+    # --- Generación ---
+    def generar(self, prompt, al_avanzar=None, stream=True):
+        """Genera texto para el prompt. Con stream=True cada fragmento pasa a
+        al_avanzar a medida que llega. Retorna el texto completo; lanza
+        ServicioNoDisponible si el circuito está abierto, u otra excepción si falla"""
+        if not self._permitir():
+            raise ServicioNoDisponible("el servicio de IA no responde")
+        payload = {"model": self.modelo, "prompt": prompt, "stream": stream, "keep_alive": self.keep_alive}
+        inicio = time.perf_counter()
+        try:
+            if stream:
+                texto, final, primero = self._generar_stream(payload, al_avanzar, inicio)
+            else:
+                r = self.sesion.post(f"{self.url_base}/api/generate", json=payload, timeout=self.timeout)
+                r.raise_for_status()
+                final = r.json()
+                texto = final.get("response", "")
+                primero = time.perf_counter() - inicio
+                if al_avanzar and texto:
+                    al_avanzar(texto)
+        except Exception:
+            self._fallo()
+            with self._lock:
+                estadisticas["llamadas"] += 1
+                estadisticas["fallidas"] += 1
+            raise
+        self._exito()
+        self._modelo_cargado = True
+        self._medir(time.perf_counter() - inicio, primero, final)
+        return texto
+
+    def _generar_stream(self, payload, al_avanzar, inicio):
+        """Lee la respuesta NDJSON de Ollama. Retorna (texto, última línea, segundos hasta el primer fragmento)"""
+        partes = []
+        final = {}
+        primero = 0.0
+        with self.sesion.post(f"{self.url_base}/api/generate", json=payload,
+                              stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            # Una línea JSON por fragmento: {"response": "...", "done": false}
+            for linea in r.iter_lines():
+                if not linea:
+                    continue
+                datos = json.loads(linea)
+                if datos.get("error"):
+                    raise RuntimeError(datos["error"])
+                fragmento = datos.get("response", "")
+                if fragmento:
+                    if not partes:
+                        primero = time.perf_counter() - inicio
+                    partes.append(fragmento)
+                    if al_avanzar:
+                        al_avanzar(fragmento)
+                if datos.get("done"):
+                    # Sin cortar el bucle: leer hasta el final deja la conexión lista para reutilizarse
+                    final = datos
+        return "".join(partes), final, primero
+
+    def _medir(self, latencia, primero, final):
+        """Registra latencia y velocidad (eval_count / eval_duration que informa Ollama)"""
+        tokens = final.get("eval_count", 0)
+        duracion = final.get("eval_duration", 0) / 1e9
+        velocidad = tokens / duracion if duracion else 0.0
+        with self._lock:
+            estadisticas["llamadas"] += 1
+            estadisticas["latencia_ultima"] = latencia
+            estadisticas["latencia_total"] += latencia
+            estadisticas["primer_fragmento_ultimo"] = primero
+            estadisticas["tokens_ultima"] = tokens
+            estadisticas["tokens_por_seg_ultima"] = velocidad
+        print(f"🤖 [IA] {latencia:.1f} s (primer fragmento {primero:.1f} s), {tokens} tokens a {velocidad:.1f} tok/s")
+
+    def estado(self):
+        """"disponible", "caído" o "probando" (ya pasó la espera y se admite un intento)"""
+        with self._lock:
+            if self._abierto_hasta == 0:
+                return "disponible"
+            return "probando" if time.time() >= self._abierto_hasta else "caído"
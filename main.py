@@ -1,3 +1,6 @@
+import time
+inicio = time.perf_counter()  # para el informe de arranque (incluye importar la interfaz)
+
 from chat_app import ChatApp
 
 # Este archivo es el punto de entrada.
@@ -5,6 +8,6 @@ from chat_app import ChatApp
 # ejecutar la aplicación principal.
 
 if __name__ == "__main__":
-    app = ChatApp()
+    app = ChatApp(inicio=inicio)
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
     app.mainloop()
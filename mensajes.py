@@ -0,0 +1,74 @@
+import sys
+import time
+from datetime import datetime
+
+# --- REGISTRO DE MENSAJES ---
+# El historial guarda registros compactos en lugar de cadenas ya formateadas.
+# El texto "[HH:MM] 👑 [ADMIN] usuario: texto" solo se arma al enviarlo.
+
+PREFIJOS_ROL = {
+    "admin": "👑 [ADMIN] ",
+    "docente": "🎓 [DOCENTE] "
+}
+
+class Mensaje:
+    """Mensaje de una sala con id estable y creciente"""
+    __slots__ = ("id", "ts", "autor", "rol", "texto")
+
+    def __init__(self, id, ts, autor, rol, texto):
+        self.id = id
+        self.ts = ts            # epoch en segundos (None en mensajes importados del formato antiguo)
+        self.autor = autor      # None para mensajes del sistema y anuncios
+        self.rol = rol
+        self.texto = texto
+
+    @classmethod
+    def nuevo(cls, id, texto, autor=None, rol=None):
+        if autor is not None:
+            # Los alias se repiten en miles de mensajes: una sola copia en memoria
+            autor = sys.intern(autor)
+        return cls(id, time.time(), autor, rol, texto)
+
+    @classmethod
+    def desde_legado(cls, id, cadena):
+        """Convierte una línea ya formateada del historial antiguo"""
+        return cls(id, None, None, None, cadena)
+
+    @classmethod
+    def desde_dict(cls, d):
+        return cls(d["id"], d.get("ts"), d.get("a"), d.get("r"), d["t"])
+
+    def a_dict(self):
+        d = {"id": self.id, "ts": self.ts, "t": self.texto}
+        if self.autor is not None:
+            d["a"] = self.autor
+            d["r"] = self.rol
+        return d
+
+    def para_envio(self):
+        """Forma en que viaja dentro de HISTORY_BATCH"""
+        return {"id": self.id, "texto": self.renderizar()}
+
+    def renderizar(self):
+        """Texto tal como lo muestra el cliente"""
+        if self.ts is None:
+            return self.texto
+        hora = datetime.fromtimestamp(self.ts).strftime("%H:%M")
+        if self.autor is None:
+            return f"[{hora}] {self.texto}"
+        return f"[{hora}] {PREFIJOS_ROL.get(self.rol, '')}{self.autor}: {self.texto}"
+
+    def __repr__(self):
+        return f"<Mensaje {self.id} {self.autor}>"
+
+def cargar_registros(entradas, siguiente_id):
+    """Convierte lo leído del disco (dicts o cadenas antiguas) en Mensajes.
+    Retorna (lista, siguiente_id) asignando ids nuevos a las cadenas antiguas"""
+    registros = []
+    for e in entradas:
+        if isinstance(e, dict):
+            registros.append(Mensaje.desde_dict(e))
+        else:
+            registros.append(Mensaje.desde_legado(siguiente_id, e))
+            siguiente_id += 1
+    return registros, siguiente_id
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+
+from almacenamiento import AlmacenJSON, AlmacenSQLite
+
+# --- MIGRACIÓN JSON -> SQLITE ---
+# Importa usuarios.json, salas.json, pines.json, resumenes.json e historial.json (más lo que
+# quede en historial_log/) a una base SQLite para usar el Host con --sqlite.
+# Ejecutar con el servidor detenido, en la carpeta donde están los archivos.
+
+def migrar(origen, destino):
+    """Copia todos los datos del almacén JSON al SQLite. Retorna los totales"""
+    usuarios = origen.cargar_usuarios() or {}
+    destino.guardar_usuarios(usuarios, usuarios.keys())
+
+    salas = origen.cargar_salas() or []
+    if salas:
+        destino.guardar_salas(salas)
+
+    pines = origen.cargar_pines() or {}
+    destino.guardar_pines(pines, pines.keys())
+
+    resumenes = origen.cargar_resumenes() or {}
+    destino.guardar_resumenes(resumenes, resumenes.keys())
+
+    total_mensajes = 0
+    for sala, mensajes in origen.cargar_historial().items():
+        for m in mensajes:
+            destino.agregar_mensaje(sala, m)
+        total_mensajes += len(mensajes)
+    destino.sincronizar()
+
+    return {"usuarios": len(usuarios), "salas": len(salas), "pines": len(pines),
+            "resumenes": len(resumenes), "mensajes": total_mensajes}
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa los datos JSON del servidor a SQLite")
+    parser.add_argument("--db", default="dchat.db", help="Base SQLite de destino")
+    parser.add_argument("--forzar", action="store_true", help="Migrar aunque la base ya tenga datos")
+    args = parser.parse_args()
+
+    if not os.path.exists("usuarios.json"):
+        print("❌ No se encontró usuarios.json en esta carpeta.")
+        return 1
+
+    destino = AlmacenSQLite(args.db)
+    if destino.contar_usuarios() and not args.forzar:
+        print(f"⚠️ {args.db} ya contiene usuarios. Usa --forzar para migrar igualmente.")
+        destino.cerrar()
+        return 1
+
+    origen = AlmacenJSON("usuarios.json", "salas.json", "pines.json", "historial.json", "historial_log")
+    totales = migrar(origen, destino)
+    destino.cerrar()
+
+    print(f"✅ Migración completa en {args.db}: {totales['usuarios']} usuarios, {totales['salas']} salas, "
+          f"{totales['pines']} pines, {totales['resumenes']} resúmenes, {totales['mensajes']} mensajes.")
+    print('   -> Inicia el servidor con: python "Host 0.0.3.py" --sqlite')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,46 +1,121 @@
-import socket, threading, queue, ssl
+import socket, threading, queue, ssl, json, random, time
+from protocolo import codificar_texto, decodificar_texto, LectorTramas, VERSION_AUTH, VERSION_JOIN_DESDE
+
+# Reconexión automática: esperas con jitter que se duplican de RECONEXION_BASE
+# hasta RECONEXION_MAX segundos, durante RECONEXION_INTENTOS intentos
+RECONEXION_BASE = 0.5; RECONEXION_MAX = 30; RECONEXION_INTENTOS = 8
+
+_contexto_tls = None
+
+def contexto_tls():
+    """Un único contexto TLS para todas las conexiones (necesario para reanudar sesiones)"""
+    global _contexto_tls
+    if _contexto_tls is None:
+        ctx = ssl.create_default_context(); ctx.check_hostname = False; ctx.verify_mode = ssl.CERT_NONE
+        _contexto_tls = ctx
+    return _contexto_tls
 
 class NetworkManager:
     def __init__(self, message_queue):
-        self.client = None; self.connected = False; self.queue = message_queue
+        self.client = None; self.lector = None; self.connected = False; self.queue = message_queue
         self.host = "192.168.100.37"; self.port = 5000
+        self.auth_legado = False  # el servidor no entiende AUTH (se detecta solo)
+        # Sesión TLS de la última conexión: al reconectar se reanuda sin handshake completo
+        self.sesion_tls = None; self.precalentada = False; self._lock_conexion = threading.Lock()
+        # Para reanudar tras una caída: token del servidor, sala y último id mostrado
+        self.usuario = None; self.token = None; self.sala = None; self.ultimo_id = None
+        self.version_servidor = 2  # según el AUTH_RESULT del login (2 = diálogo legado)
+        self.al_encolar = None  # aviso a la interfaz (desde este hilo) de que hay mensajes nuevos
+        self.compresion = True  # pedir tramas zlib al servidor (historial, miembros y resúmenes grandes)
+
+    def _publicar(self, msg):
+        self.queue.put(msg)
+        if self.al_encolar: self.al_encolar()
 
     def connect(self):
-        if self.connected: return (True, "OK")
+        with self._lock_conexion:
+            if self.connected: return (True, "OK")
+            try:
+                raw = socket.socket(socket.AF_INET, socket.SOCK_STREAM); raw.settimeout(5)
+                self.client = contexto_tls().wrap_socket(raw, server_hostname=self.host, session=self.sesion_tls)
+                self.client.connect((self.host, self.port)); self.connected = True; self.client.settimeout(None)
+                self.lector = LectorTramas(self.client); self.precalentada = False
+                return (True, "OK")
+            except Exception as e: return (False, str(e))
+
+    def precalentar(self):
+        """Abre en segundo plano la conexión TCP+TLS mientras se muestra el login:
+        al pulsar "Iniciar Sesión" solo queda el intercambio de credenciales"""
+        def abrir():
+            if not self.connected and self.connect()[0]: self.precalentada = True
+        threading.Thread(target=abrir, daemon=True).start()
+
+    def _guardar_sesion_tls(self):
+        # Con TLS 1.3 el ticket llega después del handshake: se toma tras recibir datos
         try:
-            ctx = ssl.create_default_context(); ctx.check_hostname = False; ctx.verify_mode = ssl.CERT_NONE
-            raw = socket.socket(socket.AF_INET, socket.SOCK_STREAM); raw.settimeout(5)
-            self.client = ctx.wrap_socket(raw, server_hostname=self.host)
-            self.client.connect((self.host, self.port)); self.connected = True; self.client.settimeout(None)
-            return (True, "OK")
-        except Exception as e: return (False, str(e))
+            if self.client.session is not None: self.sesion_tls = self.client.session
+        except (AttributeError, ValueError): pass
 
     def disconnect(self):
+        """Cierre pedido por el usuario: no se intenta reconectar"""
+        self.token = None; self._cerrar()
+
+    def _cerrar(self):
         self.connected = False
+        self._guardar_sesion_tls()
         try: self.client.close()
         except: pass
 
     def send_msg(self, msg):
         if self.connected:
             try: 
-                self.client.send(msg.encode("utf-8"))
+                self._enviar(msg)
                 return True
             except (ssl.SSLEOFError, BrokenPipeError, OSError): 
-                self.disconnect()
+                self._cerrar()   # _listen se encarga de reconectar
                 return False
         return False
 
+    def _enviar(self, texto):
+        """Envía un mensaje como trama completa"""
+        self.client.sendall(codificar_texto(texto))
+
+    def _recibir(self):
+        """Siguiente mensaje completo del servidor ("" si se cerró)"""
+        texto = self.lector.recibir_texto(); self._guardar_sesion_tls()
+        return texto
+
     def start_listening(self):
         threading.Thread(target=self._listen, daemon=True).start()
 
     def _listen(self):
-        """Hilo que escucha mensajes del servidor"""
-        while self.connected:
+        """Hilo que escucha mensajes del servidor y reconecta si la conexión se cae"""
+        # Socket y lector de este hilo: tras logout/disconnect puede haber ya otra
+        # conexión (precalentada) en self.client que no es asunto de este hilo
+        propio = self.client
+        while True:
+            self._escuchar(propio, self.lector)
+            if propio is not self.client or not (self.token and self._reconectar()): break
+            propio = self.client
+        with self._lock_conexion:   # connect() cambia self.client con este mismo candado
+            actual = propio is self.client
+            if actual: self.connected = False
+        if actual: self._publicar("[SISTEMA] Desconectado.")
+
+    def _escuchar(self, propio, lector):
+        while self.connected and propio is self.client:
             try:
-                data = self.client.recv(65536).decode("utf-8")
-                if not data: 
+                trama = lector.recibir()
+                if trama is None: 
                     break
-                self.queue.put(data)
+                texto = decodificar_texto(*trama)
+                if texto.startswith("MSG"):
+                    # MSG:<id>:<texto> y MSG_ID:<id> (id del mensaje propio) pasan a la interfaz con su id
+                    if texto.startswith("MSG:"):
+                        self.marcar_visto(None, int(texto[4:].split(":", 1)[0]))
+                    elif texto.startswith("MSG_ID:"):
+                        self.marcar_visto(None, int(texto[7:]))
+                self._publicar(texto)
             except ssl.SSLEOFError:
                 # El servidor cerró la conexión SSL (comportamiento esperado al salir/kick)
                 break 
@@ -50,90 +125,140 @@ class NetworkManager:
             except Exception as e:
                 print(f"Error desconocido en listen: {e}")
                 break
-        
-        self.connected = False
-        self.queue.put("[SISTEMA] Desconectado.")
+
+    def marcar_visto(self, sala, ultimo_id=None):
+        """Sala actual y último id mostrado: al reanudar se pide solo lo posterior"""
+        if sala is not None: self.sala = sala
+        if ultimo_id is not None and (self.ultimo_id is None or ultimo_id > self.ultimo_id): self.ultimo_id = ultimo_id
+
+    def _reconectar(self):
+        """Reintenta con espera exponencial y jitter, y reanuda la sesión con el token"""
+        self._cerrar(); self._publicar("[SISTEMA] Conexión perdida. Reconectando...")
+        espera = RECONEXION_BASE
+        for _ in range(RECONEXION_INTENTOS):
+            # Jitter completo: los clientes de una misma caída no vuelven todos a la vez
+            time.sleep(random.uniform(0, espera)); espera = min(espera * 2, RECONEXION_MAX)
+            if not self.token: return False   # el usuario salió mientras tanto
+            if not self.connect()[0]: continue
+            try:
+                self._enviar("AUTH:" + json.dumps({"v": VERSION_AUTH, "op": "reanudar", "usuario": self.usuario,
+                                                   "token": self.token, "sala": self.sala, "desde": self.ultimo_id,
+                                                   "compresion": self._compresiones()}))
+                resp = self._recibir()
+            except OSError: resp = ""
+            if resp.startswith("AUTH_RESULT:"):
+                datos = json.loads(resp[len("AUTH_RESULT:"):])
+                if not datos.get("ok"): break   # token vencido o sesión anulada (kick, ban)
+                self.token = datos.get("token"); self._publicar("[SISTEMA] Reconectado.")
+                return True
+            self._cerrar()
+        self.token = None; self._cerrar()
+        return False
 
     def solicitar_usuarios(self): self.send_msg("/get_users")
 
+    def unirse(self, sala, desde=None):
+        """Cambia de sala. Con desde=id (y un servidor que lo admita) solo llegan los mensajes posteriores"""
+        if desde is None or self.version_servidor < VERSION_JOIN_DESDE: return self.send_msg(f"/join {sala}")
+        return self.send_msg(f"/join {json.dumps({'sala': sala, 'desde': desde})}")
+
+    def pedir_historial(self, sala, **peticion):
+        """Pide una página de historial: ultimos=n, antes=id (más antiguos) o desde=id (delta)"""
+        peticion["sala"] = sala; return self.send_msg(f"/historial {json.dumps(peticion)}")
+
     # Auth Methods
-    # En network_manager.py
+    # Cada operación es una sola petición AUTH:{json} con todos los campos y una
+    # respuesta AUTH_RESULT:{json}. Un servidor anterior no la entiende y cierra la
+    # conexión: se reconecta, se recuerda y se usa el diálogo paso a paso con ACK.
+
+    def _conectar_para(self, etiqueta):
+        if self.connected: return True
+        exito, error = self.connect()
+        if not exito: self._publicar(f"[{etiqueta}] Error de conexión: {error}")
+        return exito
+
+    def _compresiones(self): return ["zlib"] if self.compresion else []
+
+    def _pedir_auth(self, op, **campos):
+        """Respuesta del servidor (dict), o None si hay que usar el diálogo legado.
+        Solo se recuerda que el servidor es legado si cierra la conexión ante AUTH en
+        dos conexiones nuevas seguidas; un error de red lanza OSError y el próximo
+        intento vuelve a probar AUTH"""
+        if self.auth_legado: return None
+        campos.update(v=VERSION_AUTH, op=op); cierres = 0
+        while True:
+            # Una conexión precalentada pudo quedar cerrada (p. ej. servidor reiniciado): ese cierre no cuenta
+            nueva = not self.precalentada
+            try: self._enviar(f"AUTH:{json.dumps(campos)}"); resp = self._recibir()
+            except ssl.SSLEOFError: resp = ""
+            if resp.startswith("AUTH_RESULT:"): return json.loads(resp[len("AUTH_RESULT:"):])
+            if nueva: cierres += 1
+            self._cerrar(); exito, error = self.connect()
+            if not exito: raise OSError(error)
+            if cierres == 2: break
+        self.auth_legado = True
+        return None
 
     def login(self, u, p):
         # Si no estamos conectados, intentamos conectar primero
-        if not self.connected: 
-            exito, error = self.connect()
-            if not exito: 
-                self.queue.put(f"[LOGIN] Error de conexión: {error}")
-                return
-
+        if not self._conectar_para("LOGIN"): return
         try:
-            self.client.send("l".encode())
-            ack = self.client.recv(1024) # Esperar ACK inicial
-            
-            self.client.send(u.encode())
-            self.client.recv(1024) # ACK usuario
-            
-            self.client.send(p.encode())
-            resp = self.client.recv(1024).decode().strip()
-            
-            self.queue.put(f"[LOGIN] {resp}")
-            
-            # --- CORRECCIÓN CRÍTICA ---
-            # Si el servidor no responde con "Bienvenido", significa que rechazó el login
-            # y cerró el socket en su 'finally'. Debemos cerrar aquí también.
-            if "Bienvenido" not in resp:
+            datos = self._pedir_auth("login", usuario=u, clave=p, compresion=self._compresiones())
+            resp = datos["mensaje"].strip() if datos else self._login_legado(u, p)
+            self.usuario = u; self.token = datos.get("token") if datos else None; self.ultimo_id = None
+            self.version_servidor = datos.get("v", 3) if datos else 2
+            self._publicar(f"[LOGIN] {resp}")
+            # Si el servidor rechazó el login ya cerró el socket: cerramos aquí también
+            if not (datos["ok"] if datos else "Bienvenido" in resp):
                 self.disconnect()
-                
         except Exception as e: 
             self.disconnect()
-            self.queue.put(f"[LOGIN] Error de red: {str(e)}")
+            self._publicar(f"[LOGIN] Error de red: {str(e)}")
 
     def register(self, u, p, q, a):
-        if not self.connected: 
-            exito, error = self.connect()
-            if not exito: 
-                self.queue.put(f"[REGISTRO] Error de conexión: {error}")
-                return
-
+        if not self._conectar_para("REGISTRO"): return
         try:
-            self.client.send("r".encode())
-            self.client.recv(1024)
-            
-            self.client.send(u.encode())
-            self.client.recv(1024)
-            
-            self.client.send(p.encode())
-            self.client.recv(1024)
-            
-            self.client.send(q.encode())
-            self.client.recv(1024)
-            
-            self.client.send(a.encode())
-            resp = self.client.recv(1024).decode()
-            
-            self.queue.put(f"[REGISTRO] {resp}")
-            
-            # --- CORRECCIÓN CRÍTICA ---
-            # El servidor SIEMPRE cierra la conexión tras el registro.
-            # Debemos desconectar el cliente para limpiar el socket.
-            self.disconnect() 
-            
+            datos = self._pedir_auth("registro", usuario=u, clave=p, pregunta=q, respuesta=a)
+            self._publicar(f"[REGISTRO] {datos['mensaje'] if datos else self._registro_legado(u, p, q, a)}")
         except Exception as e: 
-            self.disconnect()
-            self.queue.put(f"[REGISTRO] Error de red: {str(e)}")
+            self._publicar(f"[REGISTRO] Error de red: {str(e)}")
+        # El servidor SIEMPRE cierra la conexión tras el registro
+        self.disconnect()
 
     def recover_step1(self, u):
         if not self.connected: self.connect()
         try:
-            self.client.send("rec_req".encode()); self.client.recv(1024)
-            self.client.send(u.encode()); self.queue.put(f"[RECUPERACION_DATA] {self.client.recv(1024).decode()}")
-        except: self.disconnect()
+            datos = self._pedir_auth("recuperar", usuario=u)
+            self._publicar(f"[RECUPERACION_DATA] {datos['mensaje'] if datos else self._recuperar_legado(u)}")
+        except: pass
+        self.disconnect()
 
     def recover_step2(self, u, r, np):
         if not self.connected: self.connect()
         try:
-            self.client.send("rec_reset".encode()); self.client.recv(1024); self.client.send(u.encode())
-            self.client.recv(1024); self.client.send(r.encode()); self.client.recv(1024)
-            self.client.send(np.encode()); self.queue.put(f"[RECUPERACION_RESULT] {self.client.recv(1024).decode()}")
-        except: self.disconnect()
+            datos = self._pedir_auth("restablecer", usuario=u, respuesta=r, nueva=np)
+            self._publicar(f"[RECUPERACION_RESULT] {datos['mensaje'] if datos else self._restablecer_legado(u, r, np)}")
+        except: pass
+        self.disconnect()
+
+    # Diálogo legado (servidores sin AUTH): un ACK por campo
+    def _login_legado(self, u, p):
+        self._enviar("l"); self._recibir()
+        self._enviar(u); self._recibir()
+        self._enviar(p); return self._recibir().strip()
+
+    def _registro_legado(self, u, p, q, a):
+        self._enviar("r"); self._recibir()
+        self._enviar(u); self._recibir()
+        self._enviar(p); self._recibir()
+        self._enviar(q); self._recibir()
+        self._enviar(a); return self._recibir()
+
+    def _recuperar_legado(self, u):
+        self._enviar("rec_req"); self._recibir()
+        self._enviar(u); return self._recibir()
+
+    def _restablecer_legado(self, u, r, np):
+        self._enviar("rec_reset"); self._recibir(); self._enviar(u)
+        self._recibir(); self._enviar(r); self._recibir()
+        self._enviar(np); return self._recibir()
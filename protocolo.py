@@ -0,0 +1,185 @@
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+# --- PROTOCOLO DE TRAMAS ---
+# Cada mensaje viaja como una trama: cabecera de 5 bytes (longitud del cuerpo
+# en 4 bytes big-endian + 1 byte de tipo) seguida del cuerpo.
+# Lo usan tanto el Host como NetworkManager, así TCP/TLS puede juntar o partir
+# lecturas sin que se mezclen mensajes.
+
+CABECERA = struct.Struct("!IB")
+TAM_CABECERA = CABECERA.size
+MAX_TRAMA = 16 * 1024 * 1024  # 16 MiB, protege contra cabeceras corruptas
+# Lo que el servidor acepta de un cliente (comandos y mensajes de chat): una
+# conexión, autenticada o no, no puede hacerle reservar más que esto
+MAX_TRAMA_ENTRANTE = 64 * 1024
+
+# Tipos de trama
+TIPO_TEXTO = 1     # Mensaje de chat/protocolo en UTF-8 (ACK, HISTORY_BATCH:, PIN_UPDATE:, ...)
+TIPO_TEXTO_ZLIB = 2  # El mismo texto comprimido con zlib y DICCIONARIO_ZLIB (solo si el cliente lo negoció)
+
+# --- COMPRESIÓN ---
+# Cada trama se comprime por separado con un diccionario fijo (no un flujo por
+# conexión): así una trama armada una vez, como la página inicial de historial o
+# un broadcast, sirve igual para todos los clientes que negociaron "zlib".
+# Solo se comprimen las de UMBRAL_COMPRESION bytes o más, y solo si ahorran algo.
+UMBRAL_COMPRESION = 512
+NIVEL_COMPRESION = 6
+# Fragmentos frecuentes en historial, miembros y presencia (lo más común, al final)
+DICCIONARIO_ZLIB = (
+    'USERS_LIST:{"General": [" [ADMIN]", " [DOCENTE]", " \\ud83d\\udd07"], "Equipo 1": [], "Equipo 2": []}'
+    'PRESENCE_SNAPSHOT:{"usuarios": [{"id": 1, "alias": "", "rol": "estudiante", "sala": "General", "muted": false}, '
+    '{"id": 2, "alias": "", "rol": "docente", "sala": "Equipo 1", "muted": true}, {"rol": "admin", '
+    'SUMMARY_CHUNK:\u2728 --- RESUMEN IA --- '
+    'HISTORY_BATCH:{"sala": "General", "modo": "ultimos", "mensajes": [], "hay_mas": false, "total": 50}'
+    '{"id": 1, "texto": "[12:00] [SISTEMA] ana entr\\u00f3."}, {"id": 2, "texto": "[12:00] [SISTEMA] bob sali\\u00f3."}, '
+    '{"id": 3, "texto": "[12:00] \\ud83c\\udf93 [DOCENTE] '
+    '{"id": 4, "texto": "[12:00] \\ud83d\\udc51 [ADMIN] '
+    '"}, {"id": 5, "texto": "[12:'
+).encode("utf-8")
+
+# Contadores globales de compresión (de este proceso)
+estadisticas = {
+    "tramas_comprimidas": 0,
+    "bytes_originales": 0,
+    "bytes_comprimidos": 0,
+    "segundos_cpu": 0.0
+}
+_lock_estadisticas = threading.Lock()
+
+# Autenticación en un solo paso: el cliente envía AUTH:{"v", "op", ...campos} y
+# recibe AUTH_RESULT:{"v", "op", "ok", "mensaje", ...}. Las versiones anteriores
+# usan el diálogo paso a paso con ACK ("l", "r", "rec_req", "rec_reset").
+# Desde la versión 3 el login entrega un token para reanudar la sesión (op
+# "reanudar") y los mensajes de sala llegan como MSG:<id>:<texto>. Desde la 4
+# la lista completa de salas (ROOMS_UPDATE) solo se envía al iniciar sesión; luego
+# llegan los cambios sueltos ROOM_ADDED:{"sala"} y ROOM_REMOVED:{"sala"}. Desde
+# la 5, /join {"sala", "desde"} entra a la sala recibiendo solo lo posterior a desde.
+# Desde la 6 el cliente recibe al entrar PRESENCE_SNAPSHOT:{"usuarios": [...]} y
+# luego solo los cambios PRESENCE_DELTA:{"ev", "id", ...} (entro, salio, movido,
+# rol, silencio), sin volver a pedir la lista completa con /get_users.
+# Desde la 7 el login y "reanudar" pueden pedir "compresion": ["zlib"]; si el
+# servidor la acepta responde "compresion": "zlib" y desde entonces puede enviar
+# tramas TIPO_TEXTO_ZLIB.
+VERSION_AUTH = 7
+VERSION_SALAS_DELTA = 4
+VERSION_JOIN_DESDE = 5
+VERSION_PRESENCIA = 6
+
+class ErrorProtocolo(Exception):
+    """Trama mal formada o demasiado grande"""
+
+def codificar_trama(tipo, cuerpo):
+    """Empaqueta un cuerpo en bytes con su cabecera"""
+    if len(cuerpo) > MAX_TRAMA:
+        raise ErrorProtocolo(f"Trama demasiado grande: {len(cuerpo)} bytes")
+    return CABECERA.pack(len(cuerpo), tipo) + cuerpo
+
+def codificar_texto(texto, comprimir=False):
+    """Trama de texto lista para enviar por el socket. Con comprimir=True las
+    tramas grandes salen como TIPO_TEXTO_ZLIB"""
+    cuerpo = texto.encode("utf-8")
+    if not comprimir or len(cuerpo) < UMBRAL_COMPRESION:
+        return codificar_trama(TIPO_TEXTO, cuerpo)
+    inicio = time.thread_time()
+    compresor = zlib.compressobj(NIVEL_COMPRESION, zdict=DICCIONARIO_ZLIB)
+    comprimido = compresor.compress(cuerpo) + compresor.flush()
+    with _lock_estadisticas:
+        estadisticas["segundos_cpu"] += time.thread_time() - inicio
+        if len(comprimido) < len(cuerpo):
+            estadisticas["tramas_comprimidas"] += 1
+            estadisticas["bytes_originales"] += len(cuerpo)
+            estadisticas["bytes_comprimidos"] += len(comprimido)
+    if len(comprimido) >= len(cuerpo):
+        return codificar_trama(TIPO_TEXTO, cuerpo)
+    return codificar_trama(TIPO_TEXTO_ZLIB, comprimido)
+
+def decodificar_texto(tipo, cuerpo, maximo=MAX_TRAMA):
+    """Texto de una trama TIPO_TEXTO o TIPO_TEXTO_ZLIB (descomprimida, como mucho maximo bytes)"""
+    if tipo == TIPO_TEXTO_ZLIB:
+        descompresor = zlib.decompressobj(zdict=DICCIONARIO_ZLIB)
+        cuerpo = descompresor.decompress(cuerpo, maximo)
+        if descompresor.unconsumed_tail:
+            raise ErrorProtocolo("Trama comprimida demasiado grande")
+    return cuerpo.decode("utf-8")
+
+def leer_cabecera(datos, maximo=MAX_TRAMA):
+    """Desempaqueta y valida una cabecera. Retorna (longitud, tipo)"""
+    longitud, tipo = CABECERA.unpack(datos)
+    if longitud > maximo:
+        raise ErrorProtocolo(f"Trama demasiado grande: {longitud} bytes")
+    return longitud, tipo
+
+class DecodificadorTramas:
+    """Decodificador incremental: se alimenta con lo que devuelva recv() y
+    entrega solo tramas completas. Reutiliza un único buffer por conexión."""
+
+    def __init__(self, maximo=MAX_TRAMA):
+        self._buffer = bytearray()
+        self.maximo = maximo
+
+    def alimentar(self, datos):
+        """Agrega bytes recibidos y retorna la lista de tramas (tipo, cuerpo) completas"""
+        self._buffer += datos
+        tramas = []
+        vista = memoryview(self._buffer)
+        pos = 0
+        total = len(self._buffer)
+        try:
+            while total - pos >= TAM_CABECERA:
+                longitud, tipo = leer_cabecera(vista[pos:pos + TAM_CABECERA], self.maximo)
+                fin = pos + TAM_CABECERA + longitud
+                if fin > total:
+                    break
+                tramas.append((tipo, bytes(vista[pos + TAM_CABECERA:fin])))
+                pos = fin
+        finally:
+            vista.release()
+        if pos:
+            # Compactar: lo consumido se descarta, el resto queda al inicio
+            del self._buffer[:pos]
+        return tramas
+
+    def pendientes(self):
+        """Bytes recibidos que aún no forman una trama completa"""
+        return len(self._buffer)
+
+class LectorTramas:
+    """Lectura bloqueante de tramas sobre un socket (hilos del servidor y cliente).
+    maximo: tamaño máximo de trama aceptado (MAX_TRAMA_ENTRANTE en el servidor)"""
+
+    def __init__(self, sock, tam_lectura=65536, maximo=MAX_TRAMA):
+        self.sock = sock
+        self.tam_lectura = tam_lectura
+        self.maximo = maximo
+        self.decodificador = DecodificadorTramas(maximo)
+        self._cola = deque()
+
+    def recibir(self):
+        """Retorna la siguiente trama (tipo, cuerpo) o None si el socket se cerró"""
+        while not self._cola:
+            datos = self.sock.recv(self.tam_lectura)
+            if not datos:
+                return None
+            self._cola.extend(self.decodificador.alimentar(datos))
+        return self._cola.popleft()
+
+    def recibir_texto(self):
+        """Siguiente trama de texto decodificada, o "" si el socket se cerró"""
+        trama = self.recibir()
+        if trama is None:
+            return ""
+        return decodificar_texto(*trama, self.maximo)
+
+async def leer_trama_async(reader, maximo=MAX_TRAMA):
+    """Lee una trama completa de un StreamReader. Retorna None al cerrar"""
+    try:
+        cabecera = await reader.readexactly(TAM_CABECERA)
+        longitud, tipo = leer_cabecera(cabecera, maximo)
+        cuerpo = await reader.readexactly(longitud)
+    except EOFError:
+        return None
+    return tipo, cuerpo
@@ -0,0 +1,145 @@
+import itertools
+import threading
+
+# --- REGISTRO DE SALAS Y SESIONES ---
+# Quién está conectado y en qué sala. Los miembros de cada sala se guardan
+# como tuplas inmutables que se reemplazan en cada alta o baja (copy-on-write):
+# difundir un mensaje recorre la tupla vigente sin tomar ningún lock, y las
+# modificaciones (login, /join, /borrar, desconexión) se serializan entre sí.
+# Cada sesión lleva un id propio con el que los clientes suscritos a la
+# presencia identifican a quién se refiere cada cambio.
+
+class RegistroSesiones:
+    """Miembros de cada sala y datos de sesión de cada conexión, seguro entre hilos"""
+
+    def __init__(self, nombres_salas=()):
+        self._lock = threading.Lock()
+        self._miembros = {nombre: () for nombre in nombres_salas}   # sala -> tupla de conexiones
+        self._sesiones = {}        # conn -> {"id", "alias", "sala", "rol", "muted", "pending_pin", "ids", "token", "version", "zlib"}
+        self._por_alias = {}       # alias en minúsculas -> set(conn)
+        self._suscritos = ()       # conexiones que reciben los cambios de presencia (copy-on-write)
+        self._ids = itertools.count(1)
+
+    # --- Salas ---
+    def nombres_salas(self):
+        return list(self._miembros)
+
+    def existe_sala(self, sala):
+        return sala in self._miembros
+
+    def miembros(self, sala):
+        """Instantánea de las conexiones de la sala (tupla vacía si no existe)"""
+        return self._miembros.get(sala, ())
+
+    def crear_sala(self, nombre):
+        """Agrega una sala vacía. Retorna False si ya existía"""
+        with self._lock:
+            if nombre in self._miembros:
+                return False
+            self._miembros[nombre] = ()
+            return True
+
+    def eliminar_sala(self, nombre):
+        """Borra la sala y pasa sus miembros a la primera sala restante.
+        Retorna (sala_destino, conexiones movidas), o None si no existe o es la última"""
+        with self._lock:
+            if nombre not in self._miembros or len(self._miembros) <= 1:
+                return None
+            destino = next(s for s in self._miembros if s != nombre)
+            movidos = self._miembros.pop(nombre)
+            self._miembros[destino] = self._miembros[destino] + movidos
+            for c in movidos:
+                self._sesiones[c]["sala"] = destino
+            return destino, movidos
+
+    # --- Sesiones ---
+    def alta(self, conn, alias, rol, sala=None, ids=False, token=None, version=2, zlib=False):
+        """Registra la sesión en la sala pedida (o en la primera si no existe). Retorna sus datos.
+        ids: el cliente recibe los mensajes con su id; token: token de reanudación;
+        version: versión de protocolo del cliente; zlib: acepta tramas comprimidas"""
+        with self._lock:
+            if sala not in self._miembros:
+                sala = next(iter(self._miembros))
+            datos = {"id": next(self._ids), "alias": alias, "sala": sala, "rol": rol, "muted": False,
+                     "pending_pin": None, "ids": ids, "token": token, "version": version, "zlib": zlib}
+            self._sesiones[conn] = datos
+            self._miembros[sala] = self._miembros[sala] + (conn,)
+            self._por_alias.setdefault(alias.lower(), set()).add(conn)
+            return datos
+
+    def baja(self, conn):
+        """Quita la sesión de su sala y del índice de alias. Retorna sus datos o None"""
+        with self._lock:
+            datos = self._sesiones.pop(conn, None)
+            if datos is None:
+                return None
+            self._quitar_de_sala(conn, datos["sala"])
+            if conn in self._suscritos:
+                self._suscritos = tuple(c for c in self._suscritos if c is not conn)
+            clave = datos["alias"].lower()
+            conns = self._por_alias.get(clave)
+            if conns is not None:
+                conns.discard(conn)
+                if not conns:
+                    del self._por_alias[clave]
+            return datos
+
+    def mover(self, conn, sala):
+        """Cambia la sesión de sala. Retorna False si la sala o la sesión no existen"""
+        with self._lock:
+            datos = self._sesiones.get(conn)
+            if datos is None or sala not in self._miembros:
+                return False
+            self._quitar_de_sala(conn, datos["sala"])
+            self._miembros[sala] = self._miembros[sala] + (conn,)
+            datos["sala"] = sala
+            return True
+
+    def _quitar_de_sala(self, conn, sala):
+        """Llamar con self._lock tomado"""
+        actuales = self._miembros.get(sala)
+        if actuales and conn in actuales:
+            self._miembros[sala] = tuple(c for c in actuales if c is not conn)
+
+    def actualizar(self, conn, **campos):
+        """Cambia datos de la sesión (muted, rol). Retorna sus datos o None"""
+        with self._lock:
+            datos = self._sesiones.get(conn)
+            if datos is not None:
+                datos.update(campos)
+            return datos
+
+    def suscribir(self, conn, enviar_lista):
+        """Suscribe la conexión a los cambios de presencia. enviar_lista(usuarios) recibe
+        la lista completa bajo el mismo lock que las altas, bajas y cambios: todo cambio
+        que no esté en la lista llega como delta después de ella"""
+        with self._lock:
+            enviar_lista([datos_presencia(d) for d in self._sesiones.values()])
+            self._suscritos = self._suscritos + (conn,)
+
+    def suscritos(self):
+        """Instantánea de las conexiones suscritas a la presencia"""
+        return self._suscritos
+
+    def sesion(self, conn):
+        """Datos de la sesión, o None si la conexión no está autenticada"""
+        return self._sesiones.get(conn)
+
+    def sesiones(self):
+        """Instantánea [(conn, datos)] de todas las sesiones"""
+        with self._lock:
+            return list(self._sesiones.items())
+
+    def sesiones_de(self, alias, exacto=False):
+        """[(conn, datos)] de las sesiones abiertas del alias, sin recorrer todos los
+        clientes. No distingue mayúsculas salvo con exacto=True"""
+        with self._lock:
+            return [(c, self._sesiones[c]) for c in self._por_alias.get(alias.lower(), ())
+                    if not exacto or self._sesiones[c]["alias"] == alias]
+
+    def __len__(self):
+        return len(self._sesiones)
+
+def datos_presencia(datos):
+    """Lo que ven los demás clientes de una sesión"""
+    return {"id": datos["id"], "alias": datos["alias"], "rol": datos["rol"], "sala": datos["sala"], "muted": datos["muted"]}
@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ia_cliente
+from ia_cliente import ClienteOllama, ServicioNoDisponible
+
+# --- OLLAMA DE PRUEBA ---
+# Servidor HTTP local que imita /api/tags y /api/generate (NDJSON con stream)
+
+class OllamaFalso(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fallar = False          # /api/generate responde 500
+    demora = 0.0            # segundos antes de responder a /api/generate
+    generaciones = 0        # peticiones recibidas en /api/generate con prompt
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, codigo, datos):
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        self._responder(200, {"models": [{"name": "llama3.2:3b"}]})
+
+    def do_POST(self):
+        peticion = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if "prompt" not in peticion:
+            # Precarga del modelo
+            return self._responder(200, {"response": "", "done": True})
+        OllamaFalso.generaciones += 1
+        time.sleep(OllamaFalso.demora)
+        if OllamaFalso.fallar:
+            return self._responder(500, {"error": "modelo caído"})
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        lineas = [{"response": p, "done": False} for p in ("Resumen ", "de ", "prueba.")]
+        lineas.append({"response": "", "done": True, "eval_count": 30, "eval_duration": 1.5e9})
+        for linea in lineas:
+            datos = (json.dumps(linea) + "\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(datos), datos))
+        self.wfile.write(b"0\r\n\r\n")
+
+class PruebaClienteOllama(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ThreadingHTTPServer(("127.0.0.1", 0), OllamaFalso)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.servidor.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+
+    def setUp(self):
+        OllamaFalso.fallar = False
+        OllamaFalso.demora = 0.0
+        OllamaFalso.generaciones = 0
+        self.cliente = ClienteOllama(self.url, fallos_para_abrir=2, espera_reintento=0.3, timeout=(2, 5))
+
+    def test_stream_une_fragmentos_y_mide(self):
+        fragmentos = []
+        texto = self.cliente.generar("hola", al_avanzar=fragmentos.append)
+        self.assertEqual(texto, "Resumen de prueba.")
+        self.assertEqual(fragmentos, ["Resumen ", "de ", "prueba."])
+        self.assertEqual(ia_cliente.estadisticas["tokens_ultima"], 30)
+        self.assertAlmostEqual(ia_cliente.estadisticas["tokens_por_seg_ultima"], 20.0)
+        self.assertEqual(self.cliente.estado(), "disponible")
+
+    def test_circuito_abre_tras_fallos(self):
+        OllamaFalso.fallar = True
+        for _ in range(2):
+            with self.assertRaises(Exception) as error:
+                self.cliente.generar("hola")
+            self.assertNotIsInstance(error.exception, ServicioNoDisponible)
+        self.assertEqual(self.cliente.estado(), "caído")
+        with self.assertRaises(ServicioNoDisponible):
+            self.cliente.generar("hola")
+        self.assertEqual(OllamaFalso.generaciones, 2)
+
+    def test_una_llamada_de_prueba_y_sondeo_cierra(self):
+        OllamaFalso.fallar = True
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.cliente.generar("hola")
+        time.sleep(0.35)
+        self.assertEqual(self.cliente.estado(), "probando")
+
+        # Mientras la llamada de prueba sigue en curso, las demás se rechazan sin conectar
+        OllamaFalso.demora = 0.3
+        prueba = threading.Thread(target=lambda: self.assertRaises(Exception, self.cliente.generar, "hola"))
+        prueba.start()
+        time.sleep(0.1)
+        with self.assertRaises(ServicioNoDisponible):
+            self.cliente.generar("hola")
+        prueba.join()
+        self.assertEqual(OllamaFalso.generaciones, 3)
+
+        # La prueba falló: el circuito sigue abierto hasta que un sondeo lo cierra
+        self.assertEqual(self.cliente.estado(), "caído")
+        self.assertTrue(self.cliente.sondear())
+        self.assertEqual(self.cliente.estado(), "disponible")
+        OllamaFalso.fallar = False
+        OllamaFalso.demora = 0.0
+        self.assertEqual(self.cliente.generar("hola"), "Resumen de prueba.")
+
+if __name__ == "__main__":
+    unittest.main()